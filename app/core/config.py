@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,6 +7,60 @@ class Settings(BaseSettings):
     # 数据库
     DATABASE_URL: str = "sqlite+aiosqlite:///./chat.db"
 
+    # SQLite 性能配置 (每个新连接建立时以 PRAGMA 形式下发)
+    SQLITE_JOURNAL_MODE: str = "WAL"  # WAL 模式下读写互不阻塞
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL + NORMAL 只在 checkpoint 时 fsync
+    SQLITE_MMAP_SIZE: int = 268435456  # 256MB，0 表示关闭内存映射
+    SQLITE_CACHE_SIZE: int = -65536  # 负数单位为 KiB，即每个连接约 64MB 页缓存
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # 遇到写锁时最多等待的毫秒数，而不是立即报错
+
+    # 异步引擎连接池
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+
+    # 消息写入合并 (write-behind 组提交)，默认关闭
+    WRITE_BEHIND_ENABLED: bool = False
+    WRITE_BEHIND_FLUSH_INTERVAL_MS: int = 5  # 收到第一条写入后最多等待多久再提交
+    WRITE_BEHIND_MAX_BATCH: int = 64  # 单个事务最多合并的写入项数
+    WRITE_BEHIND_QUEUE_SIZE: int = 1024  # 队列上限，写满后写入方将等待 (背压)
+
+    # 进程内会话缓存 (默认关闭，保持 SessionManager 无状态)
+    SESSION_CACHE_ENABLED: bool = False
+    SESSION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 按消息内容估算的内存上限
+
+    # 模型回复缓存 (上下文完全相同的请求直接返回缓存)，默认关闭
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024  # 内存层最多缓存的回复条数
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600
+    RESPONSE_CACHE_PERSISTENT: bool = False  # 同时写入数据库，重启后依然有效
+
+    # 合并同时进行中的相同请求 (相同模型与上下文只向上游发送一次)
+    LLM_SINGLE_FLIGHT_ENABLED: bool = True
+
+    # 流式接口的 SSE 帧合并：攒够时间/字节数或遇到句末标点时才下发一帧
+    SSE_COALESCE_MAX_DELAY_MS: int = 40  # 0 表示不合并，每个增量一帧
+    SSE_COALESCE_MAX_BYTES: int = 256
+
+    # LLM Provider 熔断与健康检查
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5  # 连续失败多少次后熔断
+    LLM_BREAKER_RESET_SECONDS: float = 30.0  # 熔断后多久放行探测请求 (半开)
+    LLM_HEALTH_CHECK_INTERVAL: float = 30.0  # 后台健康检查间隔，0 表示关闭
+    LLM_HEALTH_CHECK_TIMEOUT: float = 5.0
+
+    # LLM Provider 的 HTTP 连接池 (每个 Provider 一个长连接客户端)
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    # 最多保留的空闲长连接数，超出的连接用完即关闭；只作用于 httpx 连接池 (HTTP/2 与 OpenAI 兼容直连)，
+    # aiohttp 会话只受 LLM_HTTP_MAX_CONNECTIONS 限制
+    LLM_HTTP_MAX_KEEPALIVE: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0  # 空闲长连接的保留秒数
+    LLM_HTTP2: bool = True  # 需要安装 h2，未安装时自动退回 HTTP/1.1
+    LLM_HTTP_TIMEOUT: float = 600.0
+    LLM_HTTP_CONNECT_TIMEOUT: float = 10.0
+
+    # 小沪首 token 超过该毫秒数仍未到达时向备用模型发起对冲请求 (额外付费)，0 表示不对冲
+    XIAOHU_HEDGE_AFTER_MS: int = 0
+
     # API Keys
     DEEPSEEK_API_KEY: str = ""
     CHATGPT_API_KEY: str = ""
@@ -15,6 +71,34 @@ class Settings(BaseSettings):
     TTS_API_BASE: str = ""
     SHANGHAI_ASR_URL: str = ""
 
+    # TTS 服务的 HTTP 连接池 (合成、下载与音频代理共用)
+    TTS_HTTP_MAX_CONNECTIONS: int = 32
+    TTS_HTTP_MAX_KEEPALIVE: int = 16
+    TTS_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    # 请求合成时是否使用 HTTP(S)_PROXY 等环境变量中的代理；TTS 服务在内网且需要绕过系统代理时设为 False
+    TTS_HTTP_TRUST_ENV: bool = True
+    # 下载音频 (缓存与音频代理) 时是否使用系统代理，默认绕过；与上一项相同时两者共用一个连接池
+    TTS_AUDIO_TRUST_ENV: bool = False
+
+    # 流式语音：同时合成的句子数上限
+    TTS_MAX_PARALLEL: int = 2
+
+    # 语音缓存：按 (文本, 合成参数) 的哈希保存在本地磁盘，超过容量时按 LRU 淘汰
+    TTS_CACHE_ENABLED: bool = True
+    TTS_CACHE_DIR: str = "./tts_cache"
+    TTS_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    # 启动时预先合成的语句 (小沪的开场白会自动加入)
+    TTS_PRESYNTH_PHRASES: List[str] = []
+
+    # 语音转码 (wav -> Opus/MP3，需要 ffmpeg)：客户端通过 Accept 头或 format 参数选择格式，
+    # 结果与源音频一起保存在语音缓存中
+    TTS_TRANSCODE_ENABLED: bool = True
+    TTS_TRANSCODE_WORKERS: int = 2
+    TTS_OPUS_BITRATE: str = "24k"
+    TTS_MP3_BITRATE: str = "48k"
+    # 音频代理转码时最多缓冲的源文件大小，超过时直接流式转发原始 wav
+    TTS_TRANSCODE_MAX_BYTES: int = 16 * 1024 * 1024
+
     # 阿里云 ASR
     ALI_ASR_URL: str = ""
     ALI_ASR_APPKEY: str = ""
@@ -36,6 +36,11 @@ def get_all_models() -> List[Union[APIConfig, OllamaConfig]]:
             system_prompt=XIAOHU_PROMPT,  # 注入人设
             greeting="侬好！我是上海大学的小沪，很高兴和侬用上海话聊天。有什么我可以帮侬的吗？",
             temperature=0.7,
+            summary_trigger_tokens=6000,  # 长对话在后台滚动摘要，控制 Prompt 大小
+            # DeepSeek 出错时切换到 GPT (未配置 CHATGPT_API_KEY 时不启用)；
+            # 对冲会为慢请求额外付费调用一次 GPT，默认关闭，通过 XIAOHU_HEDGE_AFTER_MS 开启
+            fallback_models=["gpt-4o-mini"],
+            hedge_after_ms=settings.XIAOHU_HEDGE_AFTER_MS,
         ),
         # 基础大模型 - ChatGPT
         APIConfig(
@@ -50,6 +55,7 @@ def get_all_models() -> List[Union[APIConfig, OllamaConfig]]:
             endpoint="",
             temperature=0.7,
             max_tokens=8192,
+            max_context_tokens=65536,
         ),
         # 本地基础模型 - Ollama
         OllamaConfig(
@@ -57,5 +63,8 @@ def get_all_models() -> List[Union[APIConfig, OllamaConfig]]:
             model_desc="本地 Ollama 模型",
             endpoint=settings.OLLAMA_ENDPOINT,
             temperature=0.7,
+            max_context_tokens=4096,  # 本地小模型上下文窗口较小
+            max_concurrency=2,  # 本地推理资源有限，超出部分排队，队列满时返回 503
+            max_queue_size=8,
         ),
     ]
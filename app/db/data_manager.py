@@ -1,26 +1,183 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import select, update, delete, func, event
-from typing import List, Optional
+from sqlalchemy import select, update, delete, func, event, literal_column, or_, and_
+from sqlalchemy.engine import make_url
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
-from app.schemas.chat import Session, Message
-from app.db.models import Base, SessionModel, MessageModel
+from app.schemas.chat import (
+    Session,
+    Message,
+    SessionSummary,
+    UsageStats,
+    ConversationSummary,
+)
+from app.db.models import (
+    Base,
+    SessionModel,
+    MessageModel,
+    ConversationSummaryModel,
+    ResponseCacheModel,
+)
+from app.db.migrations import run_migrations
 from app.core.logger import log
+from app.core.config import settings
+
+# SQLite 隐式行号，作为同一秒内多条消息的稳定次排序键 (也即插入顺序)
+MESSAGE_ROWID = literal_column("messages.rowid")
+
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def default_sqlite_pragmas() -> Dict[str, Any]:
+    """从全局 Settings 中读取 SQLite 性能配置"""
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+    }
+
+
+def _build_pragma_statements(pragmas: Dict[str, Any]) -> List[str]:
+    """校验配置并生成 PRAGMA 语句 (PRAGMA 不支持参数绑定，因此先做白名单校验)"""
+    statements = []
+    for name, value in pragmas.items():
+        if value is None:
+            continue
+        if name == "journal_mode":
+            value = str(value).upper()
+            if value not in _JOURNAL_MODES:
+                raise ValueError(f"Unsupported SQLite journal_mode: {value}")
+        elif name == "synchronous":
+            value = str(value).upper()
+            if value not in _SYNCHRONOUS_LEVELS:
+                raise ValueError(f"Unsupported SQLite synchronous level: {value}")
+        elif name in ("mmap_size", "cache_size", "busy_timeout"):
+            value = int(value)
+        else:
+            raise ValueError(f"Unsupported SQLite pragma: {name}")
+        statements.append(f"PRAGMA {name}={value}")
+    return statements
+
+
+# 读路径只选取需要的列，返回普通的行元组，绕开 ORM 对象构造与 identity map
+_MESSAGE_COLUMNS = (
+    MessageModel.message_id,
+    MessageModel.role,
+    MessageModel.content,
+    MessageModel.timestamp,
+    # 持久化的 token 数让上下文构建无需重新分词历史消息
+    MessageModel.token_count,
+)
+_SESSION_COLUMNS = (
+    SessionModel.session_id,
+    SessionModel.model_name,
+    SessionModel.create_time,
+    SessionModel.update_time,
+)
+
+
+class AppendResult(NamedTuple):
+    """追加消息的写入结果"""
+
+    # 写入后会话的 update_time (会话版本号)
+    version: int
+    # 本次写入之前该会话已有的消息条数，供上层缓存判断自己是否错过了其他进程的写入
+    prior_count: int
+
+
+def _row_to_message(row) -> Message:
+    """数据库中的数据已经过校验，使用 model_construct 跳过 Pydantic 的重复校验"""
+    return Message.model_construct(
+        message_id=row.message_id,
+        role=row.role,
+        content=row.content,
+        timestamp=row.timestamp,
+        token_count=row.token_count,
+    )
+
+
+def _message_to_model(session_id: str, message: Message) -> MessageModel:
+    """将 Pydantic 消息转换为 ORM 对象 (含用量统计列)"""
+    return MessageModel(
+        message_id=message.message_id,
+        session_id=session_id,
+        role=message.role,
+        content=message.content,
+        timestamp=message.timestamp,
+        token_count=message.token_count,
+        model=message.model,
+        latency_ms=message.latency_ms,
+        prompt_tokens=message.prompt_tokens,
+        completion_tokens=message.completion_tokens,
+        cached_tokens=message.cached_tokens,
+    )
+
+
+def _row_to_session(row) -> Session:
+    return Session.model_construct(
+        session_id=row.session_id,
+        model_name=row.model_name,
+        created_at=row.create_time,
+        updated_at=row.update_time,
+        messages=[],  # 历史消息采用懒加载策略
+    )
+
+
+def _bump_update_time(timestamp: int):
+    """
+    update_time 同时充当会话的版本号 (用于 ETag 等)，因此每次写入必须严格递增：
+    取 max(原值 + 1, 新时间戳)，避免同一秒内的两次写入得到相同版本
+    """
+    return func.max(SessionModel.update_time + 1, timestamp)
 
 
 class DataManager:
-    def __init__(self, db_url: str = "sqlite+aiosqlite:///./chat.db"):
+    def __init__(
+        self,
+        db_url: str = "sqlite+aiosqlite:///./chat.db",
+        pragmas: Optional[Dict[str, Any]] = None,
+        pool_size: Optional[int] = None,
+        max_overflow: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+    ):
         """
         初始化数据库引擎
         :param db_url: 数据库连接字符串，默认使用当前目录下的 chat.db
+        :param pragmas: SQLite 性能配置 (journal_mode / synchronous / mmap_size /
+                        cache_size / busy_timeout)，为 None 时读取 Settings
+        :param pool_size / max_overflow / pool_timeout: 连接池大小，为 None 时读取 Settings
         """
+        url = make_url(db_url)
+        engine_kwargs: Dict[str, Any] = {}
+
+        # 内存数据库使用 StaticPool，只有文件数据库才需要配置连接池
+        if url.database not in (None, "", ":memory:"):
+            engine_kwargs["pool_size"] = (
+                pool_size if pool_size is not None else settings.DB_POOL_SIZE
+            )
+            engine_kwargs["max_overflow"] = (
+                max_overflow if max_overflow is not None else settings.DB_MAX_OVERFLOW
+            )
+            engine_kwargs["pool_timeout"] = (
+                pool_timeout if pool_timeout is not None else settings.DB_POOL_TIMEOUT
+            )
+
         # 创建异步引擎 (echo=False 关闭原生 SQL 打印，如果需要调试可以设为 True)
-        self.engine = create_async_engine(db_url, echo=False)
+        self.engine = create_async_engine(db_url, echo=False, **engine_kwargs)
+
+        self._pragma_statements = _build_pragma_statements(
+            default_sqlite_pragmas() if pragmas is None else pragmas
+        )
 
-        # 开启 SQLite 外键约束
+        # 开启 SQLite 外键约束，并下发性能相关的 PRAGMA
         @event.listens_for(self.engine.sync_engine, "connect")
         def enable_sqlite_fk(dbapi_connection, connection_record):
             cursor = dbapi_connection.cursor()
             cursor.execute("PRAGMA foreign_keys=ON")
+            for statement in self._pragma_statements:
+                cursor.execute(statement)
             cursor.close()
 
         # 创建异步会话工厂 (替代 C++ 中每次操作创建的 sqlite 句柄)
@@ -33,7 +190,9 @@ class DataManager:
         async with self.engine.begin() as conn:
             # SQLAlchemy 会自动检测表是否存在，并创建表
             await conn.run_sync(Base.metadata.create_all)
-        log.info("DataManager: 数据库表初始化完成")
+            # create_all 不会改动已存在的表，索引等结构变更交给版本化迁移补齐
+            version = await conn.run_sync(run_migrations)
+        log.info(f"DataManager: 数据库表初始化完成 (schema v{version})")
 
     # Session 相关的 CRUD 操作
     async def insert_session(self, session: Session) -> bool:
@@ -51,35 +210,73 @@ class DataManager:
             log.info(f"DataManager: Insert session success: {session.session_id}")
             return True
 
+    async def create_session_with_greeting(
+        self, session: Session, greeting: Optional[Message] = None
+    ) -> bool:
+        """在同一个事务中插入会话及其开场白消息"""
+        async with self.async_session_maker() as db_session:
+            async with db_session.begin():
+                db_session.add(
+                    SessionModel(
+                        session_id=session.session_id,
+                        model_name=session.model_name,
+                        create_time=session.created_at,
+                        update_time=(
+                            max(session.updated_at, greeting.timestamp)
+                            if greeting
+                            else session.updated_at
+                        ),
+                    )
+                )
+                # 先 flush 会话行，保证开场白插入时外键约束已满足
+                await db_session.flush()
+                if greeting:
+                    db_session.add(_message_to_model(session.session_id, greeting))
+            log.info(f"DataManager: Insert session success: {session.session_id}")
+            return True
+
     async def get_session(self, session_id: str) -> Optional[Session]:
         """获取指定 sessionId 的会话信息"""
         async with self.async_session_maker() as db_session:
             # 替代 C++: SELECT * FROM sessions WHERE session_id = ?
-            stmt = select(SessionModel).where(SessionModel.session_id == session_id)
+            stmt = select(*_SESSION_COLUMNS).where(SessionModel.session_id == session_id)
             result = await db_session.execute(stmt)
-            db_obj = result.scalar_one_or_none()
+            row = result.first()
 
-            if db_obj:
+            if row:
                 # 转换回 Pydantic 对象返回
-                return Session(
-                    session_id=db_obj.session_id,
-                    model_name=db_obj.model_name,
-                    created_at=db_obj.create_time,
-                    updated_at=db_obj.update_time,
-                    messages=[],  # 历史消息采用懒加载策略
-                )
+                return _row_to_session(row)
 
             log.warning(f"DataManager.get_session: Session not found: {session_id}")
             return None
 
+    async def get_session_version(self, session_id: str) -> Optional[int]:
+        """
+        只读取会话的 update_time (即会话版本号)，不加载任何消息
+        :return: 会话不存在时为 None
+        """
+        async with self.async_session_maker() as db_session:
+            stmt = select(SessionModel.update_time).where(
+                SessionModel.session_id == session_id
+            )
+            return (await db_session.execute(stmt)).scalar_one_or_none()
+
+    async def get_session_model_name(self, session_id: str) -> Optional[str]:
+        """只读取会话所属的模型名称，会话不存在时为 None"""
+        async with self.async_session_maker() as db_session:
+            stmt = select(SessionModel.model_name).where(
+                SessionModel.session_id == session_id
+            )
+            return (await db_session.execute(stmt)).scalar_one_or_none()
+
     async def update_session_timestamp(self, session_id: str, timestamp: int) -> bool:
-        """更新指定会话的时间戳"""
+        """更新指定会话的时间戳 (update_time 即会话版本号，只会严格递增，不会回退)"""
         async with self.async_session_maker() as db_session:
             # 替代 C++: UPDATE sessions SET update_time = ? WHERE session_id = ?
             stmt = (
                 update(SessionModel)
                 .where(SessionModel.session_id == session_id)
-                .values(update_time=timestamp)
+                .values(update_time=_bump_update_time(timestamp))
             )
 
             await db_session.execute(stmt)
@@ -98,19 +295,68 @@ class DataManager:
     async def get_all_sessions(self) -> List[Session]:
         """获取所有session信息，并按照更新时间降序排列"""
         async with self.async_session_maker() as db_session:
-            stmt = select(SessionModel).order_by(SessionModel.update_time.desc())
+            stmt = select(*_SESSION_COLUMNS).order_by(SessionModel.update_time.desc())
             result = await db_session.execute(stmt)
-            db_sessions = result.scalars().all()
+            return [_row_to_session(row) for row in result]
+
+    async def get_session_summaries(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> List[SessionSummary]:
+        """
+        获取会话列表摘要 (按更新时间降序)
+        消息条数与第一条用户消息通过关联子查询在同一条 SQL 中算出，
+        避免为每个会话加载全部消息 (N+1 查询)
+        :param limit: 最多返回的条数，None 表示不限制
+        :param offset: 跳过的条数，配合 limit 分页
+        """
+        # SELECT count(*) FROM messages WHERE messages.session_id = sessions.session_id
+        message_count = (
+            select(func.count(MessageModel.message_id))
+            .where(MessageModel.session_id == SessionModel.session_id)
+            .correlate(SessionModel)
+            .scalar_subquery()
+        )
+        # 会话中最早的一条用户消息
+        first_user_message = (
+            select(MessageModel.content)
+            .where(
+                MessageModel.session_id == SessionModel.session_id,
+                MessageModel.role == "user",
+            )
+            .order_by(MessageModel.timestamp.asc())
+            .limit(1)
+            .correlate(SessionModel)
+            .scalar_subquery()
+        )
+
+        stmt = (
+            select(
+                SessionModel.session_id,
+                SessionModel.model_name,
+                SessionModel.create_time,
+                SessionModel.update_time,
+                message_count.label("message_count"),
+                first_user_message.label("first_user_message"),
+            )
+            # 追加 session_id 作为次排序键，保证分页结果稳定
+            .order_by(SessionModel.update_time.desc(), SessionModel.session_id)
+            .offset(offset)
+        )
+        if limit is not None:
+            stmt = stmt.limit(limit)
 
+        async with self.async_session_maker() as db_session:
+            result = await db_session.execute(stmt)
             return [
-                Session(
-                    session_id=obj.session_id,
-                    model_name=obj.model_name,
-                    created_at=obj.create_time,
-                    updated_at=obj.update_time,
-                    messages=[],  # 依然保持为空，懒加载
+                SessionSummary(
+                    session_id=row.session_id,
+                    model_name=row.model_name,
+                    created_at=row.create_time,
+                    updated_at=row.update_time,
+                    message_count=row.message_count or 0,
+                    first_user_message=row.first_user_message,
                 )
-                for obj in db_sessions
+                for row in result
             ]
 
     async def clear_all_sessions(self) -> bool:
@@ -139,20 +385,13 @@ class DataManager:
         async with self.async_session_maker() as db_session:
             async with db_session.begin():  # 开启数据库事务
                 # 插入消息
-                msg_obj = MessageModel(
-                    message_id=message.message_id,
-                    session_id=session_id,
-                    role=message.role,
-                    content=message.content,
-                    timestamp=message.timestamp,
-                )
-                db_session.add(msg_obj)
+                db_session.add(_message_to_model(session_id, message))
 
                 # 更新会话时间戳
                 update_stmt = (
                     update(SessionModel)
                     .where(SessionModel.session_id == session_id)
-                    .values(update_time=message.timestamp)
+                    .values(update_time=_bump_update_time(message.timestamp))
                 )
 
                 await db_session.execute(update_stmt)
@@ -161,25 +400,260 @@ class DataManager:
             log.info(f"DataManager: Insert message success: {message.message_id}")
             return True
 
-    async def get_session_messages(self, session_id: str) -> List[Message]:
-        """获取会话中的所有消息"""
+    async def write_message_batch(
+        self, items: List[Tuple[str, List[Message]]]
+    ) -> List[Optional[AppendResult]]:
+        """
+        在同一个事务中批量写入多个会话的消息 (组提交，一次 fsync)
+        每一项会先更新会话时间戳，会话不存在时跳过该项的消息插入
+        :param items: [(session_id, [Message, ...]), ...]
+        :return: 与 items 一一对应的 AppendResult，会话不存在时为 None
+        """
+        results: List[Optional[AppendResult]] = []
         async with self.async_session_maker() as db_session:
-            # 替代 : SELECT * FROM messages ORDER BY timestamp ASC
-            stmt = (
-                select(MessageModel)
-                .where(MessageModel.session_id == session_id)
-                .order_by(MessageModel.timestamp.asc())
+            async with db_session.begin():
+                for session_id, messages in items:
+                    if not messages:
+                        results.append(None)
+                        continue
+
+                    # 写入前的消息条数 (走 session_id 复合索引，只扫描索引)
+                    prior_count = (
+                        select(func.count())
+                        .select_from(MessageModel)
+                        .where(MessageModel.session_id == session_id)
+                        .scalar_subquery()
+                    )
+                    # UPDATE ... RETURNING 同时完成时间戳更新与会话存在性检查
+                    update_stmt = (
+                        update(SessionModel)
+                        .where(SessionModel.session_id == session_id)
+                        .values(
+                            update_time=_bump_update_time(
+                                max(m.timestamp for m in messages)
+                            )
+                        )
+                        .returning(SessionModel.update_time, prior_count)
+                    )
+                    row = (await db_session.execute(update_stmt)).first()
+                    if row is None:
+                        log.warning(
+                            f"DataManager.write_message_batch: Session not found: {session_id}"
+                        )
+                        results.append(None)
+                        continue
+
+                    db_session.add_all(
+                        _message_to_model(session_id, m) for m in messages
+                    )
+                    results.append(AppendResult(version=row[0], prior_count=row[1]))
+
+        return results
+
+    async def append_messages(
+        self, session_id: str, messages: List[Message]
+    ) -> Optional[AppendResult]:
+        """
+        追加消息的融合写入路径：会话存在性检查、插入一条或多条消息、更新会话时间戳
+        在同一个事务中完成，只需一次往返与一次提交
+        :return: 写入结果 (新的会话版本号等)，会话不存在时为 None
+        """
+        return (await self.write_message_batch([(session_id, messages)]))[0]
+
+    async def append_exchange(
+        self,
+        session_id: str,
+        user_msg: Message,
+        assistant_msg: Optional[Message] = None,
+    ) -> Optional[AppendResult]:
+        """一次性写入一轮对话 (用户提问 + 助手回复)，回复为空时只写入提问"""
+        messages = [user_msg] if assistant_msg is None else [user_msg, assistant_msg]
+        return await self.append_messages(session_id, messages)
+
+    # 会话摘要相关操作
+    async def get_conversation_summary(
+        self, session_id: str
+    ) -> Optional[ConversationSummary]:
+        """获取会话的滚动摘要，不存在时为 None"""
+        async with self.async_session_maker() as db_session:
+            db_obj = await db_session.get(ConversationSummaryModel, session_id)
+            if db_obj is None:
+                return None
+            return ConversationSummary(
+                session_id=db_obj.session_id,
+                content=db_obj.content,
+                covered_until_message_id=db_obj.covered_until_message_id,
+                covered_count=db_obj.covered_count,
+                token_count=db_obj.token_count,
+                created_at=db_obj.created_at,
             )
 
-            result = await db_session.execute(stmt)
-            db_messages = result.scalars().all()
+    async def save_conversation_summary(self, summary: ConversationSummary) -> bool:
+        """保存 (覆盖) 会话的滚动摘要，会话已被删除时返回 False"""
+        async with self.async_session_maker() as db_session:
+            async with db_session.begin():
+                exists = await db_session.get(SessionModel, summary.session_id)
+                if exists is None:
+                    return False
+                await db_session.merge(
+                    ConversationSummaryModel(
+                        session_id=summary.session_id,
+                        content=summary.content,
+                        covered_until_message_id=summary.covered_until_message_id,
+                        covered_count=summary.covered_count,
+                        token_count=summary.token_count,
+                        created_at=summary.created_at,
+                    )
+                )
+        log.info(
+            f"DataManager: Save summary for {summary.session_id} "
+            f"(covers {summary.covered_count} messages)"
+        )
+        return True
+
+    # 回复缓存相关操作
+    async def get_cached_response(
+        self, cache_key: str, now: int
+    ) -> Optional[Tuple[str, int]]:
+        """读取未过期的缓存回复 (内容, 过期时间戳)，不存在或已过期时为 None"""
+        async with self.async_session_maker() as db_session:
+            stmt = select(ResponseCacheModel.content, ResponseCacheModel.expires_at).where(
+                ResponseCacheModel.cache_key == cache_key,
+                ResponseCacheModel.expires_at > now,
+            )
+            row = (await db_session.execute(stmt)).first()
+            return (row.content, row.expires_at) if row else None
+
+    async def save_cached_response(
+        self, cache_key: str, model_name: str, content: str, now: int, expires_at: int
+    ):
+        """保存 (覆盖) 一条缓存回复"""
+        async with self.async_session_maker() as db_session:
+            async with db_session.begin():
+                await db_session.merge(
+                    ResponseCacheModel(
+                        cache_key=cache_key,
+                        model_name=model_name,
+                        content=content,
+                        created_at=now,
+                        expires_at=expires_at,
+                    )
+                )
+
+    async def purge_expired_responses(self, now: int) -> int:
+        """删除已过期的缓存回复，返回删除的条数"""
+        async with self.async_session_maker() as db_session:
+            async with db_session.begin():
+                result = await db_session.execute(
+                    delete(ResponseCacheModel).where(ResponseCacheModel.expires_at <= now)
+                )
+        return result.rowcount
+
+    async def get_usage_stats(
+        self,
+        group_by: str = "model",
+        since: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[UsageStats]:
+        """
+        按模型或会话聚合助手回复的 token 用量与耗时，按总 token 数降序排列
+        :param group_by: "model" 或 "session"
+        :param since: 只统计该时间戳之后的消息
+        :param limit: 最多返回的分组数
+        """
+        if group_by == "model":
+            key = MessageModel.model
+        elif group_by == "session":
+            key = MessageModel.session_id
+        else:
+            raise ValueError(f"Unsupported group_by: {group_by}")
 
+        total_tokens = func.coalesce(func.sum(MessageModel.prompt_tokens), 0) + func.coalesce(
+            func.sum(MessageModel.completion_tokens), 0
+        )
+        stmt = (
+            select(
+                key.label("key"),
+                func.count(MessageModel.message_id).label("message_count"),
+                func.coalesce(func.sum(MessageModel.prompt_tokens), 0).label("prompt_tokens"),
+                func.coalesce(func.sum(MessageModel.completion_tokens), 0).label(
+                    "completion_tokens"
+                ),
+                func.coalesce(func.sum(MessageModel.cached_tokens), 0).label("cached_tokens"),
+                func.coalesce(func.avg(MessageModel.latency_ms), 0).label("avg_latency_ms"),
+                func.coalesce(func.max(MessageModel.latency_ms), 0).label("max_latency_ms"),
+            )
+            # 只有带模型信息的助手回复才有用量数据
+            .where(MessageModel.model.is_not(None))
+            .group_by(key)
+            .order_by(total_tokens.desc())
+        )
+        if since is not None:
+            stmt = stmt.where(MessageModel.timestamp >= since)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+
+        async with self.async_session_maker() as db_session:
+            result = await db_session.execute(stmt)
             return [
-                Message(
-                    message_id=msg.message_id,
-                    role=msg.role,
-                    content=msg.content,
-                    timestamp=msg.timestamp,
+                UsageStats(
+                    key=row.key,
+                    message_count=row.message_count,
+                    prompt_tokens=row.prompt_tokens,
+                    completion_tokens=row.completion_tokens,
+                    cached_tokens=row.cached_tokens,
+                    avg_latency_ms=float(row.avg_latency_ms),
+                    max_latency_ms=row.max_latency_ms,
                 )
-                for msg in db_messages
+                for row in result
             ]
+
+    async def get_session_messages(
+        self,
+        session_id: str,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Message]:
+        """
+        获取会话中的消息，支持基于游标 (keyset) 的增量分页
+        :param after: 游标，可以是消息 ID，也可以是纯数字的时间戳；只返回其后的消息
+        :param limit: 最多返回的条数，None 表示不限制
+        :raises ValueError: 游标是消息 ID 但在该会话中不存在
+        """
+        async with self.async_session_maker() as db_session:
+            # 替代 : SELECT * FROM messages ORDER BY timestamp ASC
+            stmt = (
+                select(*_MESSAGE_COLUMNS)
+                .where(MessageModel.session_id == session_id)
+                .order_by(MessageModel.timestamp.asc(), MESSAGE_ROWID.asc())
+            )
+
+            if after is not None:
+                if after.isdigit():
+                    # 时间戳游标：严格晚于该时间的消息
+                    stmt = stmt.where(MessageModel.timestamp > int(after))
+                else:
+                    # 消息 ID 游标：按 (timestamp, rowid) 定位，同一秒内的消息也不会漏读
+                    cursor_stmt = select(MessageModel.timestamp, MESSAGE_ROWID).where(
+                        MessageModel.session_id == session_id,
+                        MessageModel.message_id == after,
+                    )
+                    cursor = (await db_session.execute(cursor_stmt)).first()
+                    if cursor is None:
+                        raise ValueError(f"Unknown message cursor: {after}")
+                    cursor_ts, cursor_rowid = cursor
+                    stmt = stmt.where(
+                        or_(
+                            MessageModel.timestamp > cursor_ts,
+                            and_(
+                                MessageModel.timestamp == cursor_ts,
+                                MESSAGE_ROWID > cursor_rowid,
+                            ),
+                        )
+                    )
+
+            if limit is not None:
+                stmt = stmt.limit(limit)
+
+            result = await db_session.execute(stmt)
+            return [_row_to_message(row) for row in result]
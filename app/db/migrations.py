@@ -0,0 +1,85 @@
+"""
+轻量级的版本化 Schema 迁移
+Base.metadata.create_all 只会创建缺失的表，不会给已存在的 chat.db 补建索引或新增列，
+因此所有结构变更都登记在 MIGRATIONS 中，按版本号顺序执行。
+当前版本号记录在 SQLite 自带的 PRAGMA user_version 中。
+
+新增迁移时：追加一个 (版本号, 描述, 迁移函数)，版本号必须递增，
+迁移函数需要保证幂等 (新库已由 create_all 建好最新结构，迁移会再执行一遍)。
+"""
+
+from typing import Callable, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.core.logger import log
+
+
+def _create_message_session_index(conn: Connection):
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_session_id_timestamp "
+            "ON messages (session_id, timestamp)"
+        )
+    )
+
+
+def _create_session_update_time_index(conn: Connection):
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_sessions_update_time_desc "
+            "ON sessions (update_time DESC, session_id, model_name, create_time)"
+        )
+    )
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl_type: str):
+    """SQLite 的 ADD COLUMN 不支持 IF NOT EXISTS，先查询表结构再决定是否添加"""
+    existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _add_message_usage_columns(conn: Connection):
+    for column, ddl_type in (
+        ("token_count", "INTEGER"),
+        ("model", "VARCHAR"),
+        ("latency_ms", "INTEGER"),
+        ("prompt_tokens", "INTEGER"),
+        ("completion_tokens", "INTEGER"),
+        ("cached_tokens", "INTEGER"),
+    ):
+        _add_column_if_missing(conn, "messages", column, ddl_type)
+
+
+# (版本号, 描述, 迁移函数)
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "messages(session_id, timestamp) 复合索引", _create_message_session_index),
+    (2, "sessions(update_time DESC) 覆盖索引", _create_session_update_time_index),
+    (3, "messages 新增 token 数、模型、耗时等用量列", _add_message_usage_columns),
+]
+
+
+def get_schema_version(conn: Connection) -> int:
+    """读取数据库当前的 Schema 版本号"""
+    return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def run_migrations(conn: Connection) -> int:
+    """
+    执行所有尚未应用的迁移，返回迁移后的版本号
+    需要在同一个事务中调用 (conn.run_sync)，任一迁移失败都会整体回滚
+    """
+    current = get_schema_version(conn)
+
+    for version, desc, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        log.info(f"DataManager: 执行数据库迁移 v{version}: {desc}")
+        migrate(conn)
+        # PRAGMA 不支持参数绑定，版本号来自上方常量，可以安全拼接
+        conn.execute(text(f"PRAGMA user_version = {version}"))
+        current = version
+
+    return current
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, ForeignKey
+from sqlalchemy import Column, String, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 
@@ -20,6 +20,17 @@ class SessionModel(Base):
         "MessageModel", back_populates="session", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # 会话列表按 update_time 降序读取，索引覆盖列表所需的全部列，避免回表
+        Index(
+            "ix_sessions_update_time_desc",
+            update_time.desc(),
+            "session_id",
+            "model_name",
+            "create_time",
+        ),
+    )
+
 
 class MessageModel(Base):
     __tablename__ = "messages"
@@ -33,5 +44,48 @@ class MessageModel(Base):
     content = Column(String, nullable=False)
     timestamp = Column(Integer, nullable=False)
 
+    # 用量统计 (旧数据与用户消息中的模型用量字段为空)
+    token_count = Column(Integer, nullable=True)  # 消息内容本身的 token 数
+    model = Column(String, nullable=True)  # 生成该回复的底层模型
+    latency_ms = Column(Integer, nullable=True)  # 生成该回复的耗时
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cached_tokens = Column(Integer, nullable=True)  # 命中上游 Prompt 缓存的 token 数
+
     # 反向关联
     session = relationship("SessionModel", back_populates="messages")
+
+    __table_args__ = (
+        # 历史消息按 session_id 过滤、按 timestamp 排序，复合索引同时消除全表扫描与排序
+        Index("ix_messages_session_id_timestamp", "session_id", "timestamp"),
+    )
+
+
+class ConversationSummaryModel(Base):
+    """会话的滚动摘要：压缩了该会话最早的 covered_count 条消息"""
+
+    __tablename__ = "conversation_summaries"
+
+    session_id = Column(
+        String,
+        ForeignKey("sessions.session_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    content = Column(String, nullable=False)
+    # 摘要覆盖到的最后一条消息及覆盖的消息条数，用于校验摘要是否仍与历史一致
+    covered_until_message_id = Column(String, nullable=False)
+    covered_count = Column(Integer, nullable=False)
+    token_count = Column(Integer, nullable=True)
+    created_at = Column(Integer, nullable=False)
+
+
+class ResponseCacheModel(Base):
+    """模型回复缓存的持久层：按请求内容哈希精确匹配"""
+
+    __tablename__ = "response_cache"
+
+    cache_key = Column(String, primary_key=True)
+    model_name = Column(String, nullable=False)
+    content = Column(String, nullable=False)
+    created_at = Column(Integer, nullable=False)
+    expires_at = Column(Integer, nullable=False, index=True)
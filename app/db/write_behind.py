@@ -0,0 +1,139 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from app.schemas.chat import Message
+from app.db.data_manager import AppendResult
+from app.core.logger import log
+
+
+# 关闭写入器时放入队列的哨兵对象
+_STOP = object()
+
+
+class MessageWriteBehind:
+    """
+    消息写入合并器 (Write-Behind / Group Commit)
+    多个并发请求的消息写入先进入有界队列，由单个后台任务每隔几毫秒或凑满 N 项后
+    合并为一个事务提交，把大量细碎的 fsync 合并为一次。
+    submit 会等待所属批次真正落库后才返回，因此调用方随后的读取一定能看到这条消息。
+    """
+
+    def __init__(
+        self,
+        data_manager,
+        flush_interval_ms: int = 5,
+        max_batch: int = 64,
+        max_queue: int = 1024,
+    ):
+        self._data_manager = data_manager
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_batch = max(1, max_batch)
+        # 有界队列：写满后 submit 会在 put 上等待，形成背压
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # 统计信息
+        self.flushed_batches = 0
+        self.flushed_items = 0
+
+    def start(self):
+        """启动后台写入任务 (需要在事件循环中调用)"""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+            log.info("MessageWriteBehind: 后台写入任务已启动")
+
+    async def close(self):
+        """停止接收新写入，并把队列中剩余的消息全部落库后再返回"""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+        # 后台任务退出后才进入队列的写入 (关闭前已通过检查、正在 put 上等待) 也要落库
+        await self._drain()
+        self._task = None
+        log.info(
+            f"MessageWriteBehind: 已刷新全部待写消息并停止 "
+            f"(batches={self.flushed_batches}, items={self.flushed_items})"
+        )
+
+    async def submit(
+        self, session_id: str, messages: List[Message]
+    ) -> Optional[AppendResult]:
+        """
+        提交一组同一会话的消息，等待其所在批次提交后返回
+        :return: 写入结果 (新的会话版本号等)，会话不存在时为 None
+        """
+        # 未启动或正在关闭时直接同步写入，保证不丢消息
+        if self._task is None or self._closing:
+            return (await self._data_manager.write_message_batch([(session_id, messages)]))[0]
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((session_id, messages, future))
+        if self._task is None or self._task.done():
+            # 在 put 上等待期间写入器已关闭，不会再有后台任务取走这条消息：自行落库
+            await self._drain()
+        # shield：调用方被取消 (如客户端断开) 时，消息依旧会随批次落库
+        return await asyncio.shield(future)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+
+            # 队列里还不够一批时，稍等片刻让并发请求的写入凑到同一个事务里
+            if self._queue.qsize() + 1 < self._max_batch:
+                await asyncio.sleep(self._flush_interval)
+
+            batch = [first]
+            while len(batch) < self._max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+        # 收到停止信号后，把哨兵之后仍在队列中的写入也一并落库
+        await self._drain()
+
+    async def _drain(self):
+        """把队列中剩余的写入按批落库 (后台任务退出后调用)"""
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self._max_batch):
+            await self._flush(remaining[start : start + self._max_batch])
+
+    async def _flush(self, batch: List[Tuple[str, List[Message], asyncio.Future]]):
+        try:
+            results = await self._data_manager.write_message_batch(
+                [(session_id, messages) for session_id, messages, _ in batch]
+            )
+        except Exception as e:
+            # 整批失败时退化为逐项提交，避免一条坏数据拖累同批的其他请求
+            log.error(f"MessageWriteBehind: 批量提交失败，改为逐项提交: {e}")
+            for session_id, messages, future in batch:
+                try:
+                    result = await self._data_manager.write_message_batch(
+                        [(session_id, messages)]
+                    )
+                    if not future.done():
+                        future.set_result(result[0])
+                except Exception as item_error:
+                    if not future.done():
+                        future.set_exception(item_error)
+            return
+
+        self.flushed_batches += 1
+        self.flushed_items += len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
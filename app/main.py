@@ -1,24 +1,39 @@
 import os
-import json
+import time
 import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-import httpx
 import urllib.parse
+from typing import Optional
 
 from app.db.data_manager import DataManager
+from app.db.write_behind import MessageWriteBehind
 from app.services.session_manager import SessionManager
+from app.services.conversation_cache import ConversationCache
 from app.services.llm_manager import LLMManager
+from app.services.response_cache import ResponseCache
 from app.services.chat_sdk import ChatSDK
+from app.services.concurrency import ProviderOverloadedError
+from app.services.disconnect import stream_until_disconnected
+from app.services.sse import coalesce_chunks, sse_event
 from app.schemas.chat import APIConfig, OllamaConfig
 from app.core.logger import log
 
 from app.core.model_registry import get_all_models
 from app.tts.xiaohu_tts import XiaoHuTTS
+from app.tts.speech_pipeline import SpeechPipeline, SpeechSegment
+from app.tts.audio_cache import AudioCache, make_audio_key
+from app.tts.audio_proxy import fetch_audio, open_audio_stream
+from app.tts.transcoder import (
+    SOURCE_FORMAT,
+    AudioTranscoder,
+    ffmpeg_available,
+    negotiate_format,
+)
 
 import shutil
 import tempfile
@@ -35,20 +50,53 @@ xiaohu_tts_service = XiaoHuTTS()
 # 实例化 ASR 服务
 asr_shanghai_service = ShanghaiASR()
 asr_ali_service = AliASR()
+# 语音转码 (wav -> Opus/MP3)，启动时按配置与 ffmpeg 是否可用创建
+audio_transcoder: Optional[AudioTranscoder] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global sdk_instance, asr_instance
+    global sdk_instance, asr_instance, audio_transcoder
     log.info("ChatServer: 正在初始化数据库与 ChatSDK...")
 
     # 初始化数据库
     db_manager = DataManager(settings.DATABASE_URL)
     await db_manager.init_database()
 
+    # 可选：启动消息写入合并器，把并发请求的消息写入合并为组提交
+    write_behind = None
+    if settings.WRITE_BEHIND_ENABLED:
+        write_behind = MessageWriteBehind(
+            db_manager,
+            flush_interval_ms=settings.WRITE_BEHIND_FLUSH_INTERVAL_MS,
+            max_batch=settings.WRITE_BEHIND_MAX_BATCH,
+            max_queue=settings.WRITE_BEHIND_QUEUE_SIZE,
+        )
+        write_behind.start()
+
+    # 可选：进程内会话缓存 (多 worker 部署下依靠 update_time 版本号保持一致)
+    conversation_cache = None
+    if settings.SESSION_CACHE_ENABLED:
+        conversation_cache = ConversationCache(settings.SESSION_CACHE_MAX_BYTES)
+
+    # 可选：模型回复缓存 (可选持久层复用同一个数据库)
+    response_cache = None
+    if settings.RESPONSE_CACHE_ENABLED:
+        store = None
+        if settings.RESPONSE_CACHE_PERSISTENT:
+            store = db_manager
+            await db_manager.purge_expired_responses(int(time.time()))
+        response_cache = ResponseCache(
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+            store=store,
+        )
+
     # 实例化 Managers
-    session_manager = SessionManager(db_manager)
-    llm_manager = LLMManager()
+    session_manager = SessionManager(db_manager, write_behind, conversation_cache)
+    llm_manager = LLMManager(
+        response_cache, single_flight=settings.LLM_SINGLE_FLIGHT_ENABLED
+    )
     sdk_instance = ChatSDK(llm_manager, session_manager)
 
     # 调用统一配置函数组装模型配置
@@ -60,12 +108,53 @@ async def lifespan(app: FastAPI):
     else:
         log.error("ChatServer: ChatSDK 初始化失败!!!")
 
+    # 定期探测各模型节点，/api/models 只列出可用的模型
+    llm_manager.start_health_checks(
+        settings.LLM_HEALTH_CHECK_INTERVAL, settings.LLM_HEALTH_CHECK_TIMEOUT
+    )
+
+    # 语音缓存与常用语句 (开场白等) 的预合成，在后台进行，不阻塞启动
+    presynth_task = None
+    if settings.TTS_CACHE_ENABLED:
+        xiaohu_tts_service.audio_cache = AudioCache(
+            settings.TTS_CACHE_DIR, settings.TTS_CACHE_MAX_BYTES
+        )
+        phrases = list(settings.TTS_PRESYNTH_PHRASES) + [
+            config.greeting
+            for config in configs
+            if "小沪" in config.model_name and config.greeting
+        ]
+        if settings.TTS_API_BASE and phrases:
+            presynth_task = asyncio.create_task(
+                xiaohu_tts_service.presynthesize(phrases)
+            )
+
+    if settings.TTS_TRANSCODE_ENABLED:
+        if ffmpeg_available():
+            audio_transcoder = AudioTranscoder(
+                settings.TTS_TRANSCODE_WORKERS,
+                {"opus": settings.TTS_OPUS_BITRATE, "mp3": settings.TTS_MP3_BITRATE},
+            )
+        else:
+            log.warning("ChatServer: 未找到 ffmpeg，语音转码已关闭，只提供 wav")
+
     # 预热 ASR 客户端 (扔到后台线程执行，不阻塞 FastAPI 启动)
     asyncio.create_task(asyncio.to_thread(asr_shanghai_service.init_client_sync))
 
     yield  # 将控制权交还给 FastAPI，服务器正式开始接收请求
 
     # 服务器停止时的清理逻辑
+    if presynth_task:
+        presynth_task.cancel()
+        await asyncio.gather(presynth_task, return_exceptions=True)
+    await xiaohu_tts_service.close()
+    if audio_transcoder:
+        audio_transcoder.close()
+    await sdk_instance.close()
+    if write_behind:
+        # 先把队列中尚未提交的消息全部落库，保证回复不丢失
+        await write_behind.close()
+    await db_manager.engine.dispose()
     log.info("ChatServer: HTTP 服务已停止，资源清理完毕。")
 
 
@@ -90,6 +179,9 @@ class CreateSessionReq(BaseModel):
 class SendMessageReq(BaseModel):
     session_id: str
     message: str
+    # 流式接口的语音模式：小沪的回复按句合成语音，每句合成完即以 "audio" 事件穿插在文本帧之间
+    # (目前 www 中打包的前端不发送 voice，也没有处理 "audio" 事件，供新版客户端使用)
+    voice: bool = False
 
 
 # 通用响应生成器
@@ -102,6 +194,15 @@ def standard_response(
     return JSONResponse(status_code=status_code, content=content)
 
 
+def overloaded_response(e: ProviderOverloadedError):
+    """模型过载：503 + Retry-After，提示前端稍后重试"""
+    response = standard_response(
+        False, "model is busy, please retry later", status_code=503
+    )
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
 # HTTP 路由注册
 
 
@@ -120,25 +221,22 @@ async def create_session(req: CreateSessionReq):
 
 
 @app.get("/api/sessions")
-async def get_session_lists():
-    """处理获取会话列表请求"""
-    session_ids = await sdk_instance.get_session_list()
-    data_array = []
-
-    for sid in session_ids:
-        session = await sdk_instance.get_session(sid)
-        if session:
-            first_msg = session.messages[0].content if session.messages else "新会话"
-            data_array.append(
-                {
-                    "id": session.session_id,
-                    "model": session.model_name,
-                    "created_at": session.created_at,
-                    "updated_at": session.updated_at,
-                    "message_count": len(session.messages),
-                    "first_user_message": first_msg,
-                }
-            )
+async def get_session_lists(
+    limit: Optional[int] = Query(None, ge=1), offset: int = Query(0, ge=0)
+):
+    """处理获取会话列表请求 (支持 limit/offset 分页)"""
+    summaries = await sdk_instance.get_session_summaries(limit, offset)
+    data_array = [
+        {
+            "id": s.session_id,
+            "model": s.model_name,
+            "created_at": s.created_at,
+            "updated_at": s.updated_at,
+            "message_count": s.message_count,
+            "first_user_message": s.first_user_message or "新会话",
+        }
+        for s in summaries
+    ]
 
     return standard_response(True, "get session lists success", data_array)
 
@@ -164,12 +262,32 @@ async def delete_session(session_id: str):
 
 
 @app.get("/api/session/{session_id}/history")
-async def get_history_messages(session_id: str):
-    """处理获取历史消息请求"""
-    session = await sdk_instance.get_session(session_id)
-    if not session:
+async def get_history_messages(
+    request: Request,
+    session_id: str,
+    after: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """
+    处理获取历史消息请求
+    支持 ?after=<消息ID或时间戳>&limit=N 增量拉取；
+    会话的 update_time 作为 ETag，历史未变化时直接返回 304，不查询消息表
+    """
+    version = await sdk_instance.get_session_version(session_id)
+    if version is None:
         return standard_response(False, "session not found", status_code=404)
 
+    # 同一会话不同的分页参数对应不同的表示，因此一并计入 ETag
+    etag = f'W/"{version}-{after or ""}-{limit or ""}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        messages = await sdk_instance.get_history_messages(session_id, after, limit)
+    except ValueError as e:
+        return standard_response(False, str(e), status_code=400)
+
     data_array = [
         {
             "id": msg.message_id,
@@ -177,17 +295,44 @@ async def get_history_messages(session_id: str):
             "content": msg.content,
             "timestamp": msg.timestamp,
         }
-        for msg in session.messages
+        for msg in messages
     ]
 
-    return standard_response(True, "get history messages success", data_array)
+    response = standard_response(True, "get history messages success", data_array)
+    response.headers["ETag"] = etag
+    return response
+
+
+def proxied_audio_url(raw_audio_url: str) -> str:
+    """将 TTS 服务的 HTTP 外部链接进行 URL 编码，包装成我们的内部代理路径"""
+    encoded_url = urllib.parse.quote(raw_audio_url, safe="")
+    # 因为前端 script.js 使用相对路径，这里直接返回 /api/... 即可
+    return f"/api/audio/proxy?url={encoded_url}"
+
+
+async def synthesize_audio_url(text: str) -> Optional[str]:
+    """合成语音，返回前端可以直接播放的地址 (本地缓存，或代理后的上游地址)"""
+    if xiaohu_tts_service.audio_cache is not None:
+        name = await xiaohu_tts_service.generate_cached(text)
+        return f"/api/audio/cache/{name}" if name else None
+    # 获取原始的 HTTP 链接
+    raw_audio_url = await xiaohu_tts_service.generate_audio(text)
+    return proxied_audio_url(raw_audio_url) if raw_audio_url else None
+
+
+def audio_event(segment: SpeechSegment) -> str:
+    """语音片段帧：event: audio，data 为 {"index", "text", "audio_url"}"""
+    return sse_event(segment.model_dump(), event="audio")
 
 
 @app.post("/api/message")
 async def send_message_full(req: SendMessageReq):
     """处理发送消息请求 - 全量返回（并尝试同步调用 TTS）"""
     # 调用大模型获取文本回复
-    response_text = await sdk_instance.send_message(req.session_id, req.message)
+    try:
+        response_text = await sdk_instance.send_message(req.session_id, req.message)
+    except ProviderOverloadedError as e:
+        return overloaded_response(e)
     if not response_text:
         return standard_response(
             False, "Failed to send AI response message", status_code=500
@@ -195,16 +340,9 @@ async def send_message_full(req: SendMessageReq):
 
     # 判断该会话是否属于“小沪”，如果是，则请求语音合成
     audio_url = None
-    session = await sdk_instance.get_session(req.session_id)
-    if session and "小沪" in session.model_name:
-        # 获取原始的 HTTP 链接
-        raw_audio_url = await xiaohu_tts_service.generate_audio(response_text)
-
-        if raw_audio_url:
-            # 【关键修改】：将 HTTP 外部链接进行 URL 编码，包装成我们的内部代理路径
-            encoded_url = urllib.parse.quote(raw_audio_url, safe="")
-            # 因为前端 script.js 使用相对路径，这里直接返回 /api/... 即可
-            audio_url = f"/api/audio/proxy?url={encoded_url}"
+    model_name = await sdk_instance.get_session_model_name(req.session_id)
+    if model_name and "小沪" in model_name:
+        audio_url = await synthesize_audio_url(response_text)
 
     # 将文本和可能存在的音频链接一起返回给前端
     return standard_response(
@@ -219,30 +357,64 @@ async def send_message_full(req: SendMessageReq):
 
 
 @app.post("/api/message/async")
-async def send_message_stream(req: SendMessageReq):
+async def send_message_stream(req: SendMessageReq, request: Request):
     """
     处理发送消息请求 - 增量返回
+    浏览器关闭连接后主动取消上游生成，已生成的部分回复照常落库
     """
+    # 响应头一旦发出就无法再返回 503，因此在开始推流之前先做准入检查
+    try:
+        await sdk_instance.check_admission(req.session_id)
+    except ProviderOverloadedError as e:
+        return overloaded_response(e)
+
+    # 语音模式：只对小沪的会话生效，边生成边按句合成
+    speech = None
+    if req.voice:
+        model_name = await sdk_instance.get_session_model_name(req.session_id)
+        if model_name and "小沪" in model_name:
+            speech = SpeechPipeline(synthesize_audio_url, settings.TTS_MAX_PARALLEL)
 
     async def event_generator():
-        # json.dumps 替代了 C++ 的 Json::valueToQuotedString，确保 \n 被安全转义为 "\\n"
-        yield f"data: {json.dumps('', ensure_ascii=False)}\n\n"
+        # 先发一个空帧，让前端尽快进入流式状态
+        yield sse_event("")
 
         try:
-            # 遍历底层的 AsyncGenerator
-            async for chunk in sdk_instance.send_message_stream(
-                req.session_id, req.message
-            ):
-                if chunk:
+            # 遍历底层的 AsyncGenerator，客户端断开时取消上游请求并释放并发槽位
+            stream = stream_until_disconnected(
+                sdk_instance.send_message_stream(req.session_id, req.message),
+                request.is_disconnected,
+            )
+            # 把逐字的增量合并成按时间/字节数/句子下发的帧
+            frames = coalesce_chunks(
+                stream,
+                settings.SSE_COALESCE_MAX_DELAY_MS,
+                settings.SSE_COALESCE_MAX_BYTES,
+            )
+            if speech:
+                # 句子合成完立即穿插在文本帧之间下发，不等下一个文本帧
+                frames = speech.interleave(frames)
+            async for item in frames:
+                if isinstance(item, SpeechSegment):
+                    yield audio_event(item)
+                else:
                     # 遵循 SSE 协议格式：data: "文本内容"\n\n
-                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    yield sse_event(item)
 
             # 流结束标记
             yield "data: [DONE]\n\n"
 
+        except ProviderOverloadedError:
+            # 准入检查之后才被挤满 (或排队超时)，只能在流内告知前端
+            yield sse_event("[ERROR] Model Busy")
+
         except Exception as e:
             log.error(f"Streaming Error: {e}")
-            yield f"data: {json.dumps('[ERROR] Stream Failed', ensure_ascii=False)}\n\n"
+            yield sse_event("[ERROR] Stream Failed")
+
+        finally:
+            if speech:
+                await speech.close()
 
     # StreamingResponse 会自动设置 Transfer-Encoding: chunked
     # 只需设置 media_type 即可
@@ -253,6 +425,17 @@ async def send_message_stream(req: SendMessageReq):
     )
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """处理获取运行指标请求 (各模型的并发/排队深度与等待时间、缓存命中等)"""
+    metrics = sdk_instance.get_metrics()
+    if xiaohu_tts_service.audio_cache is not None:
+        metrics["audio_cache"] = xiaohu_tts_service.audio_cache.stats().model_dump()
+    if audio_transcoder is not None:
+        metrics["transcoder"] = audio_transcoder.stats().model_dump()
+    return standard_response(True, "get metrics success", metrics)
+
+
 @app.post("/api/audio/recognize")
 async def recognize_audio_api(
     file: UploadFile = File(...),
@@ -311,24 +494,79 @@ async def recognize_audio_api(
         return standard_response(False, f"服务器内部错误: {str(e)}", status_code=500)
 
 
+def negotiate_audio_format(request: Request, fmt: Optional[str]) -> str:
+    """按 format 参数或 Accept 头选择音频格式；没有可用的转码器时只提供 wav"""
+    try:
+        fmt = negotiate_format(request.headers.get("accept"), fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return fmt if audio_transcoder is not None else SOURCE_FORMAT
+
+
+@app.get("/api/audio/cache/{name}")
+async def get_cached_audio(
+    name: str, request: Request, fmt: Optional[str] = Query(None, alias="format")
+):
+    """
+    本地缓存的语音文件：按内容寻址，同一地址的内容永远不变，可以让浏览器长期缓存
+    FileResponse 支持 Range 请求，音频可以拖动进度
+    客户端可通过 format 参数 (opus/mp3/wav) 或 Accept 头要求转码，转码结果与源文件一起缓存
+    """
+    cache = xiaohu_tts_service.audio_cache
+    if cache is None or not AudioCache.is_valid_name(name):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    key, ext = name.rsplit(".", 1)
+    fmt = negotiate_audio_format(request, fmt)
+    if ext == SOURCE_FORMAT and fmt != SOURCE_FORMAT:
+        variant = await audio_transcoder.cached_variant(cache, key, fmt)
+        if variant:
+            name = variant
+    path = cache.get_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return FileResponse(
+        path,
+        media_type=AudioCache.media_type(name),
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept"},
+    )
+
+
 @app.get("/api/audio/proxy")
-async def proxy_audio(url: str):
+async def proxy_audio(
+    url: str, request: Request, fmt: Optional[str] = Query(None, alias="format")
+):
     """
     音频代理接口：解决 HTTPS 网站无法直接播放 HTTP 音频的混合内容 (Mixed Content) 拦截问题
     """
     # 安全校验：防止被恶意利用当作开放代理
     if not url.startswith(settings.TTS_API_BASE):
         raise HTTPException(status_code=403, detail="Forbidden URL")
+    fmt = negotiate_audio_format(request, fmt)
 
     try:
-        # 由后端代为向 HTTP 的 TTS 服务器请求音频文件数据
-        # 加上 trust_env=False 绕过系统代理
-        async with httpx.AsyncClient(trust_env=False, timeout=60.0) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-
-            # 拿到二进制音频数据后，作为本机的 HTTPS 流量返回给前端
-            return Response(content=resp.content, media_type="audio/wav")
+        cache = xiaohu_tts_service.audio_cache
+        if fmt != SOURCE_FORMAT and cache is not None:
+            # 转码需要完整的源文件：以 URL 的哈希为键，把源文件与转码结果一起写入语音缓存，
+            # 重复请求直接读磁盘。源文件超过 TTS_TRANSCODE_MAX_BYTES 或转码失败时退回原始 wav
+            variant = await audio_transcoder.cached_variant(
+                cache,
+                make_audio_key(url),
+                fmt,
+                lambda: fetch_audio(
+                    xiaohu_tts_service.audio_client, url, settings.TTS_TRANSCODE_MAX_BYTES
+                ),
+            )
+            path = cache.get_path(variant) if variant else None
+            if path:
+                return FileResponse(
+                    path, media_type=AudioCache.media_type(variant), headers={"Vary": "Accept"}
+                )
+
+        # 由后端代为向 HTTP 的 TTS 服务器请求音频文件数据 (复用下载音频的长连接池，默认绕过系统代理)，
+        # 收到的数据边读边作为本机的 HTTPS 流量转发给前端，并转发 Range 请求以支持拖动进度
+        return await open_audio_stream(
+            xiaohu_tts_service.audio_client, url, request.headers.get("range")
+        )
 
     except Exception as e:
         log.error(f"代理音频失败: {e}")
@@ -27,6 +27,14 @@ class Message(BaseModel):
         default_factory=current_timestamp, description="消息发送时间戳"
     )
 
+    # 用量统计 (可选)：token_count 为消息内容本身的 token 数，其余仅助手回复会填写
+    token_count: Optional[int] = None
+    model: Optional[str] = None
+    latency_ms: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+
 
 # 模型配置结构 (Config)
 class LLMConfig(BaseModel):
@@ -45,6 +53,30 @@ class LLMConfig(BaseModel):
     temperature: float = Field(default=0.7, ge=0.0, le=2.0)
     max_tokens: int = 2048
 
+    # 上下文窗口预算 (token)：系统提示词 + 历史消息 + 预留的 max_tokens 不超过该值，<= 0 表示不裁剪
+    max_context_tokens: int = 16384
+
+    # 滚动摘要：未被摘要覆盖的历史超过该 token 数时在后台压缩较早的对话，<= 0 表示关闭
+    summary_trigger_tokens: int = 0
+    # 压缩时始终保留原文的最近消息条数
+    summary_keep_recent: int = 6
+
+    # 并发限制：同时发往上游的请求数上限，<= 0 表示不限制
+    max_concurrency: int = 0
+    # 超出并发上限时的等待队列长度，队列已满的请求立即失败 (503 + Retry-After)
+    max_queue_size: int = 16
+    # 排队的最长等待秒数，超时同样按过载处理，<= 0 表示一直等待
+    queue_timeout_seconds: float = 30.0
+
+    # 备用模型 (已注册的模型名，按优先级排列)：主模型出错时依次切换
+    fallback_models: List[str] = Field(default_factory=list)
+    # 首 token 超过该毫秒数仍未到达时向下一个备用模型发起对冲请求，取先响应者，<= 0 表示不对冲
+    hedge_after_ms: int = 0
+
+    # 调用方式："direct" 直接走 OpenAI 兼容接口 (不经过 litellm)，"litellm" 走 litellm，
+    # "auto" 对 OpenAI / DeepSeek / Ollama 使用 direct，其余 (如 Gemini) 使用 litellm
+    backend: Literal["auto", "direct", "litellm"] = "auto"
+
 
 # 继承：API配置 与 Ollama 配置
 class APIConfig(LLMConfig):
@@ -74,3 +106,52 @@ class Session(BaseModel):
     messages: List[Message] = Field(default_factory=list)
     created_at: int = Field(default_factory=current_timestamp)
     updated_at: int = Field(default_factory=current_timestamp)
+
+
+# 会话摘要 (会话列表专用，不携带完整消息列表)
+class SessionSummary(BaseModel):
+    session_id: str
+    model_name: str = ""
+    created_at: int = 0
+    updated_at: int = 0
+    message_count: int = 0
+    # 会话中的第一条用户消息，尚无用户消息时为 None
+    first_user_message: Optional[str] = None
+
+
+# 单次大模型调用的用量 (由 Provider 写入 request_param["usage"])
+class LLMUsage(BaseModel):
+    model: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency_ms: int = 0
+
+
+# 用量聚合统计 (按会话或模型分组)
+class UsageStats(BaseModel):
+    key: str  # 分组键：session_id 或模型名
+    message_count: int = 0  # 参与统计的助手回复条数
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    avg_latency_ms: float = 0.0
+    max_latency_ms: int = 0
+
+
+# 会话的滚动摘要
+class ConversationSummary(BaseModel):
+    session_id: str
+    content: str
+    covered_until_message_id: str  # 摘要覆盖到的最后一条消息
+    covered_count: int  # 摘要覆盖的消息条数 (从会话第一条消息算起)
+    token_count: Optional[int] = None
+    created_at: int = Field(default_factory=current_timestamp)
+
+    def is_valid_for(self, history: List[Message]) -> bool:
+        """历史消息的前 covered_count 条必须仍以 covered_until_message_id 结尾，否则摘要已失效"""
+        return (
+            0 < self.covered_count <= len(history)
+            and history[self.covered_count - 1].message_id
+            == self.covered_until_message_id
+        )
@@ -1,19 +1,52 @@
 import asyncio
-from typing import List, Union, AsyncGenerator, Dict, Any
-
-from app.schemas.chat import Message, ModelInfo, APIConfig, OllamaConfig
+from typing import List, Optional, Tuple, Union, AsyncGenerator, Dict, Any
+
+from app.schemas.chat import (
+    ConversationSummary,
+    LLMUsage,
+    Message,
+    ModelInfo,
+    APIConfig,
+    OllamaConfig,
+    SessionSummary,
+)
 from app.services.llm_manager import LLMManager
+from app.services.llm_provider import LLMProvider, is_error_reply
+from app.services.concurrency import ProviderOverloadedError
+from app.services.openai_compatible_provider import (
+    OPENAI_COMPATIBLE_BASES,
+    OpenAICompatibleProvider,
+)
 from app.services.session_manager import SessionManager
-from app.services.unified_llm_provider import UnifiedLLMProvider
+from app.services.context_builder import ContextBuilder
 from app.core.logger import log
 
+# 滚动摘要使用的提示词
+SUMMARY_SYSTEM_PROMPT = (
+    "你是一个对话摘要助手。请把给出的对话记录压缩成一段简洁的中文摘要，"
+    "保留用户的身份信息、偏好、提出过的问题、已经给出的关键结论以及尚未解决的事项，"
+    "不要编造对话中没有的内容，不要输出与摘要无关的解释。"
+)
+SUMMARY_MAX_TOKENS = 512
+
 
 class ChatSDK:
-    def __init__(self, llm_manager: LLMManager, session_manager: SessionManager):
+    def __init__(
+        self,
+        llm_manager: LLMManager,
+        session_manager: SessionManager,
+        context_builder: Optional[ContextBuilder] = None,
+    ):
         self._llm_manager = llm_manager
         self._session_manager = session_manager
         self._initialized = False
 
+        # 按 token 预算裁剪历史上下文
+        self._context_builder = context_builder or ContextBuilder()
+
+        # 正在后台生成摘要的会话 -> 任务 (同一会话同时只允许一个摘要任务)
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+
         # 缓存配置信息，用于后续组装 requestParam (如 temperature, max_tokens)
         self._model_configs: Dict[str, Union[APIConfig, OllamaConfig]] = {}
 
@@ -28,6 +61,36 @@ class ChatSDK:
             return "gemini"
         return "openai"  # 默认 fallback
 
+    def _create_provider(
+        self, config: Union[APIConfig, OllamaConfig], real_model: str
+    ) -> LLMProvider:
+        """根据模型配置选择 Provider：OpenAI 兼容的提供商默认直连，其余走 litellm"""
+        if isinstance(config, OllamaConfig):
+            provider_type, model_desc = "ollama", config.model_desc
+        else:
+            provider_type, model_desc = self._infer_provider_type(real_model), ""
+
+        backend = config.backend
+        if backend == "auto":
+            backend = "direct" if provider_type in OPENAI_COMPATIBLE_BASES else "litellm"
+        if backend == "direct" and provider_type in OPENAI_COMPATIBLE_BASES:
+            return OpenAICompatibleProvider(provider_type, real_model, model_desc)
+
+        # litellm 导入耗时较长，只在确实需要时才加载
+        from app.services.unified_llm_provider import UnifiedLLMProvider
+
+        return UnifiedLLMProvider(provider_type, real_model, model_desc)
+
+    def _usable_fallback(self, model_name: str) -> bool:
+        """备用模型需要初始化成功；云端模型未配置 API Key 时请求必然失败，不作为备用"""
+        config = self._model_configs.get(model_name)
+        if config is None:
+            return False
+        if isinstance(config, APIConfig) and not config.api_key:
+            log.warning(f"ChatSDK: fallback model {model_name} has no API key, skipped")
+            return False
+        return True
+
     async def init_models(self, configs: List[Union[APIConfig, OllamaConfig]]) -> bool:
         """初始化所有支持的模型"""
         for config in configs:
@@ -38,13 +101,7 @@ class ChatSDK:
 
             # 注册 Provider
             if not self._llm_manager.is_model_available(model_name):
-                if isinstance(config, OllamaConfig):
-                    provider = UnifiedLLMProvider(
-                        "ollama", real_model, config.model_desc
-                    )
-                else:
-                    provider_type = self._infer_provider_type(real_model)
-                    provider = UnifiedLLMProvider(provider_type, real_model)
+                provider = self._create_provider(config, real_model)
 
                 # 注册时依然使用 UI上的 model_name 映射
                 self._llm_manager.register_provider(model_name, provider)
@@ -62,9 +119,27 @@ class ChatSDK:
             success = await self._llm_manager.init_model(model_name, model_params)
             if success:
                 self._model_configs[model_name] = config
+                self._llm_manager.set_concurrency_limit(
+                    model_name,
+                    config.max_concurrency,
+                    config.max_queue_size,
+                    config.queue_timeout_seconds,
+                )
             else:
                 log.error(f"ChatSDK: failed to init model {model_name}")
 
+        # 备用路由需要在所有模型注册之后配置 (只保留初始化成功且配置了 API Key 的备用模型)
+        for config in configs:
+            if config.model_name in self._model_configs and config.fallback_models:
+                self._llm_manager.set_route(
+                    config.model_name,
+                    [m for m in config.fallback_models if self._usable_fallback(m)],
+                    config.hedge_after_ms,
+                )
+
+        # 提前加载分词器编码表，避免首个请求阻塞事件循环
+        await asyncio.to_thread(self._context_builder.warm_up)
+
         self._initialized = True
         log.info("ChatSDK initialized successfully.")
         return True
@@ -73,26 +148,43 @@ class ChatSDK:
     async def create_session(self, model_name: str) -> str:
         if not self._initialized:
             raise RuntimeError("ChatSDK is not initialized")
-        session_id = await self._session_manager.create_session(model_name)
-
-        # 【新增】：自动插入自我介绍开场白到数据库
+        # 【新增】：自我介绍开场白与会话在同一个事务中写入数据库
         config = self._model_configs.get(model_name)
-        if config and config.greeting:
-            greeting_msg = Message(role="assistant", content=config.greeting)
-            await self._session_manager.add_message(session_id, greeting_msg)
-
-        return session_id
+        greeting = config.greeting if config and config.greeting else ""
+        return await self._session_manager.create_session(model_name, greeting)
 
     async def get_session(self, session_id: str):
         if not self._initialized:
             raise RuntimeError("ChatSDK is not initialized")
         return await self._session_manager.get_session(session_id)
 
+    async def get_session_version(self, session_id: str) -> Optional[int]:
+        if not self._initialized:
+            raise RuntimeError("ChatSDK is not initialized")
+        return await self._session_manager.get_session_version(session_id)
+
+    async def get_history_messages(
+        self,
+        session_id: str,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Message]:
+        if not self._initialized:
+            raise RuntimeError("ChatSDK is not initialized")
+        return await self._session_manager.get_history_messages(session_id, after, limit)
+
     async def get_session_list(self) -> List[str]:
         if not self._initialized:
             raise RuntimeError("ChatSDK is not initialized")
         return await self._session_manager.get_session_list()
 
+    async def get_session_summaries(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> List[SessionSummary]:
+        if not self._initialized:
+            raise RuntimeError("ChatSDK is not initialized")
+        return await self._session_manager.get_session_summaries(limit, offset)
+
     async def delete_session(self, session_id: str) -> bool:
         if not self._initialized:
             raise RuntimeError("ChatSDK is not initialized")
@@ -103,44 +195,241 @@ class ChatSDK:
         return self._llm_manager.get_available_models()
 
     # ================= 消息发送 =================
+    def _build_request_param(
+        self, config: Optional[Union[APIConfig, OllamaConfig]]
+    ) -> Dict[str, Any]:
+        """构建请求参数 (全量与流式共用)"""
+        return {
+            "temperature": config.temperature if config else 0.7,
+            "max_tokens": config.max_tokens if config else 2048,
+            "system_prompt": config.system_prompt if config else "",  # 透传给底层
+            "usage": LLMUsage(),  # 由 Provider 回填本次调用的用量
+        }
+
+    def _finalize_exchange(
+        self, user_msg: Message, response: str, usage: LLMUsage
+    ) -> Optional[Message]:
+        """补全本轮对话待落库的 token 数与用量，返回助手消息 (没有回复时为 None)"""
+        user_msg.token_count = self._context_builder.content_tokens(user_msg)
+        if not response:
+            return None
+
+        ai_msg = Message(role="assistant", content=response)
+        ai_msg.token_count = self._context_builder.content_tokens(ai_msg)
+        if usage.model:
+            ai_msg.model = usage.model
+            ai_msg.latency_ms = usage.latency_ms
+            ai_msg.prompt_tokens = usage.prompt_tokens
+            ai_msg.completion_tokens = usage.completion_tokens
+            ai_msg.cached_tokens = usage.cached_tokens
+        return ai_msg
+
+    def _build_context(
+        self,
+        history: List[Message],
+        config: Optional[Union[APIConfig, OllamaConfig]],
+        system_prompt: str = "",
+    ) -> List[Message]:
+        """按模型的上下文预算保留最近的消息 (为回复预留 max_tokens)"""
+        if not config:
+            return history
+        return self._context_builder.build(
+            history,
+            system_prompt=system_prompt,
+            max_context_tokens=config.max_context_tokens,
+            reserve_tokens=config.max_tokens,
+        )
+
+    async def _prepare_turn(
+        self, session, user_msg: Message
+    ) -> Tuple[
+        Optional[Union[APIConfig, OllamaConfig]],
+        Dict[str, Any],
+        List[Message],
+        int,
+    ]:
+        """
+        准备本轮请求：参数、上下文，以及已被摘要覆盖的消息条数
+        存在有效摘要时，被覆盖的早期消息替换为系统提示词中的摘要
+        """
+        config = self._model_configs.get(session.model_name)
+        request_param = self._build_request_param(config)
+        history = session.messages + [user_msg]
+
+        covered = 0
+        if config and config.summary_trigger_tokens > 0:
+            summary = await self._session_manager.get_conversation_summary(
+                session.session_id
+            )
+            if summary and summary.is_valid_for(history):
+                covered = summary.covered_count
+                request_param["system_prompt"] = (
+                    f"{request_param['system_prompt']}\n\n"
+                    f"以下是此前对话的摘要，请在回答时参考：\n{summary.content}"
+                ).strip()
+            elif summary:
+                log.warning(
+                    f"ChatSDK: summary of session {session.session_id} is stale, ignored"
+                )
+
+        context = self._build_context(
+            history[covered:], config, request_param["system_prompt"]
+        )
+        return config, request_param, context, covered
+
+    def _maybe_schedule_summary(
+        self,
+        session_id: str,
+        model_name: str,
+        config: Optional[Union[APIConfig, OllamaConfig]],
+        unsummarized: List[Message],
+    ):
+        """未被摘要覆盖的历史超过阈值时，在后台生成摘要 (不阻塞当前请求)"""
+        if not config or config.summary_trigger_tokens <= 0:
+            return
+        if session_id in self._summary_tasks:
+            return
+
+        tokens = sum(self._context_builder.message_tokens(m) for m in unsummarized)
+        if tokens <= config.summary_trigger_tokens:
+            return
+
+        task = asyncio.create_task(
+            self._summarize_session(session_id, model_name, config)
+        )
+        self._summary_tasks[session_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(session_id, None))
+
+    async def _summarize_session(
+        self,
+        session_id: str,
+        model_name: str,
+        config: Union[APIConfig, OllamaConfig],
+    ):
+        """把较早的对话 (连同旧摘要) 压缩为新的滚动摘要并持久化"""
+        try:
+            history = await self._session_manager.get_history_messages(session_id)
+            summary = await self._session_manager.get_conversation_summary(session_id)
+            if summary and not summary.is_valid_for(history):
+                summary = None
+            covered = summary.covered_count if summary else 0
+
+            # 始终保留最近几条原文；单次最多压缩半个上下文窗口，剩余部分留给后续轮次
+            fold_end = len(history) - config.summary_keep_recent
+            fold_budget = (
+                config.max_context_tokens // 2
+                if config.max_context_tokens > 0
+                else float("inf")
+            )
+            to_fold: List[Message] = []
+            for message in history[covered:fold_end]:
+                fold_budget -= self._context_builder.message_tokens(message)
+                if to_fold and fold_budget < 0:
+                    break
+                to_fold.append(message)
+            if not to_fold:
+                return
+
+            transcript = "\n".join(
+                f"{'用户' if m.role == 'user' else '助手'}: {m.content}" for m in to_fold
+            )
+            prompt = (
+                f"已有摘要：\n{summary.content}\n\n新增对话：\n{transcript}"
+                if summary
+                else f"对话记录：\n{transcript}"
+            )
+            response = await self._llm_manager.send_message(
+                model_name,
+                [Message(role="user", content=prompt)],
+                {
+                    "temperature": 0.3,
+                    "max_tokens": SUMMARY_MAX_TOKENS,
+                    "system_prompt": SUMMARY_SYSTEM_PROMPT,
+                    "cache": False,
+                },
+            )
+            if not response or is_error_reply(response):
+                log.warning(f"ChatSDK: summarize session {session_id} failed")
+                return
+
+            covered += len(to_fold)
+            await self._session_manager.save_conversation_summary(
+                ConversationSummary(
+                    session_id=session_id,
+                    content=response,
+                    covered_until_message_id=history[covered - 1].message_id,
+                    covered_count=covered,
+                    token_count=self._context_builder.count_tokens(response),
+                )
+            )
+        except Exception as e:
+            log.error(f"ChatSDK: summarize session {session_id} error: {e}")
+
+    async def close(self):
+        """停止所有后台任务并关闭 Provider 的连接池 (服务关闭时调用)"""
+        tasks = list(self._summary_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._llm_manager.close()
+
     async def send_message(self, session_id: str, message_content: str) -> str:
         """给模型发消息 - 全量返回"""
         if not self._initialized:
             raise RuntimeError("ChatSDK is not initialized")
 
+        # 会话连同历史消息一次读出，不再单独查询历史
         session = await self.get_session(session_id)
         if not session:
             log.error(f"ChatSDK.send_message: session {session_id} not found")
             return ""
 
-        # 保存用户提问
+        # 用户提问先只拼接到上下文中，与助手回复在同一个事务里落库
         user_msg = Message(role="user", content=message_content)
-        await self._session_manager.add_message(session_id, user_msg)
-
-        # 获取完整的历史上下文
-        history = await self._session_manager.get_history_messages(session_id)
 
-        # 构建请求参数
-        config = self._model_configs.get(session.model_name)
-        request_param = {
-            "temperature": config.temperature if config else 0.7,
-            "max_tokens": config.max_tokens if config else 2048,
-            "system_prompt": config.system_prompt if config else "",  # 透传给底层
-        }
+        # 构建请求参数与上下文
+        config, request_param, context, covered = await self._prepare_turn(
+            session, user_msg
+        )
 
         # 调用 LLM 发送消息
         response = await self._llm_manager.send_message(
-            session.model_name, history, request_param
+            session.model_name, context, request_param
         )
 
-        # 保存助手消息
+        # 保存本轮对话与用量 (没有回复时只保存用户提问)
+        ai_msg = self._finalize_exchange(user_msg, response, request_param["usage"])
+        await self._session_manager.append_exchange(session_id, user_msg, ai_msg)
         if response:
-            ai_msg = Message(role="assistant", content=response)
-            await self._session_manager.add_message(session_id, ai_msg)
             log.info(f"ChatSDK.send_message: success for model {session.model_name}")
+            self._maybe_schedule_summary(
+                session_id,
+                session.model_name,
+                config,
+                session.messages[covered:] + [user_msg, ai_msg],
+            )
 
         return response
 
+    async def check_admission(self, session_id: str):
+        """
+        流式接口开始输出之前的准入检查：会话所属模型已过载时抛出 ProviderOverloadedError
+        (全量接口的过载错误会直接从 send_message 抛出)
+        """
+        if not self._llm_manager.has_concurrency_limits():
+            return
+        model_name = await self._session_manager.get_session_model_name(session_id)
+        if model_name:
+            self._llm_manager.check_admission(model_name)
+
+    async def get_session_model_name(self, session_id: str) -> Optional[str]:
+        """只查询会话所属的模型名，不加载消息"""
+        return await self._session_manager.get_session_model_name(session_id)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """LLM 调用相关的运行指标 (并发/排队、回复缓存、请求合并)"""
+        return self._llm_manager.metrics()
+
     async def send_message_stream(
         self, session_id: str, message_content: str
     ) -> AsyncGenerator[str, None]:
@@ -154,38 +443,49 @@ class ChatSDK:
             yield "Error: Session not found"
             return
 
-        # 保存用户提问
+        # 用户提问先只拼接到上下文中，流结束后与助手回复一起落库
         user_msg = Message(role="user", content=message_content)
-        await self._session_manager.add_message(session_id, user_msg)
 
-        # 获取上下文与参数
-        history = await self._session_manager.get_history_messages(session_id)
-        config = self._model_configs.get(session.model_name)
-        request_param = {
-            "temperature": config.temperature if config else 0.7,
-            "max_tokens": config.max_tokens if config else 2048,
-        }
+        # 获取参数与上下文 (与全量接口一致，同样携带系统提示词)
+        config, request_param, context, covered = await self._prepare_turn(
+            session, user_msg
+        )
 
         # 流式处理与后台持久化
         full_response = ""
+        rejected = False
         try:
             # 不断将大模型产生的流式 chunk yield 给前端
             async for chunk in self._llm_manager.send_message_stream(
-                session.model_name, history, request_param
+                session.model_name, context, request_param
             ):
                 if chunk:
                     full_response += chunk
                     yield chunk
 
+        except ProviderOverloadedError:
+            # 过载被拒绝的请求不落库，与全量接口的 503 保持一致
+            rejected = True
+            raise
+
         finally:
             # 无论生成是否正常结束，或者用户前端主动断开网络连接
-            # try...finally 都会保证将已生成的文本拼装后，持久化到数据库中
-            if full_response:
-                ai_msg = Message(role="assistant", content=full_response)
+            # try...finally 都会保证将用户提问与已生成的文本在同一个事务中持久化
+            if not (rejected and not full_response):
+                ai_msg = self._finalize_exchange(
+                    user_msg, full_response, request_param["usage"]
+                )
                 # 使用 asyncio.shield 保护写入数据库的操作不被取消
                 await asyncio.shield(
-                    self._session_manager.add_message(session_id, ai_msg)
+                    self._session_manager.append_exchange(session_id, user_msg, ai_msg)
                 )
+            if full_response:
                 log.info(
                     f"ChatSDK.send_message_stream: stream finished & saved for {session.model_name}"
                 )
+                self._maybe_schedule_summary(
+                    session_id,
+                    session.model_name,
+                    config,
+                    session.messages[covered:] + [user_msg, ai_msg],
+                )
@@ -0,0 +1,109 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from pydantic import BaseModel
+
+from app.core.logger import log
+
+# 熔断器状态
+CLOSED = "closed"  # 正常放行
+OPEN = "open"  # 熔断中，直接拒绝
+HALF_OPEN = "half_open"  # 冷却结束，放行少量探测请求
+
+
+# 熔断器统计信息
+class BreakerStats(BaseModel):
+    state: str = CLOSED
+    consecutive_failures: int = 0
+    failures: int = 0
+    successes: int = 0
+    opened: int = 0  # 进入熔断的次数
+    rejected: int = 0  # 熔断期间被直接拒绝的请求数
+
+
+class CircuitBreaker:
+    """
+    单个 Provider 的熔断器
+    连续 failure_threshold 次失败 (出错的回复、异常、超时) 后熔断，reset_timeout 秒内直接拒绝请求；
+    冷却结束后进入半开状态，最多放行 half_open_max_calls 个探测请求：
+    探测成功则恢复，失败则重新熔断
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self._failure_threshold = max(1, failure_threshold)
+        self._reset_timeout = reset_timeout
+        self._half_open_max_calls = max(1, half_open_max_calls)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0  # 半开状态下进行中的探测请求数
+        self._stats = BreakerStats()
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allows_request(self) -> bool:
+        """是否放行新的请求 (不占用探测名额)"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        return state == HALF_OPEN and self._probes < self._half_open_max_calls
+
+    @contextmanager
+    def attempt(self) -> Iterator[bool]:
+        """
+        包住一次上游调用，返回是否放行；
+        调用方在上下文中根据结果调用 record_success / record_failure，
+        被取消等未记录结果的探测请求在退出时归还名额
+        """
+        if not self.allows_request():
+            self._stats.rejected += 1
+            yield False
+            return
+
+        probe = self._state == HALF_OPEN
+        if probe:
+            self._probes += 1
+        try:
+            yield True
+        finally:
+            if probe and self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def record_success(self):
+        self._stats.successes += 1
+        self._stats.consecutive_failures = 0
+        if self._state != CLOSED:
+            log.info("CircuitBreaker: probe succeeded, closing circuit")
+        self._state = CLOSED
+
+    def record_failure(self, reason: Optional[str] = None):
+        self._stats.failures += 1
+        self._stats.consecutive_failures += 1
+        if self._state == HALF_OPEN or (
+            self._state == CLOSED
+            and self._stats.consecutive_failures >= self._failure_threshold
+        ):
+            self._trip(reason)
+
+    def _trip(self, reason: Optional[str]):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._stats.opened += 1
+        log.warning(
+            f"CircuitBreaker: open for {self._reset_timeout}s after "
+            f"{self._stats.consecutive_failures} consecutive failures ({reason})"
+        )
+
+    def stats(self) -> BreakerStats:
+        self._stats.state = self.state
+        return self._stats.model_copy()
@@ -0,0 +1,125 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from pydantic import BaseModel
+
+
+class ProviderOverloadedError(Exception):
+    """模型的并发与等待队列均已占满 (或排队超时)，调用方应返回 503 并带上 Retry-After"""
+
+    def __init__(self, model_name: str, retry_after: int):
+        super().__init__(f"model {model_name} is overloaded, retry after {retry_after}s")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+# 并发限制器统计信息
+class LimiterStats(BaseModel):
+    model_name: str
+    max_concurrency: int
+    max_queue_size: int
+    in_flight: int = 0
+    queued: int = 0  # 当前排队深度
+    admitted: int = 0
+    rejected: int = 0  # 队列已满被拒绝的请求数
+    timed_out: int = 0  # 排队超时的请求数
+    avg_wait_ms: float = 0.0
+    max_wait_ms: int = 0
+    avg_service_ms: float = 0.0  # 占用并发槽位的平均时长
+
+
+class ConcurrencyLimiter:
+    """
+    单个模型的并发限制与有界等待队列 (准入控制)
+    同时最多 max_concurrency 个请求发往上游，其余最多 max_queue_size 个按到达顺序排队；
+    队列已满或排队超时时抛出 ProviderOverloadedError，而不是继续压垮上游
+    """
+
+    # 平均服务时长的指数滑动平均系数，以及没有样本时的初始估计 (秒)
+    _EWMA_ALPHA = 0.2
+    _INITIAL_SERVICE_SECONDS = 1.0
+    _MAX_RETRY_AFTER = 60
+
+    def __init__(
+        self,
+        model_name: str,
+        max_concurrency: int,
+        max_queue_size: int = 0,
+        queue_timeout: float = 30.0,
+    ):
+        self._model_name = model_name
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_queue_size = max(0, max_queue_size)
+        self._queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        self._in_flight = 0
+        self._queued = 0
+        self._avg_service = self._INITIAL_SERVICE_SECONDS
+        self._total_wait = 0.0
+        self._stats = LimiterStats(
+            model_name=model_name,
+            max_concurrency=self._max_concurrency,
+            max_queue_size=self._max_queue_size,
+        )
+
+    def retry_after(self) -> int:
+        """按平均服务时长估算排在队尾的请求还需要等待的秒数"""
+        estimate = self._avg_service * (self._queued + 1) / self._max_concurrency
+        return min(self._MAX_RETRY_AFTER, max(1, math.ceil(estimate)))
+
+    def is_full(self) -> bool:
+        """没有空闲槽位且等待队列已满"""
+        return (
+            self._in_flight >= self._max_concurrency
+            and self._queued >= self._max_queue_size
+        )
+
+    def check(self):
+        """准入检查：没有空闲槽位且队列已满时立即拒绝"""
+        if self.is_full():
+            self._stats.rejected += 1
+            raise ProviderOverloadedError(self._model_name, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """占用一个并发槽位直到退出上下文 (必要时排队等待)"""
+        self.check()
+
+        start = time.perf_counter()
+        self._queued += 1
+        try:
+            if self._queue_timeout > 0:
+                await asyncio.wait_for(self._semaphore.acquire(), self._queue_timeout)
+            else:
+                await self._semaphore.acquire()
+        except asyncio.TimeoutError:
+            self._stats.timed_out += 1
+            raise ProviderOverloadedError(self._model_name, self.retry_after())
+        finally:
+            self._queued -= 1
+
+        waited = time.perf_counter() - start
+        self._stats.admitted += 1
+        self._total_wait += waited
+        self._stats.max_wait_ms = max(self._stats.max_wait_ms, int(waited * 1000))
+
+        self._in_flight += 1
+        acquired_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+            service = time.perf_counter() - acquired_at
+            self._avg_service += self._EWMA_ALPHA * (service - self._avg_service)
+
+    def stats(self) -> LimiterStats:
+        self._stats.in_flight = self._in_flight
+        self._stats.queued = self._queued
+        self._stats.avg_service_ms = self._avg_service * 1000
+        if self._stats.admitted:
+            self._stats.avg_wait_ms = self._total_wait / self._stats.admitted * 1000
+        return self._stats.model_copy()
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.schemas.chat import Message
+from app.core.logger import log
+
+# OpenAI 文档中的经验值：每条消息在角色、分隔符上额外消耗约 4 个 token，回复前缀约 3 个
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+
+
+def _estimate_tokens(text: str) -> int:
+    """
+    tiktoken 编码表不可用时的粗略估算：
+    非 ASCII 字符 (中文等) 按每字 1 个 token，ASCII 按每 4 个字符 1 个 token
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_count = len(text) - non_ascii
+    return non_ascii + (ascii_count + 3) // 4
+
+
+class ContextBuilder:
+    """
+    基于 token 预算的上下文构建器
+    保留系统提示词以及能放进预算的最近若干条消息，使长会话的 Prompt 大小有上限。
+    每条消息的 token 数随消息持久化 (token_count 列)，并按 message_id 缓存，
+    避免每轮重新分词整段历史。
+    """
+
+    def __init__(
+        self, encoding_name: Optional[str] = "cl100k_base", cache_size: int = 100_000
+    ):
+        """
+        :param encoding_name: tiktoken 编码名称，为 None 时只使用粗略估算
+        :param cache_size: 缓存 token 数的消息条数上限
+        """
+        self._encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_loaded = encoding_name is None
+        self._cache_size = cache_size
+        self._token_cache: "OrderedDict[str, int]" = OrderedDict()
+
+    def warm_up(self):
+        """
+        加载 tiktoken 编码表 (首次加载可能需要读盘或联网下载，属于阻塞操作，
+        建议通过 asyncio.to_thread 在启动阶段调用)
+        """
+        if self._encoding_loaded:
+            return
+        self._encoding_loaded = True
+        try:
+            import tiktoken
+
+            self._encoding = tiktoken.get_encoding(self._encoding_name)
+            log.info(f"ContextBuilder: tiktoken 编码表 {self._encoding_name} 加载成功")
+        except Exception as e:
+            log.warning(f"ContextBuilder: tiktoken 编码表加载失败，改用粗略估算: {e}")
+
+    def count_tokens(self, text: str) -> int:
+        """计算一段文本的 token 数"""
+        if not self._encoding_loaded:
+            self.warm_up()
+        if self._encoding is None:
+            return _estimate_tokens(text)
+        # 用户输入可能包含 <|endoftext|> 之类的特殊标记，按普通文本处理
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def content_tokens(self, message: Message) -> int:
+        """
+        计算消息内容的 token 数：优先使用落库时持久化的 token_count，
+        其次使用按 message_id 缓存的结果，最后才真正分词
+        """
+        if message.token_count is not None:
+            return message.token_count
+
+        cached = self._token_cache.get(message.message_id)
+        if cached is not None:
+            self._token_cache.move_to_end(message.message_id)
+            return cached
+
+        tokens = self.count_tokens(message.content)
+        self._token_cache[message.message_id] = tokens
+        if len(self._token_cache) > self._cache_size:
+            self._token_cache.popitem(last=False)
+        return tokens
+
+    def message_tokens(self, message: Message) -> int:
+        """计算单条消息占用的上下文 token 数 (含消息格式开销)"""
+        return self.content_tokens(message) + _TOKENS_PER_MESSAGE
+
+    def build(
+        self,
+        messages: List[Message],
+        system_prompt: str = "",
+        max_context_tokens: int = 0,
+        reserve_tokens: int = 0,
+    ) -> List[Message]:
+        """
+        从最新的消息开始向前挑选，直到放不下为止
+        :param max_context_tokens: 上下文窗口预算，<= 0 表示不限制
+        :param reserve_tokens: 为模型回复预留的 token 数 (通常为 max_tokens)
+        :return: 按时间顺序排列的、能放入预算的最近消息；最新一条消息总会被保留
+        """
+        if max_context_tokens <= 0 or not messages:
+            return messages
+
+        budget = max_context_tokens - reserve_tokens - _TOKENS_PER_REPLY
+        if system_prompt:
+            budget -= self.count_tokens(system_prompt) + _TOKENS_PER_MESSAGE
+
+        selected = 0
+        for message in reversed(messages):
+            tokens = self.message_tokens(message)
+            # 最新一条 (即本轮提问) 即使超出预算也必须保留
+            if selected and tokens > budget:
+                break
+            budget -= tokens
+            selected += 1
+
+        if selected < len(messages):
+            log.info(
+                f"ContextBuilder: 上下文超出预算，保留最近 {selected}/{len(messages)} 条消息"
+            )
+        return messages[len(messages) - selected :]
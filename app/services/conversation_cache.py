@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from app.schemas.chat import Message
+
+# 估算单条消息在内存中的固定开销 (Pydantic 对象、ID、时间戳等)，按字节计
+_MESSAGE_OVERHEAD_BYTES = 256
+_SESSION_OVERHEAD_BYTES = 256
+
+
+def _estimate_message_bytes(message: Message) -> int:
+    return _MESSAGE_OVERHEAD_BYTES + len(message.content.encode("utf-8"))
+
+
+class _CacheEntry:
+    __slots__ = ("messages", "version", "nbytes")
+
+    def __init__(self, messages: List[Message], version: int):
+        self.messages = messages
+        self.version = version  # 缓存时会话的 update_time
+        self.nbytes = _SESSION_OVERHEAD_BYTES + sum(
+            _estimate_message_bytes(m) for m in messages
+        )
+
+
+# 缓存统计信息
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    current_bytes: int = 0
+    max_bytes: int = 0
+
+
+class ConversationCache:
+    """
+    进程内的会话消息 LRU 缓存
+    按估算的字节数淘汰最久未使用的会话；
+    每个条目记录缓存时的会话版本号 (sessions.update_time)，
+    读取方需先用数据库中的最新版本号校验，版本不一致即视为失效，
+    从而在多个 uvicorn worker 共享同一数据库时依然保证正确。
+    会话元数据行本身就是校验版本号时读取的那一行，因此不重复缓存。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._current_bytes = 0
+        self._stats = CacheStats(max_bytes=max_bytes)
+
+    def get(self, session_id: str, version: int) -> Optional[_CacheEntry]:
+        """按版本号读取缓存，版本不一致时丢弃旧条目并返回 None"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self._stats.misses += 1
+            return None
+        if entry.version != version:
+            self._stats.misses += 1
+            self.invalidate(session_id)
+            return None
+
+        self._entries.move_to_end(session_id)
+        self._stats.hits += 1
+        return entry
+
+    def put(self, session_id: str, messages: List[Message], version: int):
+        """缓存一个会话的消息列表 (从数据库完整加载之后调用)"""
+        self.invalidate(session_id, count=False)
+        self._insert(session_id, _CacheEntry(list(messages), version))
+
+    def append(
+        self,
+        session_id: str,
+        messages: List[Message],
+        version: int,
+        prior_count: int,
+    ):
+        """
+        写穿 (write-through)：把刚落库的消息追加到缓存中
+        prior_count 是写入前数据库中的消息条数，与缓存不一致说明错过了其他进程的写入，直接失效
+        """
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return
+        self._current_bytes -= entry.nbytes
+
+        if len(entry.messages) != prior_count or version <= entry.version:
+            self._stats.invalidations += 1
+            return
+
+        entry.messages.extend(messages)
+        entry.version = version
+        entry.nbytes += sum(_estimate_message_bytes(m) for m in messages)
+        self._insert(session_id, entry)
+
+    def invalidate(self, session_id: str, count: bool = True):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._current_bytes -= entry.nbytes
+            if count:
+                self._stats.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._current_bytes = 0
+
+    def stats(self) -> CacheStats:
+        self._stats.entries = len(self._entries)
+        self._stats.current_bytes = self._current_bytes
+        return self._stats.model_copy()
+
+    def _insert(self, session_id: str, entry: _CacheEntry):
+        # 单个会话超过整体预算时不缓存
+        if entry.nbytes > self._max_bytes:
+            return
+        self._entries[session_id] = entry
+        self._current_bytes += entry.nbytes
+        while self._current_bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._current_bytes -= evicted.nbytes
+            self._stats.evictions += 1
@@ -0,0 +1,60 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncGenerator, Awaitable, Callable
+
+from app.core.logger import log
+
+# 检查客户端是否断开的间隔 (秒)
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 上游流结束的哨兵
+_END = object()
+
+
+async def stream_until_disconnected(
+    stream: AsyncGenerator[str, None],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_interval: float = DISCONNECT_POLL_INTERVAL,
+) -> AsyncGenerator[str, None]:
+    """
+    转发 stream 的输出，并在客户端断开时主动取消上游
+    服务端只有在写下一个 chunk 失败时才会发现连接已断开，上游迟迟不出字时会一直占用
+    并发槽位并继续消耗 token；因此由后台任务每 poll_interval 秒检查一次 is_disconnected()
+    (例如 Request.is_disconnected)，断开后立即取消正在进行的读取并关闭 stream。
+    stream 在独立的任务中消费，其 finally (如持久化已生成的部分回复) 不受调用方取消的影响；
+    本生成器被提前关闭时同样会取消上游
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async with aclosing(stream) as source:
+                async for chunk in source:
+                    queue.put_nowait(chunk)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END)
+
+    async def watch():
+        while not await is_disconnected():
+            await asyncio.sleep(poll_interval)
+        log.info("stream_until_disconnected: client disconnected, cancelling upstream")
+        producer.cancel()
+
+    producer = asyncio.create_task(pump())
+    watcher = asyncio.create_task(watch())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        watcher.cancel()
+        producer.cancel()
+        await asyncio.gather(producer, watcher, return_exceptions=True)
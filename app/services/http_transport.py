@@ -0,0 +1,97 @@
+"""
+长连接 HTTP 客户端工厂
+每个 Provider 持有自己的连接池，复用 TCP/TLS 连接，避免每个请求都重新握手
+- httpx.AsyncClient：支持 HTTP/2 多路复用 (需要 h2)
+- aiohttp.ClientSession：HTTP/1.1 下吞吐更高，也是 litellm 默认使用的传输层
+"""
+
+import os
+import ssl
+from typing import Optional
+
+import aiohttp
+import certifi
+import httpx
+
+from app.core.config import settings
+from app.core.logger import log
+
+
+def http2_available() -> bool:
+    """HTTP/2 依赖可选的 h2 包 (pip install "httpx[http2]")"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_async_client(
+    *,
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+    http2: Optional[bool] = None,
+    timeout: Optional[float] = None,
+    connect_timeout: Optional[float] = None,
+    trust_env: bool = True,
+) -> httpx.AsyncClient:
+    """
+    创建带连接池的异步 HTTP 客户端，未指定的参数使用 settings 中的 LLM_HTTP_* 配置
+    调用方负责在不再使用时 await client.aclose()
+    """
+    if http2 is None:
+        http2 = settings.LLM_HTTP2
+    if http2 and not http2_available():
+        log.warning("http_transport: h2 is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections or settings.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=(
+            max_keepalive_connections or settings.LLM_HTTP_MAX_KEEPALIVE
+        ),
+        keepalive_expiry=(
+            keepalive_expiry
+            if keepalive_expiry is not None
+            else settings.LLM_HTTP_KEEPALIVE_EXPIRY
+        ),
+    )
+    # 生成回复可能很慢，读超时要足够长；连接超时则应尽快失败
+    timeout_config = httpx.Timeout(
+        timeout or settings.LLM_HTTP_TIMEOUT,
+        connect=connect_timeout or settings.LLM_HTTP_CONNECT_TIMEOUT,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout_config,
+        http2=http2,
+        trust_env=trust_env,
+        follow_redirects=True,
+    )
+
+
+def build_aiohttp_session(
+    *,
+    max_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+) -> aiohttp.ClientSession:
+    """
+    创建带连接池的 aiohttp 会话 (只支持 HTTP/1.1)，未指定的参数使用 settings 中的配置
+    必须在事件循环中调用；调用方负责在不再使用时 await session.close()
+    """
+    # 与 httpx 保持一致：优先信任 SSL_CERT_FILE 指定的证书，否则使用 certifi
+    ssl_context = ssl.create_default_context(
+        cafile=os.environ.get("SSL_CERT_FILE") or certifi.where()
+    )
+    connector = aiohttp.TCPConnector(
+        limit=max_connections or settings.LLM_HTTP_MAX_CONNECTIONS,
+        keepalive_timeout=(
+            keepalive_expiry
+            if keepalive_expiry is not None
+            else settings.LLM_HTTP_KEEPALIVE_EXPIRY
+        ),
+        ttl_dns_cache=300,
+        ssl=ssl_context,
+    )
+    return aiohttp.ClientSession(connector=connector)
@@ -1,14 +1,372 @@
-from typing import Dict, List, Any, AsyncGenerator
+import asyncio
+import time
+from contextlib import aclosing, nullcontext
+from typing import Callable, Dict, List, Any, AsyncGenerator, Optional
 
-from app.schemas.chat import Message, ModelInfo
-from app.services.llm_provider import LLMProvider
+from app.schemas.chat import LLMUsage, Message, ModelInfo
+from app.services.llm_provider import LLMProvider, is_error_reply
+from app.services.response_cache import ResponseCache, make_cache_key
+from app.services.single_flight import SingleFlight
+from app.services.concurrency import ConcurrencyLimiter, ProviderOverloadedError
+from app.services.circuit_breaker import OPEN
+from app.services.routing import ModelRoute, TTFTTracker, hedged_stream
 from app.core.logger import log
 
+# 缓存命中时，流式接口按该字数切分回放
+REPLAY_CHUNK_CHARS = 8
+# 候选模型至少积累这么多 TTFT 样本后，才会因为过慢被调整到路由末尾
+MIN_TTFT_SAMPLES = 5
+
 
 class LLMManager:
-    def __init__(self):
+    def __init__(
+        self,
+        response_cache: Optional[ResponseCache] = None,
+        single_flight: bool = False,
+    ):
+        """
+        :param response_cache: 可选的回复缓存，上下文完全相同的请求直接返回缓存的回复
+        :param single_flight: 是否合并同时进行中的相同请求，只向上游发送一次
+        """
         self._providers: Dict[str, LLMProvider] = {}
         self._model_infos: Dict[str, ModelInfo] = {}
+        self._response_cache = response_cache
+        self._single_flight = SingleFlight() if single_flight else None
+        # 各模型的并发限制器 (未配置的模型不限制)
+        self._limiters: Dict[str, ConcurrencyLimiter] = {}
+        # 逻辑模型的备用路由，以及各模型滑动窗口内的首 token 时间
+        self._routes: Dict[str, ModelRoute] = {}
+        self._ttft: Dict[str, TTFTTracker] = {}
+        # 后台健康检查任务
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def response_cache(self) -> Optional[ResponseCache]:
+        return self._response_cache
+
+    @property
+    def single_flight(self) -> Optional[SingleFlight]:
+        return self._single_flight
+
+    def _request_key(
+        self, model_name: str, messages: List[Message], request_param: Dict[str, Any]
+    ) -> Optional[str]:
+        """
+        请求指纹，供回复缓存与请求合并共用
+        两者都未启用，或请求显式传入 "cache": False 时返回 None
+        """
+        if self._response_cache is None and self._single_flight is None:
+            return None
+        if not request_param.get("cache", True):
+            return None
+        return make_cache_key(model_name, messages, request_param)
+
+    @staticmethod
+    def _record_shared_usage(
+        provider: LLMProvider, request_param: Dict[str, Any], start_time: float
+    ):
+        """命中缓存或合并到其他请求时没有自己的上游调用，token 用量记为 0"""
+        sink = request_param.get("usage")
+        if sink is not None:
+            sink.model = provider.get_model_name()
+            sink.latency_ms = int((time.perf_counter() - start_time) * 1000)
+
+    def set_concurrency_limit(
+        self,
+        model_name: str,
+        max_concurrency: int,
+        max_queue_size: int = 0,
+        queue_timeout: float = 30.0,
+    ):
+        """设置模型的并发上限与等待队列长度，max_concurrency <= 0 表示不限制"""
+        if max_concurrency <= 0:
+            self._limiters.pop(model_name, None)
+            return
+        self._limiters[model_name] = ConcurrencyLimiter(
+            model_name, max_concurrency, max_queue_size, queue_timeout
+        )
+        log.info(
+            f"LLMManager: concurrency limit for {model_name} = {max_concurrency} "
+            f"(queue {max_queue_size})"
+        )
+
+    def check_admission(self, model_name: str):
+        """
+        准入检查：模型的并发与等待队列均已占满时抛出 ProviderOverloadedError
+        配置了备用路由时，只有所有候选都已占满才拒绝
+        流式接口需要在开始输出 (发送响应头) 之前调用，以便返回 503
+        """
+        route = self._routes.get(model_name)
+        names = route.candidates if route else [model_name]
+        limiters = [self._limiters.get(name) for name in names]
+        if any(limiter is None or not limiter.is_full() for limiter in limiters):
+            return
+        limiters[0].check()
+
+    def has_concurrency_limits(self) -> bool:
+        return bool(self._limiters)
+
+    def _slot(self, model_name: str):
+        """占用模型的一个并发槽位；未配置限制时为空上下文"""
+        limiter = self._limiters.get(model_name)
+        return limiter.slot() if limiter is not None else nullcontext()
+
+    def set_route(
+        self, model_name: str, fallback_models: List[str], hedge_after_ms: int = 0
+    ):
+        """
+        为逻辑模型配置按优先级排列的备用模型
+        :param hedge_after_ms: 首 token 超过该时间仍未到达时向下一个候选发起对冲请求，0 表示只在出错时切换
+        """
+        fallbacks = [name for name in fallback_models if name != model_name]
+        if not fallbacks:
+            self._routes.pop(model_name, None)
+            return
+        self._routes[model_name] = ModelRoute(
+            model_name=model_name,
+            candidates=[model_name] + fallbacks,
+            hedge_after_ms=hedge_after_ms,
+        )
+        log.info(
+            f"LLMManager: route for {model_name} = {[model_name] + fallbacks} "
+            f"(hedge after {hedge_after_ms} ms)"
+        )
+
+    def _ttft_tracker(self, model_name: str) -> TTFTTracker:
+        tracker = self._ttft.get(model_name)
+        if tracker is None:
+            tracker = self._ttft[model_name] = TTFTTracker(model_name)
+        return tracker
+
+    def _ordered_candidates(self, route: ModelRoute) -> List[str]:
+        """
+        可用的候选模型，保持配置顺序；
+        滑动窗口内 TTFT 中位数已超过对冲时限的候选调整到末尾，避免每次都先等它超时
+        """
+        available = [name for name in route.candidates if self._usable(name)]
+        if route.hedge_after_ms <= 0:
+            return available
+
+        def is_slow(name: str) -> bool:
+            tracker = self._ttft.get(name)
+            return (
+                tracker is not None
+                and tracker.samples >= MIN_TTFT_SAMPLES
+                and tracker.percentile(0.5) > route.hedge_after_ms
+            )
+
+        # sorted 是稳定排序，同一档内保持配置顺序
+        return sorted(available, key=is_slow)
+
+    def metrics(self) -> Dict[str, Any]:
+        """并发限制、路由与首 token 时间、回复缓存与请求合并的统计信息"""
+        return {
+            "limiters": [
+                limiter.stats().model_dump() for limiter in self._limiters.values()
+            ],
+            "routes": [route.model_dump() for route in self._routes.values()],
+            "ttft": [tracker.stats().model_dump() for tracker in self._ttft.values()],
+            "breakers": [
+                {"model_name": name, **provider.circuit_breaker.stats().model_dump()}
+                for name, provider in self._providers.items()
+            ],
+            "response_cache": (
+                self._response_cache.stats().model_dump()
+                if self._response_cache
+                else None
+            ),
+            "single_flight": (
+                self._single_flight.stats().model_dump()
+                if self._single_flight
+                else None
+            ),
+        }
+
+    async def _fetch(
+        self,
+        provider: LLMProvider,
+        model_name: str,
+        messages: List[Message],
+        request_param: Dict[str, Any],
+        cache_key: Optional[str],
+    ) -> str:
+        """向上游发送全量请求 (受并发限制)，由该模型自身给出的成功回复写入缓存"""
+        # 实际给出回复的模型 (由备用模型回复时不写入缓存，避免之后的相同请求长期拿到备用模型的回复)
+        served: List[str] = []
+        if model_name in self._routes:
+            # 配置了备用路由时同样走流式，才能按首 token 时间对冲
+            async with aclosing(
+                self._route_stream(model_name, messages, request_param, served.append)
+            ) as stream:
+                response = "".join([chunk async for chunk in stream])
+        else:
+            async with self._slot(model_name):
+                response = await self._guarded_send(
+                    model_name, provider, messages, request_param
+                )
+        if (
+            cache_key
+            and self._response_cache
+            and response
+            and not is_error_reply(response)
+            and (not served or served[0] == model_name)
+        ):
+            await self._response_cache.put(cache_key, model_name, response)
+        return response
+
+    async def _fetch_stream(
+        self,
+        provider: LLMProvider,
+        model_name: str,
+        messages: List[Message],
+        request_param: Dict[str, Any],
+        cache_key: Optional[str],
+    ) -> AsyncGenerator[str, None]:
+        """向上游发送流式请求，由该模型自身给出的完整且未出错的回复写入缓存"""
+        caching = bool(cache_key and self._response_cache)
+        chunks = []
+        failed = False
+        served: List[str] = []
+        if model_name in self._routes:
+            source = self._route_stream(model_name, messages, request_param, served.append)
+        else:
+            source = self._provider_stream(model_name, provider, messages, request_param)
+        async with aclosing(source) as stream:
+            async for chunk in stream:
+                if caching:
+                    chunks.append(chunk)
+                    failed = failed or is_error_reply(chunk)
+                yield chunk
+
+        # 客户端中途断开 (上游被取消) 时不会执行到这里
+        if caching and chunks and not failed and (not served or served[0] == model_name):
+            await self._response_cache.put(cache_key, model_name, "".join(chunks))
+
+    async def _guarded_send(
+        self,
+        model_name: str,
+        provider: LLMProvider,
+        messages: List[Message],
+        request_param: Dict[str, Any],
+    ) -> str:
+        """单个 Provider 的全量请求：熔断时直接返回错误，否则把结果反馈给熔断器"""
+        breaker = provider.circuit_breaker
+        with breaker.attempt() as allowed:
+            if not allowed:
+                return f"Error: Model {model_name} circuit open."
+            try:
+                response = await provider.send_message(messages, request_param)
+            except Exception as e:
+                breaker.record_failure(repr(e))
+                raise
+            if is_error_reply(response):
+                breaker.record_failure(response[:100])
+            else:
+                breaker.record_success()
+            return response
+
+    async def _provider_stream(
+        self,
+        model_name: str,
+        provider: LLMProvider,
+        messages: List[Message],
+        request_param: Dict[str, Any],
+    ) -> AsyncGenerator[str, None]:
+        """
+        单个 Provider 的流式请求：整个流期间占用并发槽位，记录首 token 时间，
+        并把结果反馈给熔断器 (被取消的流不计入)
+        """
+        breaker = provider.circuit_breaker
+        tracker = self._ttft_tracker(model_name)
+        with breaker.attempt() as allowed:
+            if not allowed:
+                yield f"Error: Model {model_name} circuit open."
+                return
+
+            start_time = time.perf_counter()
+            first = True
+            failure = None
+            try:
+                async with self._slot(model_name):
+                    async with aclosing(
+                        provider.send_message_stream(messages, request_param)
+                    ) as stream:
+                        async for chunk in stream:
+                            if is_error_reply(chunk):
+                                failure = failure or chunk.strip()[:100]
+                            if first:
+                                first = False
+                                if failure:
+                                    tracker.record_error()
+                                else:
+                                    tracker.record(
+                                        int((time.perf_counter() - start_time) * 1000)
+                                    )
+                            yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                # 被对冲取消或客户端断开：以已等待的时间作为 TTFT 的下界
+                if first:
+                    tracker.record(int((time.perf_counter() - start_time) * 1000))
+                raise
+            except ProviderOverloadedError:
+                raise
+            except Exception as e:
+                breaker.record_failure(repr(e))
+                raise
+
+            if failure:
+                breaker.record_failure(failure)
+            else:
+                breaker.record_success()
+
+    async def _route_stream(
+        self,
+        model_name: str,
+        messages: List[Message],
+        request_param: Dict[str, Any],
+        on_served: Optional[Callable[[str], None]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        按备用路由发送流式请求：首 token 超时则对冲，出错则切换，输出最先响应的候选
+        :param on_served: 流结束时以实际给出回复的模型名调用
+        """
+        route = self._routes[model_name]
+        candidates = self._ordered_candidates(route)
+        if not candidates:
+            yield f"Error: Model {model_name} not available."
+            return
+
+        # 每个候选使用独立的用量记录，结束后把胜者的用量写回调用方
+        sink: Optional[LLMUsage] = request_param.get("usage")
+        params = [
+            dict(request_param, usage=LLMUsage()) if sink is not None else request_param
+            for _ in candidates
+        ]
+        attempts = [
+            lambda name=name, param=param: self._provider_stream(
+                name, self._providers[name], messages, param
+            )
+            for name, param in zip(candidates, params)
+        ]
+        winners: List[int] = []
+        try:
+            async with aclosing(
+                hedged_stream(attempts, route.hedge_after_ms / 1000, winners.append)
+            ) as stream:
+                async for chunk in stream:
+                    yield chunk
+        finally:
+            if winners:
+                winner = winners[0]
+                if candidates[winner] != model_name:
+                    log.info(
+                        f"LLMManager: {model_name} served by fallback {candidates[winner]}"
+                    )
+                if on_served is not None:
+                    on_served(candidates[winner])
+                if sink is not None:
+                    for field, value in params[winner]["usage"]:
+                        setattr(sink, field, value)
 
     def register_provider(self, model_name: str, provider: LLMProvider) -> bool:
         """
@@ -61,13 +419,61 @@ class LLMManager:
         return is_success
 
     def get_available_models(self) -> List[ModelInfo]:
-        """获取所有可用模型"""
+        """获取所有可用模型 (健康检查未通过或已熔断的模型不列出)"""
         models = []
-        for info in self._model_infos.values():
-            if info.is_available:
+        for model_name, info in self._model_infos.items():
+            breaker = self._providers[model_name].circuit_breaker
+            if info.is_available and breaker.state != OPEN:
                 models.append(info)
         return models
 
+    def _usable(self, model_name: str) -> bool:
+        """已初始化、最近一次健康检查通过且熔断器放行"""
+        provider = self._providers.get(model_name)
+        return (
+            provider is not None
+            and provider.is_available
+            and self.is_model_available(model_name)
+            and provider.circuit_breaker.allows_request()
+        )
+
+    async def check_health(self, timeout: float = 5.0) -> Dict[str, bool]:
+        """对所有已初始化的模型做一轮健康检查，并更新 ModelInfo.is_available"""
+        names = [name for name, provider in self._providers.items() if provider.is_available]
+        results = await asyncio.gather(*(self._probe(name, timeout) for name in names))
+        health = dict(zip(names, results))
+        for model_name, healthy in health.items():
+            info = self._model_infos[model_name]
+            if info.is_available != healthy:
+                log.warning(
+                    f"LLMManager: {model_name} is now {'healthy' if healthy else 'unhealthy'}"
+                )
+            info.is_available = healthy
+        return health
+
+    async def _probe(self, model_name: str, timeout: float) -> bool:
+        try:
+            return await asyncio.wait_for(
+                self._providers[model_name].health_check(), timeout
+            )
+        except Exception as e:
+            log.warning(f"LLMManager: health check of {model_name} failed: {e!r}")
+            return False
+
+    def start_health_checks(self, interval: float, timeout: float = 5.0):
+        """启动后台健康检查任务 (interval <= 0 时不启动)，close() 时停止"""
+        if interval <= 0 or self._health_task is not None:
+            return
+        self._health_task = asyncio.create_task(self._health_loop(interval, timeout))
+
+    async def _health_loop(self, interval: float, timeout: float):
+        while True:
+            try:
+                await self.check_health(timeout)
+            except Exception as e:
+                log.error(f"LLMManager: health check round failed: {e}")
+            await asyncio.sleep(interval)
+
     def is_model_available(self, model_name: str) -> bool:
         """检查模型是否可用"""
         info = self._model_infos.get(model_name)
@@ -84,14 +490,36 @@ class LLMManager:
             )
             return ""
 
-        if not provider.is_available:
+        # 未通过健康检查时快速失败 (熔断在实际调用前检查)；配置了备用路由时，可以由备用模型响应
+        if not self.is_model_available(model_name) and model_name not in self._routes:
             log.error(
                 f"LLMManager.send_message: model not available, model_name = {model_name}"
             )
             return ""
 
+        start_time = time.perf_counter()
+        cache_key = self._request_key(model_name, messages, request_param)
+        if cache_key and self._response_cache:
+            cached = await self._response_cache.get(cache_key)
+            if cached is not None:
+                log.info(f"LLMManager.send_message: cache hit, model_name = {model_name}")
+                self._record_shared_usage(provider, request_param, start_time)
+                return cached
+
         # 路由转发
-        return await provider.send_message(messages, request_param)
+        if cache_key and self._single_flight:
+            # 已有相同请求在进行中时直接等待它的结果
+            shared = self._single_flight.in_flight(cache_key)
+            response = await self._single_flight.do(
+                cache_key,
+                lambda: self._fetch(
+                    provider, model_name, messages, request_param, cache_key
+                ),
+            )
+            if shared:
+                self._record_shared_usage(provider, request_param, start_time)
+            return response
+        return await self._fetch(provider, model_name, messages, request_param, cache_key)
 
     async def send_message_stream(
         self, model_name: str, messages: List[Message], request_param: Dict[str, Any]
@@ -108,16 +536,61 @@ class LLMManager:
             yield f"Error: Provider {model_name} not found."
             return
 
-        if not provider.is_available:
+        # 未通过健康检查时快速失败 (熔断在实际调用前检查)；配置了备用路由时，可以由备用模型响应
+        if not self.is_model_available(model_name) and model_name not in self._routes:
             log.error(
                 f"LLMManager.send_message_stream: model not available, model_name = {model_name}"
             )
             yield f"Error: Model {model_name} not available."
             return
 
-        # 路由转发流式数据流
-        async for chunk in provider.send_message_stream(messages, request_param):
-            yield chunk
+        start_time = time.perf_counter()
+        cache_key = self._request_key(model_name, messages, request_param)
+        if cache_key and self._response_cache:
+            cached = await self._response_cache.get(cache_key)
+            if cached is not None:
+                log.info(
+                    f"LLMManager.send_message_stream: cache hit, model_name = {model_name}"
+                )
+                self._record_shared_usage(provider, request_param, start_time)
+                # 按小段回放，保持与上游流式输出相同的形态
+                for i in range(0, len(cached), REPLAY_CHUNK_CHARS):
+                    yield cached[i : i + REPLAY_CHUNK_CHARS]
+                    await asyncio.sleep(0)
+                return
+
+        upstream = lambda: self._fetch_stream(  # noqa: E731
+            provider, model_name, messages, request_param, cache_key
+        )
+        if not (cache_key and self._single_flight):
+            # 路由转发流式数据流 (显式关闭，调用方提前关闭时立即释放槽位并取消上游)
+            async with aclosing(upstream()) as stream:
+                async for chunk in stream:
+                    yield chunk
+            return
+
+        # 已有相同的流式请求在进行中时订阅它：先回放已产生的 chunk，再跟随后续输出
+        shared = self._single_flight.in_flight(cache_key)
+        async with aclosing(self._single_flight.stream(cache_key, upstream)) as stream:
+            async for chunk in stream:
+                yield chunk
+        if shared:
+            self._record_shared_usage(provider, request_param, start_time)
+
+    async def close(self):
+        """停止健康检查并关闭所有 Provider 的连接池"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for model_name, provider in self._providers.items():
+            try:
+                await provider.close()
+            except Exception as e:
+                log.error(f"LLMManager.close: close {model_name} failed: {e}")
 
 
 # 导出全局单例 LLMManager
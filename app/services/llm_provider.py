@@ -1,6 +1,23 @@
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, AsyncGenerator
-from app.schemas.chat import Message  
+from typing import List, Dict, Any, AsyncGenerator, Optional
+from app.schemas.chat import Message, LLMUsage
+from app.services.circuit_breaker import CircuitBreaker
+from app.core.config import settings
+
+
+def _usage_field(usage: Any, name: str) -> Any:
+    """兼容对象形式 (litellm) 与字典形式 (原始 JSON) 的 usage"""
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def is_error_reply(text: str) -> bool:
+    """Provider 出错时以文本形式返回错误信息 (而不是抛异常)，用于区分正常回复"""
+    return text.startswith("Error:") or text.startswith("\n[Stream Error:")
 
 
 # LLM 抽象基类
@@ -10,6 +27,11 @@ class LLMProvider(ABC):
         self._is_available: bool = False
         self._api_key: str = ""
         self._endpoint: str = ""
+        # 连续失败后熔断，避免请求堆积在不可用的节点上
+        self._circuit_breaker = CircuitBreaker(
+            failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=settings.LLM_BREAKER_RESET_SECONDS,
+        )
 
     @abstractmethod
     async def init_model(self, model_config: Dict[str, Any]) -> bool:
@@ -21,6 +43,22 @@ class LLMProvider(ABC):
         """检测模型是否有效，用 @property 装饰器变成属性调用"""
         return self._is_available
 
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        """由 LLMManager 在每次调用前后更新"""
+        return self._circuit_breaker
+
+    async def health_check(self) -> bool:
+        """
+        轻量健康检查 (不消耗 token)，由 LLMManager 的后台任务定期调用
+        默认只反映初始化结果，子类可以覆盖为真实的网络探测
+        """
+        return self._is_available
+
+    async def close(self):
+        """释放 Provider 持有的网络连接等资源 (服务关闭时调用)"""
+        pass
+
     @abstractmethod
     def get_model_name(self) -> str:
         """获取模型名称"""
@@ -38,9 +76,34 @@ class LLMProvider(ABC):
         """
         发送消息 - 全量返回
         注意：在 FastAPI 中网络请求必须用 async/await，防止阻塞主线程
+        如果 request_param 中带有 "usage" (LLMUsage)，调用结束后需要把用量写入其中
         """
         pass
 
+    def _record_usage(
+        self, request_param: Dict[str, Any], usage: Any, start_time: float
+    ):
+        """
+        将 OpenAI 格式的 usage 写入 request_param["usage"] (调用方未提供时忽略)
+        :param start_time: 请求开始时的 time.perf_counter()，用于计算耗时
+        """
+        sink: Optional[LLMUsage] = request_param.get("usage")
+        if sink is None:
+            return
+
+        sink.model = self.get_model_name()
+        sink.latency_ms = int((time.perf_counter() - start_time) * 1000)
+        if usage is None:
+            return
+
+        sink.prompt_tokens = _usage_field(usage, "prompt_tokens") or 0
+        sink.completion_tokens = _usage_field(usage, "completion_tokens") or 0
+        # OpenAI 放在 prompt_tokens_details.cached_tokens，DeepSeek 使用 prompt_cache_hit_tokens
+        cached = _usage_field(_usage_field(usage, "prompt_tokens_details"), "cached_tokens")
+        if cached is None:
+            cached = _usage_field(usage, "prompt_cache_hit_tokens")
+        sink.cached_tokens = cached or 0
+
     @abstractmethod
     async def send_message_stream(
         self, messages: List[Message], request_param: Dict[str, Any]
@@ -48,5 +111,6 @@ class LLMProvider(ABC):
         """
         发送消息 - 增量返回 - 流式响应
         通过 async for chunk in provider.send_message_stream(...) 来获取数据。
+        流结束时同样需要把最后一个 chunk 中的用量写入 request_param["usage"]
         """
         pass
@@ -0,0 +1,211 @@
+import json
+import time
+import httpx
+from typing import List, Dict, Any, AsyncGenerator, Optional
+
+from app.schemas.chat import Message
+from app.services.llm_provider import LLMProvider
+from app.services.http_transport import build_async_client
+from app.core.config import settings
+from app.core.logger import log
+
+# 说 OpenAI chat-completions 协议的提供商及其官方地址 (Ollama 必须显式配置 endpoint)
+OPENAI_COMPATIBLE_BASES = {
+    "openai": "https://api.openai.com/v1",
+    "deepseek": "https://api.deepseek.com",
+    "ollama": "",
+}
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    直接基于 httpx 调用 OpenAI 兼容接口的 Provider (DeepSeek / OpenAI / Ollama)
+    与 UnifiedLLMProvider 相比不经过 litellm：不需要导入 litellm，
+    流式响应时逐行解析 SSE，每个 chunk 只做一次 json.loads
+    """
+
+    def __init__(self, provider_type: str, model_name: str, model_desc: str = ""):
+        """
+        :param provider_type: 提供商标识，必须是 OPENAI_COMPATIBLE_BASES 中的一个
+        :param model_name: 具体的模型名，例如 "gpt-4o", "deepseek-chat", "llama3"
+        """
+        super().__init__()
+        self._provider_type = provider_type.lower()
+        if self._provider_type not in OPENAI_COMPATIBLE_BASES:
+            raise ValueError(f"provider {provider_type} is not OpenAI compatible")
+        self._raw_model_name = model_name
+        self._model_desc = model_desc
+        self._url = ""
+        self._models_url = ""
+
+        # 长连接池：init_model 时创建，close 时释放
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    async def init_model(self, model_config: Dict[str, Any]) -> bool:
+        """提取 api_key / endpoint，并创建长连接池"""
+        self._api_key = model_config.get("api_key", "")
+        self._endpoint = model_config.get("endpoint", "")
+
+        base = self._endpoint or OPENAI_COMPATIBLE_BASES[self._provider_type]
+        if not base:
+            log.error(
+                f"[{self._provider_type}/{self._raw_model_name}] Ollama requires an endpoint (base_url)."
+            )
+            return False
+        base = base.rstrip("/")
+        # Ollama 的 OpenAI 兼容接口挂在 /v1 下
+        if self._provider_type == "ollama" and not base.endswith("/v1"):
+            base += "/v1"
+        self._url = f"{base}/chat/completions"
+        self._models_url = f"{base}/models"
+
+        if self._provider_type != "ollama" and not self._api_key:
+            log.warning(
+                f"[{self._provider_type}/{self._raw_model_name}] Initialized without API Key. May fail if required."
+            )
+
+        # 重复初始化时先释放旧的连接池
+        await self.close()
+        self._http_client = build_async_client()
+
+        self._is_available = True
+        log.info(
+            f"Initialized OpenAI Compatible Provider: {self._raw_model_name} | URL: {self._url}"
+        )
+        return True
+
+    async def close(self):
+        """关闭长连接池"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = None
+
+    async def health_check(self) -> bool:
+        """GET /models：检查节点可达且 API Key 有效，不消耗 token"""
+        if not self._is_available:
+            return False
+        try:
+            response = await self._http_client.get(
+                self._models_url,
+                headers=self._headers(),
+                timeout=settings.LLM_HEALTH_CHECK_TIMEOUT,
+            )
+        except httpx.HTTPError as e:
+            log.warning(f"[{self._raw_model_name}] Health check failed: {e!r}")
+            return False
+        if response.status_code >= 400:
+            log.warning(
+                f"[{self._raw_model_name}] Health check failed: HTTP {response.status_code}"
+            )
+            return False
+        return True
+
+    def get_model_name(self) -> str:
+        return self._raw_model_name
+
+    def get_model_desc(self) -> str:
+        return self._model_desc
+
+    def _build_payload(
+        self, messages: List[Message], request_param: Dict[str, Any], stream: bool
+    ) -> Dict[str, Any]:
+        """构造 chat-completions 请求体，系统提示词置于最前端"""
+        formatted = []
+        system_prompt = request_param.get("system_prompt", "")
+        if system_prompt:
+            formatted.append({"role": "system", "content": system_prompt})
+        formatted.extend({"role": msg.role, "content": msg.content} for msg in messages)
+
+        payload = {
+            "model": self._raw_model_name,
+            "messages": formatted,
+            "temperature": float(request_param.get("temperature", 0.7)),
+            "max_tokens": int(request_param.get("max_tokens", 2048)),
+            "stream": stream,
+        }
+        if stream:
+            # 要求在最后一个 chunk 中返回用量
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _headers(self) -> Dict[str, str]:
+        if self._api_key:
+            return {"Authorization": f"Bearer {self._api_key}"}
+        return {}
+
+    async def send_message(
+        self, messages: List[Message], request_param: Dict[str, Any]
+    ) -> str:
+        """发送消息 - 全量返回"""
+        if not self.is_available:
+            log.error(f"[{self._raw_model_name}] Model not available.")
+            return ""
+
+        start_time = time.perf_counter()
+        try:
+            response = await self._http_client.post(
+                self._url,
+                json=self._build_payload(messages, request_param, stream=False),
+                headers=self._headers(),
+            )
+            response.raise_for_status()
+            data = response.json()
+
+            reply_content = data["choices"][0]["message"]["content"]
+            self._record_usage(request_param, data.get("usage"), start_time)
+            log.info(f"[{self._raw_model_name}] Response: {reply_content[:50]}...")
+            return reply_content
+
+        except Exception as e:
+            log.error(f"[{self._raw_model_name}] Request Error: {str(e)}")
+            return f"Error: {str(e)}"
+
+    async def send_message_stream(
+        self, messages: List[Message], request_param: Dict[str, Any]
+    ) -> AsyncGenerator[str, None]:
+        """发送消息 - 流式返回，逐行解析 SSE 的 data 字段"""
+        if not self.is_available:
+            log.error(f"[{self._raw_model_name}] Model not available for streaming.")
+            yield "Error: Model not available."
+            return
+
+        start_time = time.perf_counter()
+        usage = None
+        try:
+            async with self._http_client.stream(
+                "POST",
+                self._url,
+                json=self._build_payload(messages, request_param, stream=True),
+                headers=self._headers(),
+            ) as response:
+                if response.status_code >= 400:
+                    body = await response.aread()
+                    raise RuntimeError(
+                        f"HTTP {response.status_code}: {body.decode(errors='replace')[:200]}"
+                    )
+
+                async for line in response.aiter_lines():
+                    # 空行为事件分隔符，":" 开头为注释 (如 DeepSeek 的 keep-alive)
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    # 最后一个 chunk 携带用量，且可能没有 choices
+                    usage = chunk.get("usage") or usage
+                    choices = chunk.get("choices")
+                    if not choices:
+                        continue
+                    content = choices[0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+
+        except Exception as e:
+            log.error(f"[{self._raw_model_name}] Stream Error: {str(e)}")
+            yield f"\n[Stream Error: {str(e)}]"
+
+        finally:
+            # 流被提前关闭时也记录耗时，便于排查
+            self._record_usage(request_param, usage, start_time)
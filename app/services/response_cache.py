@@ -0,0 +1,117 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.schemas.chat import Message
+from app.core.logger import log
+
+
+def make_cache_key(
+    model_name: str, messages: List[Message], request_param: Dict[str, Any]
+) -> str:
+    """
+    以 (模型, 系统提示词, 完整上下文, temperature, max_tokens) 的哈希作为缓存键
+    任何一项不同都视为不同的请求
+    """
+    payload = json.dumps(
+        [
+            model_name,
+            request_param.get("system_prompt", ""),
+            [(m.role, m.content) for m in messages],
+            float(request_param.get("temperature", 0.7)),
+            int(request_param.get("max_tokens", 2048)),
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 回复缓存统计信息
+class ResponseCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    store_hits: int = 0  # 其中来自持久层的命中数
+    evictions: int = 0
+    expirations: int = 0
+    entries: int = 0
+    max_entries: int = 0
+
+
+class ResponseCache:
+    """
+    模型回复的精确匹配缓存 (LRU + TTL)
+    内存层按条数淘汰最久未使用的条目；可选的持久层 (DataManager) 在重启后依然有效，
+    内存未命中时查询持久层，命中后提升回内存。
+    只适合上下文完全相同的请求，例如会话开场白之后的第一个问题。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 3600, store=None):
+        """
+        :param store: 可选的持久层，需提供 get_cached_response / save_cached_response
+        """
+        self._max_entries = max(1, max_entries)
+        self._ttl = ttl_seconds
+        self._store = store
+        # key -> (回复内容, 过期时间戳)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._stats = ResponseCacheStats(max_entries=self._max_entries)
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            content, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return content
+            del self._entries[key]
+            self._stats.expirations += 1
+
+        if self._store is not None:
+            try:
+                stored = await self._store.get_cached_response(key, int(now))
+            except Exception as e:
+                log.error(f"ResponseCache: read store failed: {e}")
+                stored = None
+            if stored is not None:
+                # 提升回内存时沿用持久层记录的过期时间，不重新计算完整的 TTL
+                content, expires_at = stored
+                self._insert(key, content, expires_at)
+                self._stats.hits += 1
+                self._stats.store_hits += 1
+                return content
+
+        self._stats.misses += 1
+        return None
+
+    async def put(self, key: str, model_name: str, content: str):
+        now = time.time()
+        self._insert(key, content, now + self._ttl)
+        if self._store is not None:
+            try:
+                await self._store.save_cached_response(
+                    key, model_name, content, int(now), int(now + self._ttl)
+                )
+            except Exception as e:
+                log.error(f"ResponseCache: write store failed: {e}")
+
+    def clear(self):
+        """只清空内存层"""
+        self._entries.clear()
+
+    def stats(self) -> ResponseCacheStats:
+        self._stats.entries = len(self._entries)
+        return self._stats.model_copy()
+
+    def _insert(self, key: str, content: str, expires_at: float):
+        self._entries[key] = (content, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._stats.evictions += 1
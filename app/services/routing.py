@@ -0,0 +1,150 @@
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from app.services.llm_provider import is_error_reply
+from app.core.logger import log
+
+
+# 单个 Provider 的首 token 时间 (TTFT) 统计
+class TTFTStats(BaseModel):
+    model_name: str
+    samples: int = 0
+    p50_ms: Optional[int] = None
+    p95_ms: Optional[int] = None
+    errors: int = 0  # 首个 chunk 即为错误的次数
+
+
+class TTFTTracker:
+    """
+    滑动窗口内的首 token 时间统计
+    被对冲取消 (尚未产生首 token) 的请求以已等待的时间计入，作为其 TTFT 的下界
+    """
+
+    def __init__(self, model_name: str, window: int = 50):
+        self._model_name = model_name
+        self._samples: deque = deque(maxlen=window)
+        self._errors = 0
+
+    def record(self, ttft_ms: int):
+        self._samples.append(ttft_ms)
+
+    def record_error(self):
+        self._errors += 1
+
+    @property
+    def samples(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[int]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> TTFTStats:
+        return TTFTStats(
+            model_name=self._model_name,
+            samples=len(self._samples),
+            p50_ms=self.percentile(0.5),
+            p95_ms=self.percentile(0.95),
+            errors=self._errors,
+        )
+
+
+# 逻辑模型的路由：按优先级排列的候选模型 (第一个为主模型) 与对冲时限
+class ModelRoute(BaseModel):
+    model_name: str
+    candidates: List[str]
+    hedge_after_ms: int = 0  # 首 token 超过该时间仍未到达时向下一个候选发起对冲请求，0 表示只在出错时切换
+
+
+async def _discard(task: asyncio.Task, stream: AsyncGenerator):
+    """取消尚未完成的首 chunk 等待并关闭对应的流 (会连带取消上游请求)"""
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    await stream.aclose()
+
+
+async def hedged_stream(
+    attempts: List[Callable[[], AsyncGenerator[str, None]]],
+    hedge_after: float,
+    on_winner: Optional[Callable[[int], None]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    对冲请求：按顺序启动候选流，只输出最先给出有效首 chunk 的那一个
+    - 当前所有候选在 hedge_after 秒内都没有首 chunk 时，启动下一个候选 (对冲)
+    - 候选的首 chunk 为错误 (或抛出异常) 时立即切换到下一个候选 (故障转移)
+    - 选出胜者后取消其余候选
+    全部失败时输出最后一个错误；若最后的失败是异常 (如过载)，则原样抛出
+    :param attempts: 按优先级排列的流工厂
+    :param hedge_after: 对冲时限 (秒)，<= 0 表示不对冲
+    :param on_winner: 选出胜者时回调其下标
+    """
+    remaining = list(enumerate(attempts))
+    pending: Dict[asyncio.Task, tuple] = {}
+    winner: Optional[AsyncGenerator] = None
+    first_chunk = ""
+    last_error: Optional[str] = None
+    last_exception: Optional[BaseException] = None
+
+    def launch():
+        index, factory = remaining.pop(0)
+        stream = factory()
+        pending[asyncio.ensure_future(stream.__anext__())] = (index, stream)
+
+    try:
+        launch()
+        while pending and winner is None:
+            timeout = hedge_after if remaining and hedge_after > 0 else None
+            done, _ = await asyncio.wait(
+                pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                log.info(f"hedged_stream: no first token after {hedge_after}s, hedging")
+                launch()
+                continue
+
+            for task in done:
+                index, stream = pending.pop(task)
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    chunk = None
+                except Exception as e:
+                    chunk, last_exception = None, e
+                if chunk and not is_error_reply(chunk):
+                    if winner is None:
+                        winner, first_chunk = stream, chunk
+                        if on_winner:
+                            on_winner(index)
+                        continue
+                elif chunk:
+                    last_error, last_exception = chunk, None
+                await stream.aclose()
+
+            # 已启动的候选全部失败：立即切换到下一个
+            if winner is None and not pending and remaining:
+                launch()
+    finally:
+        for task, (_, stream) in list(pending.items()):
+            await _discard(task, stream)
+
+    if winner is None:
+        if last_exception is not None:
+            raise last_exception
+        if last_error:
+            yield last_error
+        return
+
+    try:
+        yield first_chunk
+        async for chunk in winner:
+            yield chunk
+    finally:
+        await winner.aclose()
@@ -2,7 +2,7 @@ import time
 from typing import List, Optional
 from uuid import uuid4
 
-from app.schemas.chat import Session, Message
+from app.schemas.chat import Session, Message, SessionSummary, ConversationSummary
 from app.core.logger import log
 
 
@@ -11,10 +11,20 @@ class SessionManager:
     无状态会话管理器 (Stateless Session Manager)
     所有的数据真实来源直接依赖 DataManager
     完全支持多进程/多实例部署 (Gunicorn/Uvicorn workers > 1)
+
+    可选挂载进程内的 ConversationCache：每次读取前仍会用 sessions.update_time 校验版本，
+    因此多进程部署下同样正确；不挂载时 (默认) 保持完全无状态
     """
 
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, write_behind=None, cache=None):
+        """
+        :param data_manager: 数据库管理器
+        :param write_behind: 可选的 MessageWriteBehind，提供后消息写入将与其他并发请求合并提交
+        :param cache: 可选的 ConversationCache，提供后会话消息列表将缓存在进程内
+        """
         self._data_manager = data_manager
+        self._write_behind = write_behind
+        self._cache = cache
 
     def _generate_id(self, prefix: str) -> str:
         """
@@ -25,8 +35,8 @@ class SessionManager:
         short_uuid = uuid4().hex[:8]  # 取 8 位 UUID
         return f"{prefix}_{current_time}_{short_uuid}"
 
-    async def create_session(self, model_name: str) -> str:
-        """创建新会话并直接落库"""
+    async def create_session(self, model_name: str, greeting: str = "") -> str:
+        """创建新会话并直接落库，如果提供了开场白则与会话在同一事务中写入"""
         session_id = self._generate_id("session")
 
         session = Session(
@@ -37,7 +47,13 @@ class SessionManager:
         )
 
         # 直接持久化到底层数据库
-        await self._data_manager.insert_session(session)
+        if greeting:
+            greeting_msg = self._stamp_message(
+                Message(role="assistant", content=greeting)
+            )
+            await self._data_manager.create_session_with_greeting(session, greeting_msg)
+        else:
+            await self._data_manager.insert_session(session)
         log.info(f"Created new stateless session: {session_id}")
         return session_id
 
@@ -49,32 +65,113 @@ class SessionManager:
             return None
 
         # 装载该会话的历史消息
-        session.messages = await self._data_manager.get_session_messages(session_id)
+        session.messages = await self._load_messages(session)
         return session
 
-    async def add_message(self, session_id: str, message: Message) -> bool:
-        """为会话添加一条新消息"""
-        # 验证会话是否存在
-        if not await self._data_manager.get_session(session_id):
-            log.warning(f"add_message failed: Session {session_id} does not exist.")
-            return False
+    async def _load_messages(self, session: Session) -> List[Message]:
+        """
+        装载会话的全部消息：缓存中的版本与数据库中的 update_time 一致时直接复用，
+        否则从数据库加载并回填缓存
+        """
+        if self._cache is None:
+            return await self._data_manager.get_session_messages(session.session_id)
+
+        entry = self._cache.get(session.session_id, session.updated_at)
+        if entry is not None:
+            return list(entry.messages)
+
+        messages = await self._data_manager.get_session_messages(session.session_id)
+        self._cache.put(session.session_id, messages, session.updated_at)
+        return list(messages)
 
-        # 完善消息属性
+    def _stamp_message(self, message: Message, keep_timestamp: bool = False) -> Message:
+        """完善消息属性：生成全局唯一的消息 ID，并打上时间戳"""
         new_msg = message.model_copy()
         new_msg.message_id = self._generate_id("msg")
-        new_msg.timestamp = int(time.time())
+        if not keep_timestamp:
+            new_msg.timestamp = int(time.time())
+        return new_msg
+
+    async def _append(self, session_id: str, messages: List[Message]) -> bool:
+        """融合写入：存在性检查、消息插入与会话时间戳更新在同一个事务中完成"""
+        if self._write_behind:
+            # 合并提交：与其他并发请求的写入共享同一个事务
+            result = await self._write_behind.submit(session_id, messages)
+        else:
+            result = await self._data_manager.append_messages(session_id, messages)
+
+        if result is None:
+            log.warning(f"append failed: Session {session_id} does not exist.")
+            if self._cache is not None:
+                self._cache.invalidate(session_id)
+            return False
 
-        # 消息落库
-        await self._data_manager.insert_message(session_id, new_msg)
-        # 更新会话的最后活跃时间
-        await self._data_manager.update_session_timestamp(session_id, new_msg.timestamp)
+        # 写穿缓存，避免下一轮对话再从数据库读取刚写入的消息
+        if self._cache is not None:
+            self._cache.append(session_id, messages, result.version, result.prior_count)
+        return True
+
+    async def add_message(self, session_id: str, message: Message) -> bool:
+        """为会话添加一条新消息"""
+        new_msg = self._stamp_message(message)
+        if not await self._append(session_id, [new_msg]):
+            return False
 
         log.info(f"Added message to DB session {session_id}: {new_msg.content[:20]}...")
         return True
 
-    async def get_history_messages(self, session_id: str) -> List[Message]:
-        """直接从数据库拉取历史消息"""
-        return await self._data_manager.get_session_messages(session_id)
+    async def append_exchange(
+        self,
+        session_id: str,
+        user_msg: Message,
+        assistant_msg: Optional[Message] = None,
+    ) -> bool:
+        """
+        一次性写入一轮对话 (用户提问 + 可选的助手回复)
+        保留消息创建时的时间戳，使提问时间早于回复时间
+        """
+        messages = [self._stamp_message(user_msg, keep_timestamp=True)]
+        if assistant_msg is not None:
+            messages.append(self._stamp_message(assistant_msg, keep_timestamp=True))
+
+        if not await self._append(session_id, messages):
+            return False
+
+        log.info(
+            f"Appended {len(messages)} message(s) to DB session {session_id}: "
+            f"{user_msg.content[:20]}..."
+        )
+        return True
+
+    async def get_history_messages(
+        self,
+        session_id: str,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Message]:
+        """直接从数据库拉取历史消息 (after/limit 用于增量分页)"""
+        if self._cache is not None and after is None and limit is None:
+            session = await self._data_manager.get_session(session_id)
+            return await self._load_messages(session) if session else []
+        return await self._data_manager.get_session_messages(session_id, after, limit)
+
+    async def get_session_version(self, session_id: str) -> Optional[int]:
+        """获取会话版本号 (即 update_time)，会话不存在时为 None"""
+        return await self._data_manager.get_session_version(session_id)
+
+    async def get_session_model_name(self, session_id: str) -> Optional[str]:
+        """获取会话所属的模型名称，会话不存在时为 None"""
+        return await self._data_manager.get_session_model_name(session_id)
+
+    async def get_conversation_summary(
+        self, session_id: str
+    ) -> Optional[ConversationSummary]:
+        """获取会话的滚动摘要"""
+        return await self._data_manager.get_conversation_summary(session_id)
+
+    async def save_conversation_summary(self, summary: ConversationSummary) -> bool:
+        """保存会话的滚动摘要"""
+        return await self._data_manager.save_conversation_summary(summary)
 
     async def get_session_list(self) -> List[str]:
         """获取数据库中按时间排序的所有 Session ID"""
@@ -83,13 +180,23 @@ class SessionManager:
         db_sessions = await self._data_manager.get_all_sessions()
         return [s.session_id for s in db_sessions]
 
+    async def get_session_summaries(
+        self, limit: Optional[int] = None, offset: int = 0
+    ) -> List[SessionSummary]:
+        """获取会话列表摘要 (单条 SQL 聚合消息条数与首条用户消息)"""
+        return await self._data_manager.get_session_summaries(limit, offset)
+
     async def delete_session(self, session_id: str) -> bool:
         """删除会话"""
         await self._data_manager.delete_session(session_id)
+        if self._cache is not None:
+            self._cache.invalidate(session_id)
         log.info(f"Deleted session from DB: {session_id}")
         return True
 
     async def clear_all_sessions(self):
         """清空数据库中的所有会话"""
         await self._data_manager.clear_all_sessions()
+        if self._cache is not None:
+            self._cache.clear()
         log.info("All DB sessions cleared.")
@@ -0,0 +1,144 @@
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from app.core.logger import log
+
+
+# 请求合并统计信息
+class SingleFlightStats(BaseModel):
+    leaders: int = 0  # 实际发往上游的请求数
+    followers: int = 0  # 合并到已有请求上的请求数
+    cancelled: int = 0  # 所有订阅者都离开后被取消的上游请求数
+    in_flight: int = 0
+
+
+class _Call:
+    """一次全量请求：所有等待者共享同一个任务"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamCall:
+    """一次流式请求：上游 chunk 写入 chunks，订阅者从头回放并继续跟随"""
+
+    __slots__ = ("task", "chunks", "done", "error", "subscribers", "changed")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # 换一个新的 Event，已在等待旧 Event 的订阅者全部被唤醒
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """
+    合并同时进行中的相同请求 (single-flight)
+    同一个 key 同一时刻只有一个上游调用：
+    - 全量请求的等待者共享同一个结果
+    - 流式请求的订阅者先回放已产生的 chunk，再实时接收后续 chunk
+    单个等待者/订阅者被取消不会影响上游调用；只有全部离开后才取消上游，避免浪费 token
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamCall] = {}
+        self._stats = SingleFlightStats()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls or key in self._streams
+
+    def stats(self) -> SingleFlightStats:
+        self._stats.in_flight = len(self._calls) + len(self._streams)
+        return self._stats.model_copy()
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 (或加入正在执行的) 全量请求"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self._stats.leaders += 1
+        else:
+            self._stats.followers += 1
+
+        call.waiters += 1
+        try:
+            # shield：等待者被取消时不会连带取消共享的任务
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+                self._stats.cancelled += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    async def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncGenerator[str, None]:
+        """订阅 (或发起) 流式请求，从第一个 chunk 开始回放"""
+        call = self._streams.get(key)
+        if call is None:
+            call = _StreamCall()
+            self._streams[key] = call
+            call.task = asyncio.create_task(self._pump(key, call, factory))
+            self._stats.leaders += 1
+        else:
+            self._stats.followers += 1
+
+        call.subscribers += 1
+        try:
+            index = 0
+            while True:
+                if index < len(call.chunks):
+                    yield call.chunks[index]
+                    index += 1
+                    continue
+                if call.done:
+                    break
+                await call.changed.wait()
+            if call.error is not None:
+                raise call.error
+        finally:
+            call.subscribers -= 1
+            # 最后一个订阅者离开 (断开/取消) 且上游尚未结束：取消上游
+            if call.subscribers == 0 and not call.done:
+                call.task.cancel()
+                self._stats.cancelled += 1
+
+    async def _pump(
+        self, key: str, call: _StreamCall, factory: Callable[[], AsyncIterator[str]]
+    ):
+        """后台任务：把上游 chunk 写入共享缓冲区"""
+        try:
+            async for chunk in factory():
+                call.chunks.append(chunk)
+                call.notify()
+        except asyncio.CancelledError:
+            log.info("SingleFlight: upstream stream cancelled (no subscribers left)")
+        except Exception as e:
+            call.error = e
+        finally:
+            call.done = True
+            self._forget(self._streams, key, call)
+            call.notify()
+
+    @staticmethod
+    def _forget(calls: Dict[str, Any], key: str, call: Any):
+        # 只移除自己，避免误删同一 key 上新发起的调用
+        if calls.get(key) is call:
+            del calls[key]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, List, Optional
+
+# 句末标点：合并后的文本在这些字符处立即下发，打字效果按句推进
+SENTENCE_PUNCTUATION = frozenset("。！？；…!?;\n")
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """
+    SSE 数据帧：json.dumps 确保 \\n 被安全转义为 "\\\\n"，前端逐帧 JSON.parse
+    :param event: 事件名，用于区分文本以外的帧 (如语音片段)
+    """
+    frame = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{frame}" if event else frame
+
+
+async def coalesce_chunks(
+    stream: AsyncGenerator[str, None],
+    max_delay_ms: int = 50,
+    max_bytes: int = 256,
+) -> AsyncGenerator[str, None]:
+    """
+    合并模型的增量输出，减少 SSE 帧数 (每帧一次 json.dumps 与一次 socket 写入)
+    模型的增量往往只有一个汉字，逐个下发时一条回复就是上千次小写入；
+    这里把增量攒起来，满足以下任一条件时作为一帧下发：
+    - 距缓冲区中第一个字已过去 max_delay_ms (上游停顿时也会按时下发)
+    - 缓冲区达到 max_bytes (UTF-8 字节数)
+    - 遇到句末标点
+    首个增量立即下发，不增加首字延迟；max_delay_ms <= 0 时原样转发
+    本生成器结束或被关闭时会关闭 stream
+    """
+    if max_delay_ms <= 0:
+        async with aclosing(stream) as source:
+            async for chunk in source:
+                yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    max_delay = max_delay_ms / 1000
+    buffer: List[str] = []
+    size = 0
+    first = True
+    finished = False
+    error: Optional[Exception] = None
+    # 缓冲区可以下发时置位；由上游任务 (字节数/标点/结束) 或定时器 (时限) 触发
+    ready = asyncio.Event()
+    timer: Optional[asyncio.TimerHandle] = None
+
+    async def pump():
+        # 在独立任务中读取上游，每个增量只做追加与判断，不为每个增量创建任务或定时器
+        nonlocal size, first, finished, error, timer
+        try:
+            async with aclosing(stream) as source:
+                async for chunk in source:
+                    if not chunk:
+                        continue
+                    if not buffer and not first:
+                        timer = loop.call_later(max_delay, ready.set)
+                    buffer.append(chunk)
+                    size += len(chunk.encode("utf-8"))
+                    if first or size >= max_bytes or chunk[-1] in SENTENCE_PUNCTUATION:
+                        first = False
+                        ready.set()
+        except Exception as e:
+            error = e
+        finally:
+            finished = True
+            ready.set()
+
+    producer = asyncio.create_task(pump())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            if buffer:
+                text = "".join(buffer)
+                buffer.clear()
+                size = 0
+                yield text
+            if finished and not buffer:
+                break
+        if error is not None:
+            raise error
+    finally:
+        if timer is not None:
+            timer.cancel()
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
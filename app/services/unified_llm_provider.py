@@ -1,8 +1,18 @@
+import time
+import aiohttp
+import httpx
 import litellm
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
 
 from app.schemas.chat import Message
 from app.services.llm_provider import LLMProvider
+from app.services.openai_compatible_provider import OPENAI_COMPATIBLE_BASES
+from app.services.http_transport import (
+    build_aiohttp_session,
+    build_async_client,
+    http2_available,
+)
+from app.core.config import settings
 from app.core.logger import log
 
 
@@ -25,6 +35,58 @@ class UnifiedLLMProvider(LLMProvider):
         else:
             self._litellm_model = f"{self._provider_type}/{self._raw_model_name}"
 
+        # 长连接池：init_model 时创建，close 时释放
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._aiohttp_session: Optional[aiohttp.ClientSession] = None
+        self._litellm_client: Any = None
+
+    def _build_litellm_client(self) -> Any:
+        """
+        创建本 Provider 独占的连接池，并包装成 litellm 的 client 参数
+        - 启用 HTTP/2 (且已安装 h2) 时使用 httpx，同一条 TLS 连接上多路复用
+        - 否则使用 aiohttp (HTTP/1.1 下比 httpx 快，与 litellm 默认传输层一致)
+        OpenAI 走官方 SDK (AsyncOpenAI)，其余提供商走 litellm 自带的 AsyncHTTPHandler
+        """
+        from litellm.llms.custom_httpx.aiohttp_transport import LiteLLMAiohttpTransport
+        from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+        use_http2 = settings.LLM_HTTP2 and http2_available()
+        if use_http2:
+            self._http_client = build_async_client(http2=True)
+        else:
+            self._aiohttp_session = build_aiohttp_session()
+
+        if self._provider_type == "openai":
+            from openai import AsyncOpenAI
+
+            if not use_http2:
+                self._http_client = httpx.AsyncClient(
+                    transport=LiteLLMAiohttpTransport(
+                        client=self._aiohttp_session, owns_session=False
+                    ),
+                    timeout=httpx.Timeout(
+                        settings.LLM_HTTP_TIMEOUT,
+                        connect=settings.LLM_HTTP_CONNECT_TIMEOUT,
+                    ),
+                )
+            return AsyncOpenAI(
+                api_key=self._api_key or "EMPTY",
+                base_url=self._endpoint or None,
+                http_client=self._http_client,
+            )
+
+        if not use_http2:
+            return AsyncHTTPHandler(
+                timeout=settings.LLM_HTTP_TIMEOUT,
+                shared_session=self._aiohttp_session,
+            )
+        handler = AsyncHTTPHandler(timeout=settings.LLM_HTTP_TIMEOUT)
+        # 用支持 HTTP/2 的连接池替换 handler 自建的客户端 (自建的尚未发出请求)。
+        # litellm 没有公开注入 httpx 客户端的参数：requirements 固定了 litellm 版本，
+        # tests/test_llm.py 的 test_provider_litellm_transport_contract 校验这一用法
+        handler.client = self._http_client
+        return handler
+
     async def init_model(self, model_config: Dict[str, Any]) -> bool:
         """统一的初始化逻辑：无论是云端 API 还是本地 Ollama 都在这里提取配置"""
         self._api_key = model_config.get("api_key", "")
@@ -43,12 +105,70 @@ class UnifiedLLMProvider(LLMProvider):
             )
             return False
 
+        # 重复初始化时先释放旧的连接池
+        await self.close()
+        self._litellm_client = self._build_litellm_client()
+
         self._is_available = True
         log.info(
             f"Initialized Unified Provider: {self._litellm_model} | Endpoint: {self._endpoint}"
         )
         return True
 
+    async def close(self):
+        """关闭长连接池"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        if self._aiohttp_session is not None:
+            await self._aiohttp_session.close()
+        self._http_client = None
+        self._aiohttp_session = None
+        self._litellm_client = None
+
+    def _health_check_target(self) -> Optional[tuple]:
+        """健康检查使用的 (URL, 请求头)：各家列出模型的接口，不消耗 token；未知的提供商返回 None"""
+        if self._provider_type == "ollama":
+            return f"{self._endpoint.rstrip('/')}/api/tags", {}
+        if self._provider_type in OPENAI_COMPATIBLE_BASES:
+            base = self._endpoint or OPENAI_COMPATIBLE_BASES[self._provider_type]
+            headers = {"Authorization": f"Bearer {self._api_key}"} if self._api_key else {}
+            return f"{base.rstrip('/')}/models", headers
+        if self._provider_type == "gemini":
+            return (
+                "https://generativelanguage.googleapis.com/v1beta/models",
+                {"x-goog-api-key": self._api_key},
+            )
+        return None
+
+    async def health_check(self) -> bool:
+        """通过 Provider 自己的连接池请求列出模型的接口，检查节点可达且 API Key 有效"""
+        if not self._is_available:
+            return False
+        target = self._health_check_target()
+        if target is None:
+            return True
+        url, headers = target
+        try:
+            if self._aiohttp_session is not None:
+                async with self._aiohttp_session.get(
+                    url,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=settings.LLM_HEALTH_CHECK_TIMEOUT),
+                ) as response:
+                    status = response.status
+            else:
+                response = await self._http_client.get(
+                    url, headers=headers, timeout=settings.LLM_HEALTH_CHECK_TIMEOUT
+                )
+                status = response.status_code
+        except Exception as e:
+            log.warning(f"[{self._litellm_model}] Health check failed: {e!r}")
+            return False
+        if status >= 400:
+            log.warning(f"[{self._litellm_model}] Health check failed: HTTP {status}")
+            return False
+        return True
+
     def get_model_name(self) -> str:
         return self._raw_model_name
 
@@ -79,6 +199,7 @@ class UnifiedLLMProvider(LLMProvider):
 
         system_prompt = request_param.get("system_prompt", "")  # 获取系统提示词
 
+        start_time = time.perf_counter()
         try:
             # 核心：acompletion 是 litellm 的异步通用接口
             # 它会自动把请求翻译成 OpenAI / Gemini / DeepSeek / Ollama 各自所需的底层格式
@@ -90,10 +211,12 @@ class UnifiedLLMProvider(LLMProvider):
                 temperature=float(request_param.get("temperature", 0.7)),
                 max_tokens=int(request_param.get("max_tokens", 2048)),
                 stream=False,
+                client=self._litellm_client,
             )
 
             # 无论底层是哪家大模型，litellm 都会把返回值包装成标准的 OpenAI 格式
             reply_content = response.choices[0].message.content
+            self._record_usage(request_param, getattr(response, "usage", None), start_time)
             log.info(f"[{self._litellm_model}] Response: {reply_content[:50]}...")
             return reply_content
 
@@ -112,6 +235,13 @@ class UnifiedLLMProvider(LLMProvider):
 
         system_prompt = request_param.get("system_prompt", "")  # 获取系统提示词
 
+        extra_params = {}
+        if self._provider_type in ("openai", "deepseek"):
+            # OpenAI 兼容接口需要显式要求在最后一个 chunk 中返回用量
+            extra_params["stream_options"] = {"include_usage": True}
+
+        start_time = time.perf_counter()
+        usage = None
         try:
             # 开启 stream=True
             response_stream = await litellm.acompletion(
@@ -122,11 +252,17 @@ class UnifiedLLMProvider(LLMProvider):
                 temperature=float(request_param.get("temperature", 0.7)),
                 max_tokens=int(request_param.get("max_tokens", 2048)),
                 stream=True,
+                client=self._litellm_client,
+                **extra_params,
             )
 
             # 告别 C++ 的粘包、半包、正则表达式和 JSON 解析
             # litellm 已经在底层处理好了所有 SSE 规范，只需要简单迭代即可
             async for chunk in response_stream:
+                # 最后一个 chunk 携带用量，且可能没有 choices
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
                 # 提取增量内容
                 content = chunk.choices[0].delta.content
                 if content:
@@ -135,3 +271,7 @@ class UnifiedLLMProvider(LLMProvider):
         except Exception as e:
             log.error(f"[{self._litellm_model}] Stream Error: {str(e)}")
             yield f"\n[Stream Error: {str(e)}]"
+
+        finally:
+            # 流被提前关闭时也记录耗时，便于排查
+            self._record_usage(request_param, usage, start_time)
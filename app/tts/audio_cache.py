@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.core.logger import log
+
+# 缓存文件名：64 位十六进制哈希 + 扩展名
+_FILE_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,8}$")
+# 写入时使用的临时文件名："<缓存文件名>.<uuid>.tmp"
+_TMP_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,8}\.[0-9a-f]{32}\.tmp$")
+# 超过该时长的临时文件视为异常退出时的残留 (更新的可能是其它 worker 正在写入的文件)
+_STALE_TMP_SECONDS = 600
+
+# 音频格式 -> Content-Type
+AUDIO_MEDIA_TYPES = {"wav": "audio/wav", "opus": "audio/ogg", "mp3": "audio/mpeg"}
+
+
+def make_audio_key(text: str, **params: Any) -> str:
+    """以 (文本, 合成参数) 的哈希作为音频的内容地址，任何一项不同都视为不同的音频"""
+    payload = json.dumps(
+        [text, sorted(params.items())], ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 音频缓存统计信息
+class AudioCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    files: int = 0
+    bytes: int = 0
+    max_bytes: int = 0
+
+
+class AudioCache:
+    """
+    按内容寻址的语音磁盘缓存 (LRU)
+    文件名为 "<哈希>.<格式>"，总大小超过 max_bytes 时淘汰最久未使用的文件；
+    启动时按文件修改时间重建 LRU 顺序，命中时更新修改时间，重启后淘汰顺序依然有效。
+    目录中其它名字的文件不会被读取或删除。
+    多个 uvicorn worker 可以共用同一目录：其它进程写入的文件在首次访问时加入索引；
+    超出预算时先重新扫描目录，把其它进程写入的文件计入预算再淘汰，
+    磁盘占用不会变成 worker 数 × max_bytes (其它进程的文件视为最久未使用，优先淘汰)
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self._dir = cache_dir
+        self._max_bytes = max(0, max_bytes)
+        # 文件名 -> 字节数，按最近使用排序
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._stats = AudioCacheStats(max_bytes=self._max_bytes)
+        self._load()
+
+    def _load(self):
+        os.makedirs(self._dir, exist_ok=True)
+        self._apply_scan(self._scan())
+        self._evict()
+        log.info(
+            f"AudioCache: loaded {len(self._files)} files ({self._total} bytes) from {self._dir}"
+        )
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        """列出目录中的缓存文件 (修改时间, 文件名, 字节数)，顺带清理过期的临时文件"""
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self._dir):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if _FILE_NAME.match(entry.name):
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+                elif _TMP_NAME.match(entry.name) and now - stat.st_mtime > _STALE_TMP_SECONDS:
+                    # 上次异常退出时残留的临时文件
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # 扫描期间被其它 worker 淘汰或替换
+                continue
+        return entries
+
+    def _apply_scan(self, entries: List[Tuple[float, str, int]]):
+        """
+        以扫描结果同步索引：已知文件保持内存中的 LRU 顺序 (文件修改时间的精度不足以区分相邻的写入)，
+        其它进程写入的文件按修改时间排在最前面，被其它进程删除的文件移出索引
+        """
+        on_disk = {name: size for _, name, size in entries}
+        unknown = [(name, size) for _, name, size in sorted(entries) if name not in self._files]
+        known = [(name, on_disk[name]) for name in self._files if name in on_disk]
+        self._files = OrderedDict(unknown + known)
+        self._total = sum(self._files.values())
+
+    @staticmethod
+    def file_name(key: str, fmt: str = "wav") -> str:
+        return f"{key}.{fmt}"
+
+    @staticmethod
+    def media_type(name: str) -> str:
+        return AUDIO_MEDIA_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+    @staticmethod
+    def is_valid_name(name: str) -> bool:
+        """校验外部传入的文件名，防止路径穿越"""
+        return bool(_FILE_NAME.match(name))
+
+    def get_path(self, name: str) -> Optional[str]:
+        """
+        存在时返回文件路径并标记为最近使用
+        不在索引中的文件可能是其它 worker 写入的：磁盘上存在时加入索引 (超出的预算在下次写入时淘汰)
+        """
+        path = os.path.join(self._dir, name)
+        if name not in self._files:
+            if not _FILE_NAME.match(name):
+                return None
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                return None
+            self._files[name] = size
+            self._total += size
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # 文件在外部被删除
+            self._total -= self._files.pop(name)
+            return None
+        self._files.move_to_end(name)
+        return path
+
+    def lookup(self, name: str) -> bool:
+        """合成前查询缓存，计入命中率"""
+        if self.get_path(name) is None:
+            self._stats.misses += 1
+            return False
+        self._stats.hits += 1
+        return True
+
+    async def put(self, name: str, data: bytes) -> str:
+        """写入 (先写临时文件再原子替换，读者不会看到写了一半的文件)，返回文件路径"""
+        path = os.path.join(self._dir, name)
+        await asyncio.to_thread(self._write_file, path, data)
+        self._total += len(data) - self._files.pop(name, 0)
+        self._files[name] = len(data)
+        if self._total > self._max_bytes:
+            # 其它 worker 写入的文件也占用预算：先同步目录的实际内容再淘汰
+            self._apply_scan(await asyncio.to_thread(self._scan))
+            self._evict()
+        return path
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        # 至少保留刚写入的文件，即使它本身超过了预算
+        while self._total > self._max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._total -= size
+            self._stats.evictions += 1
+            try:
+                os.remove(os.path.join(self._dir, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> AudioCacheStats:
+        self._stats.files = len(self._files)
+        self._stats.bytes = self._total
+        return self._stats.model_copy()
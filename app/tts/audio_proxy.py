@@ -0,0 +1,75 @@
+"""
+音频代理的流式转发
+上游的音频边读边发给浏览器，每个请求只占用一个分块大小的内存；
+浏览器的 Range 请求原样转发给上游，Safari 与移动端的 <audio> 才能拖动进度
+"""
+
+from typing import Optional
+
+import httpx
+from fastapi.responses import StreamingResponse
+
+# 每次转发的分块大小
+PROXY_CHUNK_SIZE = 64 * 1024
+
+# 原样转发给浏览器的上游响应头
+FORWARD_HEADERS = ("content-length", "content-range", "accept-ranges", "etag", "last-modified")
+
+
+class UpstreamAudioResponse(StreamingResponse):
+    """
+    边读上游边发给客户端
+    无论正常结束、出错还是客户端中途断开，都会关闭上游响应，把连接归还连接池
+    """
+
+    def __init__(self, upstream: httpx.Response, chunk_size: int = PROXY_CHUNK_SIZE):
+        content_type = upstream.headers.get("content-type", "")
+        super().__init__(
+            upstream.aiter_raw(chunk_size),
+            status_code=upstream.status_code,
+            headers={k: upstream.headers[k] for k in FORWARD_HEADERS if k in upstream.headers},
+            media_type=content_type if content_type.startswith("audio/") else "audio/wav",
+        )
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+
+async def open_audio_stream(
+    client: httpx.AsyncClient, url: str, range_header: Optional[str] = None
+) -> UpstreamAudioResponse:
+    """
+    向上游发起 (可能带 Range 的) 请求，读到响应头即返回，响应体由 UpstreamAudioResponse 流式转发
+    上游出错时抛出 httpx.HTTPStatusError；416 (范围无效) 原样返回给浏览器
+    """
+    # 要求上游不压缩，Content-Length 与 Content-Range 才与转发的字节一致
+    headers = {"Accept-Encoding": "identity"}
+    if range_header:
+        headers["Range"] = range_header
+    upstream = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+    if upstream.is_error and upstream.status_code != 416:
+        await upstream.aclose()
+        upstream.raise_for_status()
+    return UpstreamAudioResponse(upstream)
+
+
+async def fetch_audio(client: httpx.AsyncClient, url: str, max_bytes: int) -> Optional[bytes]:
+    """
+    完整下载上游音频 (供转码使用)，超过 max_bytes 时放弃并返回 None，内存占用不会超过上限
+    上游出错时抛出 httpx.HTTPStatusError
+    """
+    async with client.stream("GET", url, headers={"Accept-Encoding": "identity"}) as upstream:
+        upstream.raise_for_status()
+        length = upstream.headers.get("content-length")
+        if length is not None and int(length) > max_bytes:
+            return None
+        data = bytearray()
+        async for chunk in upstream.aiter_raw(PROXY_CHUNK_SIZE):
+            data += chunk
+            if len(data) > max_bytes:
+                return None
+        return bytes(data)
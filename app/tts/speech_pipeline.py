@@ -0,0 +1,173 @@
+import asyncio
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncGenerator, Awaitable, Callable, Deque, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from app.services.sse import SENTENCE_PUNCTUATION
+from app.core.logger import log
+
+# 句子过长时退而在这些标点处切分，避免第一句迟迟凑不齐
+CLAUSE_PUNCTUATION = frozenset("，、：,:")
+# 紧跟在句末标点之后、应归属上一句的字符
+CLOSING_MARKS = frozenset("”’」』）)\"'")
+
+
+# 一句话的合成结果，按 index 顺序下发给前端
+class SpeechSegment(BaseModel):
+    index: int
+    text: str
+    audio_url: Optional[str] = None  # 合成失败时为空，前端跳过该句
+
+
+class SentenceSplitter:
+    """
+    把模型的流式增量切分成适合语音合成的句子
+    在句末标点处切分 (太短的句子与下一句合并)；超过 max_chars 仍没有句末标点时在逗号等处切分。
+    标点后紧跟的引号、括号归属上一句，因此位于末尾的标点要等到下一个增量 (或 flush) 才切分
+    """
+
+    def __init__(self, min_chars: int = 4, max_chars: int = 60):
+        self._min_chars = min_chars
+        self._max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """追加增量，返回已经完整的句子"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        i = 0
+        while i < len(self._buffer):
+            ch = self._buffer[i]
+            length = i + 1 - start
+            if (ch in SENTENCE_PUNCTUATION and length >= self._min_chars) or (
+                ch in CLAUSE_PUNCTUATION and length >= self._max_chars
+            ):
+                while i + 1 < len(self._buffer) and self._buffer[i + 1] in CLOSING_MARKS:
+                    i += 1
+                if i + 1 == len(self._buffer):
+                    # 标点后面可能还有引号等尚未到达，等下一个增量再切分
+                    break
+                sentence = self._buffer[start : i + 1].strip()
+                if sentence:
+                    sentences.append(sentence)
+                start = i + 1
+            i += 1
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """流结束时取出剩余的文本"""
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest or None
+
+
+class SpeechPipeline:
+    """
+    边生成边合成：模型输出按句切分，每凑齐一句立即提交合成，最多 max_parallel 句同时合成，
+    合成结果按句子顺序取出。第一句合成完即可开始播放，而不必等整条回复生成完再整段合成
+    """
+
+    def __init__(
+        self,
+        synthesize: Callable[[str], Awaitable[Optional[str]]],
+        max_parallel: int = 2,
+    ):
+        """
+        :param synthesize: 合成一句话并返回音频 URL，例如 XiaoHuTTS.generate_audio
+        """
+        self._synthesize = synthesize
+        self._semaphore = asyncio.Semaphore(max(1, max_parallel))
+        self._splitter = SentenceSplitter()
+        self._pending: Deque[Tuple[int, str, asyncio.Task]] = deque()
+        self._next_index = 0
+        self._stopped = False
+
+    def feed(self, text: str):
+        """追加模型输出；出错信息不参与合成，出现后忽略后续输出"""
+        if self._stopped:
+            return
+        if self._next_index == 0 and text.startswith("Error:"):
+            self._stopped = True
+            return
+        cut = text.find("\n[Stream Error:")
+        if cut >= 0:
+            text, self._stopped = text[:cut], True
+        for sentence in self._splitter.feed(text):
+            self._submit(sentence)
+
+    def _submit(self, sentence: str):
+        task = asyncio.create_task(self._run(sentence))
+        self._pending.append((self._next_index, sentence, task))
+        self._next_index += 1
+
+    async def _run(self, sentence: str) -> Optional[str]:
+        async with self._semaphore:
+            try:
+                return await self._synthesize(sentence)
+            except Exception as e:
+                log.error(f"SpeechPipeline: synthesize failed: {e}")
+                return None
+
+    def ready(self) -> List[SpeechSegment]:
+        """按顺序取出已经合成完的句子 (前面的句子未完成时，后面的即使完成也要等待)"""
+        segments = []
+        while self._pending and self._pending[0][2].done():
+            index, sentence, task = self._pending.popleft()
+            segments.append(SpeechSegment(index=index, text=sentence, audio_url=task.result()))
+        return segments
+
+    async def drain(self) -> AsyncGenerator[SpeechSegment, None]:
+        """模型输出结束后，提交剩余文本并按顺序等待所有句子合成完"""
+        rest = self._splitter.flush()
+        if rest:
+            self._submit(rest)
+        while self._pending:
+            index, sentence, task = self._pending[0]
+            audio_url = await task
+            self._pending.popleft()
+            yield SpeechSegment(index=index, text=sentence, audio_url=audio_url)
+
+    async def interleave(
+        self, chunks: AsyncGenerator[str, None]
+    ) -> AsyncGenerator[Union[str, SpeechSegment], None]:
+        """
+        转发 chunks 的同时 feed 给流水线，句子一合成完就穿插在文本之间输出，
+        而不是等到下一个文本增量到达；chunks 结束后 drain 剩余的句子。本生成器结束或被关闭时会关闭 chunks
+        """
+        async with aclosing(chunks) as source:
+            next_chunk = asyncio.ensure_future(anext(source))
+            try:
+                while True:
+                    waiters = {next_chunk}
+                    if self._pending:
+                        # 只有最前面的句子完成时才有可以输出的片段
+                        waiters.add(self._pending[0][2])
+                    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                    for segment in self.ready():
+                        yield segment
+                    if not next_chunk.done():
+                        continue
+                    try:
+                        chunk = next_chunk.result()
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+                    self.feed(chunk)
+                    next_chunk = asyncio.ensure_future(anext(source))
+            finally:
+                # 提前结束时取消未完成的读取 (已完成的任务不受影响，只取回其结果)
+                next_chunk.cancel()
+                await asyncio.gather(next_chunk, return_exceptions=True)
+        async for segment in self.drain():
+            yield segment
+
+    async def close(self):
+        """取消尚未完成的合成 (客户端断开等情况)"""
+        tasks = [task for _, _, task in self._pending]
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,200 @@
+"""
+语音转码：把 TTS 输出的 wav 转为 Opus / MP3
+语音场景下 Opus 24 kbps、MP3 48 kbps 已足够清晰，体积约为 wav 的 1/10 以下；
+编码由 pydub 调用 ffmpeg 完成，在进程池中执行，不阻塞事件循环
+"""
+
+import io
+import time
+import shutil
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+from app.core.logger import log
+from app.services.single_flight import SingleFlight
+from app.tts.audio_cache import AudioCache
+
+# TTS 服务输出的原始格式
+SOURCE_FORMAT = "wav"
+
+# 格式 -> pydub export 参数 (Opus 使用 Ogg 封装，按语音场景调优)
+_EXPORT_OPTIONS = {
+    "opus": {"format": "ogg", "codec": "libopus", "parameters": ["-application", "voip"]},
+    "mp3": {"format": "mp3", "codec": "libmp3lame"},
+}
+
+# Accept 中明确列出的媒体类型 -> 格式
+_ACCEPT_FORMATS = {
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+}
+
+
+def ffmpeg_available() -> bool:
+    """pydub 依赖系统中的 ffmpeg 完成编码"""
+    return shutil.which("ffmpeg") is not None
+
+
+def negotiate_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    选择返回给客户端的音频格式：format 参数优先，其次取 Accept 中 q 值最高且明确列出的格式；
+    只有通配符 (*/*、audio/*) 或没有列出时返回原始的 wav
+    :raises ValueError: format 参数指定了不支持的格式
+    """
+    if requested:
+        fmt = requested.lower()
+        if fmt != SOURCE_FORMAT and fmt not in _EXPORT_OPTIONS:
+            raise ValueError(f"Unsupported audio format: {requested}")
+        return fmt
+
+    best, best_q = SOURCE_FORMAT, 0.0
+    for part in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        fmt = _ACCEPT_FORMATS.get(media_type.lower())
+        if fmt is None:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # q 值相同时取先列出的
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+def transcode_audio(data: bytes, fmt: str, bitrate: str) -> bytes:
+    """wav -> fmt (在工作进程中执行)"""
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(io.BytesIO(data), format=SOURCE_FORMAT)
+    output = io.BytesIO()
+    segment.export(output, bitrate=bitrate, **_EXPORT_OPTIONS[fmt])
+    return output.getvalue()
+
+
+# 转码统计信息
+class TranscodeStats(BaseModel):
+    transcoded: int = 0
+    failed: int = 0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    seconds: float = 0.0  # 累计转码耗时
+
+
+class AudioTranscoder:
+    """
+    在进程池中把 wav 转为 Opus / MP3
+    转码结果与源音频存放在同一个 AudioCache 中 (同一哈希、不同扩展名)，同一文件只转码一次
+    """
+
+    def __init__(self, max_workers: int = 2, bitrates: Optional[Dict[str, str]] = None):
+        """
+        :param bitrates: 各格式的码率，如 {"opus": "24k", "mp3": "48k"}
+        """
+        self._max_workers = max(1, max_workers)
+        self._bitrates = {"opus": "24k", "mp3": "48k", **(bitrates or {})}
+        # 首次转码时创建，close 时关闭
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 合并同一文件同时进行中的转码
+        self._single_flight = SingleFlight()
+        self._stats = TranscodeStats()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn：主进程中有事件循环与数据库等线程，fork 出的子进程可能继承被占用的锁
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def transcode(self, data: bytes, fmt: str) -> Optional[bytes]:
+        """把 wav 数据转为 fmt 格式，失败时返回 None"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(
+                self.executor, transcode_audio, data, fmt, self._bitrates[fmt]
+            )
+        except Exception as e:
+            self._stats.failed += 1
+            log.error(f"AudioTranscoder: 转码为 {fmt} 失败: {e}")
+            return None
+        self._stats.transcoded += 1
+        self._stats.input_bytes += len(data)
+        self._stats.output_bytes += len(result)
+        self._stats.seconds += time.perf_counter() - start
+        return result
+
+    async def cached_variant(
+        self,
+        cache: AudioCache,
+        key: str,
+        fmt: str,
+        load_source: Optional[Callable[[], Awaitable[Optional[bytes]]]] = None,
+    ) -> Optional[str]:
+        """
+        返回缓存中 key 对应音频的 fmt 格式文件名；不存在时从 wav 源文件转码并写入缓存
+        :param load_source: 源文件不在缓存中时调用，获取 wav 数据 (同样写入缓存)
+        源文件无法获得或转码失败时返回 None
+        """
+        variant = AudioCache.file_name(key, fmt)
+        if cache.get_path(variant):
+            return variant
+        return await self._single_flight.do(
+            variant, lambda: self._transcode_to_cache(cache, key, fmt, load_source)
+        )
+
+    async def _transcode_to_cache(
+        self,
+        cache: AudioCache,
+        key: str,
+        fmt: str,
+        load_source: Optional[Callable[[], Awaitable[Optional[bytes]]]],
+    ) -> Optional[str]:
+        source_name = AudioCache.file_name(key, SOURCE_FORMAT)
+        source = cache.get_path(source_name)
+        data = None
+        if source is not None:
+            try:
+                data = await asyncio.to_thread(Path(source).read_bytes)
+            except FileNotFoundError:
+                pass
+        if data is None:
+            if load_source is None:
+                return None
+            data = await load_source()
+            if data is None:
+                return None
+            await cache.put(source_name, data)
+        result = await self.transcode(data, fmt)
+        if result is None:
+            return None
+        variant = AudioCache.file_name(key, fmt)
+        await cache.put(variant, result)
+        return variant
+
+    def close(self):
+        """关闭进程池 (服务关闭时调用)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def stats(self) -> TranscodeStats:
+        return self._stats.model_copy()
@@ -1,12 +1,25 @@
 import httpx
-from typing import Optional
+from typing import List, Optional
 from app.core.logger import log
 from app.core.config import settings
+from app.services.single_flight import SingleFlight
+from app.services.http_transport import build_async_client
+from app.tts.audio_cache import AudioCache, make_audio_key
 
 
 class XiaoHuTTS:
-    def __init__(self):
+    def __init__(self, audio_cache: Optional[AudioCache] = None):
+        """
+        :param audio_cache: 可选的本地音频缓存，相同文本与参数的语音只向上游合成一次
+        """
         self.api_base = settings.TTS_API_BASE
+        self.audio_cache = audio_cache
+        # 合并同时进行中的相同合成请求
+        self._single_flight = SingleFlight()
+        # 合成与下载音频 (含音频代理) 的长连接池：首次使用时创建，close 时释放；
+        # 两者的系统代理设置相同时共用合成的连接池
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._audio_client: Optional[httpx.AsyncClient] = None
         self.model = "mix_G_71000.pth"
         self.lang = "ZH"
         self.emotion = "Neutral"
@@ -16,6 +29,102 @@ class XiaoHuTTS:
         self.length_scale = 1.0  # 对应 JS 里的 1.0 / uiSpeed
         self.speaker = "ddm"
 
+    @staticmethod
+    def _build_client(trust_env: bool) -> httpx.AsyncClient:
+        return build_async_client(
+            max_connections=settings.TTS_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.TTS_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.TTS_HTTP_KEEPALIVE_EXPIRY,
+            http2=False,
+            # 语音合成可能较慢，设置 60 秒超时
+            timeout=60.0,
+            connect_timeout=settings.LLM_HTTP_CONNECT_TIMEOUT,
+            trust_env=trust_env,
+        )
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """
+        请求合成的长连接客户端，避免每次合成都重新建立 TCP 连接
+        是否经由系统代理 (HTTP(S)_PROXY) 访问由 TTS_HTTP_TRUST_ENV 决定，默认与 httpx 一致
+        """
+        if self._http_client is None:
+            self._http_client = self._build_client(settings.TTS_HTTP_TRUST_ENV)
+        return self._http_client
+
+    @property
+    def audio_client(self) -> httpx.AsyncClient:
+        """
+        下载音频文件 (缓存与音频代理) 的长连接客户端
+        默认绕过系统代理 (TTS_AUDIO_TRUST_ENV=False)；与合成的设置相同时直接使用 http_client
+        """
+        if settings.TTS_AUDIO_TRUST_ENV == settings.TTS_HTTP_TRUST_ENV:
+            return self.http_client
+        if self._audio_client is None:
+            self._audio_client = self._build_client(settings.TTS_AUDIO_TRUST_ENV)
+        return self._audio_client
+
+    async def close(self):
+        """关闭长连接池 (服务关闭时调用)"""
+        for client in (self._http_client, self._audio_client):
+            if client is not None:
+                await client.aclose()
+        self._http_client = None
+        self._audio_client = None
+
+    def cache_key(self, text: str) -> str:
+        """文本与全部合成参数的哈希，参数变化后自然不会命中旧的音频"""
+        return make_audio_key(
+            text,
+            model=self.model,
+            speaker=self.speaker,
+            lang=self.lang,
+            emotion=self.emotion,
+            sdp=self.sdp,
+            noise=self.noise,
+            noise_w=self.noise_w,
+            length_scale=self.length_scale,
+        )
+
+    async def generate_cached(self, text: str) -> Optional[str]:
+        """
+        合成语音并保存到本地缓存，返回缓存文件名 (失败时返回 None)
+        已缓存的文本不再请求上游；需要在构造时提供 audio_cache
+        """
+        if not text or self.audio_cache is None:
+            return None
+        name = AudioCache.file_name(self.cache_key(text))
+        if self.audio_cache.lookup(name):
+            return name
+        return await self._single_flight.do(name, lambda: self._synthesize_to_cache(text, name))
+
+    async def _synthesize_to_cache(self, text: str, name: str) -> Optional[str]:
+        audio_url = await self.generate_audio(text)
+        if not audio_url:
+            return None
+        data = await self._fetch_audio(audio_url)
+        if not data:
+            return None
+        await self.audio_cache.put(name, data)
+        return name
+
+    async def _fetch_audio(self, audio_url: str) -> Optional[bytes]:
+        """下载上游生成的音频文件"""
+        try:
+            response = await self.audio_client.get(audio_url)
+            response.raise_for_status()
+            return response.content
+        except Exception as e:
+            log.error(f"XiaoHuTTS: 下载音频失败: {e}")
+            return None
+
+    async def presynthesize(self, phrases: List[str]):
+        """预先合成常用语句 (如开场白)，之后这些语句不需要再请求上游"""
+        for text in dict.fromkeys(p for p in phrases if p):
+            if await self.generate_cached(text) is None:
+                log.warning(f"XiaoHuTTS: 预合成失败: {text[:20]}...")
+        log.info(f"XiaoHuTTS: 预合成完成，共 {len(phrases)} 条")
+
     async def generate_audio(self, text: str) -> Optional[str]:
         """调用 TTS 接口生成语音，返回音频文件的 URL"""
         if not text:
@@ -38,26 +147,24 @@ class XiaoHuTTS:
         }
 
         try:
-            # 语音合成可能较慢，设置 60 秒超时
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                log.info("XiaoHuTTS: 正在向服务器请求合成语音...")
-                response = await client.post(
-                    f"{self.api_base}/run/predict", json=payload
-                )
-                response.raise_for_status()
-                result = response.json()
-
-                # 解析 Gradio API 返回的数据结构
-                data_list = result.get("data", [])
-                if data_list and len(data_list) > 0:
-                    item = data_list[0]
-                    # 有些接口返回字典 {"name": "/tmp/xx.wav"}，有些直接返回路径字符串
-                    path = item.get("name") if isinstance(item, dict) else item
-
-                    if path:
-                        audio_url = f"{self.api_base}/file={path}"
-                        log.info(f"XiaoHuTTS: 语音合成成功 -> {audio_url}")
-                        return audio_url
+            log.info("XiaoHuTTS: 正在向服务器请求合成语音...")
+            response = await self.http_client.post(
+                f"{self.api_base}/run/predict", json=payload
+            )
+            response.raise_for_status()
+            result = response.json()
+
+            # 解析 Gradio API 返回的数据结构
+            data_list = result.get("data", [])
+            if data_list and len(data_list) > 0:
+                item = data_list[0]
+                # 有些接口返回字典 {"name": "/tmp/xx.wav"}，有些直接返回路径字符串
+                path = item.get("name") if isinstance(item, dict) else item
+
+                if path:
+                    audio_url = f"{self.api_base}/file={path}"
+                    log.info(f"XiaoHuTTS: 语音合成成功 -> {audio_url}")
+                    return audio_url
 
         except Exception as e:
             log.error(f"XiaoHuTTS: 语音合成失败: {e}")
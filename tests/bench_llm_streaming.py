@@ -0,0 +1,102 @@
+"""
+流式响应开销基准：litellm (UnifiedLLMProvider) vs 直连 (OpenAICompatibleProvider)
+- 每个 chunk 的 CPU 开销：本地 OpenAI 兼容服务运行在独立线程中，
+  只统计客户端线程的 CPU 时间 (time.thread_time)
+- 启动开销：在新的解释器中分别导入两个 Provider 模块的耗时
+
+运行方式: python tests/bench_llm_streaming.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.core.logger import log  # noqa: E402
+from app.schemas.chat import Message  # noqa: E402
+from app.services.openai_compatible_provider import OpenAICompatibleProvider  # noqa: E402
+from tests.fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+CHUNKS = 2_000
+REPEAT = 5
+IMPORT_REPEAT = 3
+
+
+def start_server_thread() -> FakeOpenAIServer:
+    """在独立线程的事件循环中运行本地服务，避免服务端的 CPU 计入客户端"""
+    server = FakeOpenAIServer(reply="侬" * CHUNKS)
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return server
+
+
+async def measure_stream(provider) -> float:
+    """取多次运行中的最好成绩，返回每个 chunk 的客户端 CPU 微秒数"""
+    messages = [Message(role="user", content="侬好")]
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.thread_time()
+        count = 0
+        async for _ in provider.send_message_stream(messages, {}):
+            count += 1
+        assert count == CHUNKS, count
+        best = min(best, time.thread_time() - start)
+    return best / CHUNKS * 1_000_000
+
+
+def measure_import(module: str) -> float:
+    """在新的解释器中导入模块，返回最好成绩 (毫秒)"""
+    best = float("inf")
+    for _ in range(IMPORT_REPEAT):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", f"import {module}"],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+async def main():
+    log.remove()  # 关闭日志输出，避免 I/O 影响测量
+    server = start_server_thread()
+
+    from app.services.unified_llm_provider import UnifiedLLMProvider
+
+    providers = [
+        ("litellm", UnifiedLLMProvider("deepseek", "deepseek-chat")),
+        ("direct", OpenAICompatibleProvider("deepseek", "deepseek-chat")),
+    ]
+    print(f"streaming {CHUNKS} chunks (client CPU per chunk, best of {REPEAT})")
+    for name, provider in providers:
+        await provider.init_model({"api_key": "sk-bench", "endpoint": server.base_url})
+        try:
+            print(f"  {name:<8} {await measure_stream(provider):8.1f} us/chunk")
+        finally:
+            await provider.close()
+
+    print(f"startup (import in a fresh interpreter, best of {IMPORT_REPEAT})")
+    for name, module in [
+        ("litellm", "app.services.unified_llm_provider"),
+        ("direct", "app.services.openai_compatible_provider"),
+    ]:
+        print(f"  {name:<8} {measure_import(module):8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+LLM Provider 连接复用基准
+在本地启动 TLS 的 OpenAI 兼容服务 (tests/fake_openai_server.py)，对比：
+- 每个请求新建 httpx 客户端 (每次都要 TCP + TLS 握手)
+- 同一个 build_async_client 长连接池 (只看传输层的差异)
+- UnifiedLLMProvider 不传 client (旧实现，由 litellm 自行管理连接)
+- UnifiedLLMProvider 的长连接池 (init_model 时创建，所有请求复用；
+  未安装 h2 时底层为 aiohttp，与 litellm 默认传输层相同)
+并输出服务端实际建立的连接数
+
+运行方式: python tests/bench_llm_transport.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from app.core.logger import log  # noqa: E402
+from app.schemas.chat import Message  # noqa: E402
+from app.services.http_transport import build_async_client  # noqa: E402
+from app.services.unified_llm_provider import UnifiedLLMProvider  # noqa: E402
+from tests.fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+REQUESTS = 200
+CONCURRENCY = 10
+PAYLOAD = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "侬好"}]}
+
+
+async def run_batch(send_one) -> float:
+    """以固定并发发送 REQUESTS 个请求，返回总耗时 (秒)"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def guarded():
+        async with semaphore:
+            await send_one()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guarded() for _ in range(REQUESTS)))
+    return time.perf_counter() - start
+
+
+async def bench_client_per_request(server: FakeOpenAIServer) -> float:
+    async def send_one():
+        async with httpx.AsyncClient() as client:
+            resp = await client.post(f"{server.base_url}/chat/completions", json=PAYLOAD)
+            resp.raise_for_status()
+
+    return await run_batch(send_one)
+
+
+async def bench_pooled_client(server: FakeOpenAIServer) -> float:
+    client = build_async_client()
+
+    async def send_one():
+        resp = await client.post(f"{server.base_url}/chat/completions", json=PAYLOAD)
+        resp.raise_for_status()
+
+    try:
+        return await run_batch(send_one)
+    finally:
+        await client.aclose()
+
+
+async def bench_provider(server: FakeOpenAIServer, pooled: bool) -> float:
+    provider = UnifiedLLMProvider("deepseek", "deepseek-chat")
+    await provider.init_model({"api_key": "sk-bench", "endpoint": server.base_url})
+    if not pooled:
+        provider._litellm_client = None
+    messages = [Message(role="user", content="侬好")]
+
+    async def send_one():
+        reply = await provider.send_message(messages, {})
+        assert not reply.startswith("Error"), reply
+
+    try:
+        return await run_batch(send_one)
+    finally:
+        await provider.close()
+
+
+async def main():
+    log.remove()  # 关闭日志输出，避免 I/O 影响测量
+
+    for name, bench in [
+        ("client per request", bench_client_per_request),
+        ("pooled client", bench_pooled_client),
+        ("litellm default", lambda s: bench_provider(s, pooled=False)),
+        ("pooled provider", lambda s: bench_provider(s, pooled=True)),
+    ]:
+        server = FakeOpenAIServer(tls=True)
+        await server.start()
+        # 让 httpx 信任本地自签名证书
+        os.environ["SSL_CERT_FILE"] = server.cert_path
+        try:
+            elapsed = await bench(server)
+        finally:
+            await server.close()
+        print(
+            f"{name:<20} {REQUESTS} requests in {elapsed * 1000:8.1f} ms "
+            f"({elapsed * 1000 / REQUESTS:6.2f} ms/req), "
+            f"{server.connections} TLS connections"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
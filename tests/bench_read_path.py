@@ -0,0 +1,102 @@
+"""
+历史消息读路径微基准
+对比两种读取方式在 10 / 1k / 100k 条消息下的耗时：
+- ORM 路径 (旧实现)：select(MessageModel) 构造 ORM 对象，再逐条用 Message(...) 做完整校验
+- Core 路径 (当前 DataManager.get_session_messages)：只选取需要的列，用 model_construct 构造
+
+运行方式: python tests/bench_read_path.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, insert  # noqa: E402
+
+from app.db.data_manager import DataManager  # noqa: E402
+from app.db.models import MessageModel  # noqa: E402
+from app.schemas.chat import Session, Message  # noqa: E402
+
+ROW_COUNTS = [10, 1_000, 100_000]
+REPEAT = 5
+
+
+async def orm_read_path(dm: DataManager, session_id: str):
+    """旧实现：ORM 对象 + Pydantic 完整校验"""
+    async with dm.async_session_maker() as db_session:
+        stmt = (
+            select(MessageModel)
+            .where(MessageModel.session_id == session_id)
+            .order_by(MessageModel.timestamp.asc())
+        )
+        result = await db_session.execute(stmt)
+        return [
+            Message(
+                message_id=msg.message_id,
+                role=msg.role,
+                content=msg.content,
+                timestamp=msg.timestamp,
+            )
+            for msg in result.scalars().all()
+        ]
+
+
+async def core_read_path(dm: DataManager, session_id: str):
+    """当前实现：Core 行元组 + model_construct"""
+    return await dm.get_session_messages(session_id)
+
+
+async def seed(dm: DataManager, session_id: str, count: int):
+    await dm.insert_session(Session(session_id=session_id, model_name="bench"))
+    rows = [
+        {
+            "message_id": f"{session_id}_msg_{i}",
+            "session_id": session_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"侬好，这是第 {i} 条测试消息。" * 4,
+            "timestamp": 1_700_000_000 + i,
+        }
+        for i in range(count)
+    ]
+    async with dm.engine.begin() as conn:
+        await conn.execute(insert(MessageModel), rows)
+
+
+async def measure(func, dm: DataManager, session_id: str) -> float:
+    """取多次运行中的最好成绩，单位毫秒"""
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        await func(dm, session_id)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+async def main():
+    # 关闭 DataManager 的 info 日志，避免日志 I/O 影响测量
+    from loguru import logger
+
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        dm = DataManager(f"sqlite+aiosqlite:///{os.path.join(db_dir, 'bench.db')}")
+        await dm.init_database()
+
+        print(f"{'消息条数':>10}{'ORM 路径(ms)':>16}{'Core 路径(ms)':>16}{'加速比':>10}")
+        for count in ROW_COUNTS:
+            session_id = f"bench_{count}"
+            await seed(dm, session_id, count)
+
+            orm_ms = await measure(orm_read_path, dm, session_id)
+            core_ms = await measure(core_read_path, dm, session_id)
+            print(f"{count:>10}{orm_ms:>16.2f}{core_ms:>16.2f}{orm_ms / core_ms:>9.1f}x")
+
+        await dm.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
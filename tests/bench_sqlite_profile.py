@@ -0,0 +1,100 @@
+"""
+SQLite 连接配置写入吞吐基准
+模拟多路 SSE 并发持久化回复：CONCURRENCY 个协程各自向自己的会话写入 MESSAGES_PER_WORKER 条消息，
+逐项叠加 Settings 中的性能配置，对比每秒写入的消息数。
+
+运行方式: python tests/bench_sqlite_profile.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.data_manager import DataManager  # noqa: E402
+from app.schemas.chat import Session, Message  # noqa: E402
+
+
+CONCURRENCY = 16
+MESSAGES_PER_WORKER = 100
+
+# 逐项叠加的配置，第一项为 SQLite 默认行为 (rollback journal + 每次提交完整 fsync)
+PROFILES = [
+    ("默认 (DELETE + FULL)", {"journal_mode": "DELETE", "synchronous": "FULL"}),
+    ("+ WAL", {"journal_mode": "WAL", "synchronous": "FULL"}),
+    ("+ synchronous=NORMAL", {"journal_mode": "WAL", "synchronous": "NORMAL"}),
+    (
+        "+ mmap_size=256MB",
+        {"journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 268435456},
+    ),
+    (
+        "+ cache_size=64MB",
+        {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 268435456,
+            "cache_size": -65536,
+        },
+    ),
+    (
+        "+ busy_timeout=5s",
+        {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 268435456,
+            "cache_size": -65536,
+            "busy_timeout": 5000,
+        },
+    ),
+]
+
+
+async def _worker(dm: DataManager, session_id: str) -> int:
+    failed = 0
+    for i in range(MESSAGES_PER_WORKER):
+        msg = Message(role="assistant", content=f"回复内容 {i}" * 20)
+        try:
+            await dm.insert_message(session_id, msg)
+        except Exception:
+            # 未配置 busy_timeout 时并发写入可能直接报 database is locked
+            failed += 1
+    return failed
+
+
+async def run_profile(pragmas: dict, db_dir: str, index: int) -> tuple:
+    db_path = os.path.join(db_dir, f"bench_{index}.db")
+    dm = DataManager(f"sqlite+aiosqlite:///{db_path}", pragmas=pragmas)
+    await dm.init_database()
+
+    session_ids = [f"bench_session_{i}" for i in range(CONCURRENCY)]
+    for sid in session_ids:
+        await dm.insert_session(Session(session_id=sid, model_name="bench"))
+
+    start = time.perf_counter()
+    failures = await asyncio.gather(*(_worker(dm, sid) for sid in session_ids))
+    elapsed = time.perf_counter() - start
+
+    await dm.engine.dispose()
+    total = CONCURRENCY * MESSAGES_PER_WORKER
+    return total / elapsed, sum(failures)
+
+
+async def main():
+    # 关闭 DataManager 的 info 日志，避免日志 I/O 影响测量
+    from loguru import logger
+
+    logger.remove()
+
+    print(f"并发写入协程: {CONCURRENCY}，每协程写入: {MESSAGES_PER_WORKER} 条")
+    print(f"{'配置':<24}{'消息/秒':>12}{'失败数':>10}")
+    with tempfile.TemporaryDirectory() as db_dir:
+        for index, (name, pragmas) in enumerate(PROFILES):
+            throughput, failed = await run_profile(pragmas, db_dir, index)
+            print(f"{name:<24}{throughput:>12.1f}{failed:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
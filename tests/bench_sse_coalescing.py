@@ -0,0 +1,111 @@
+"""
+SSE 帧合并基准：逐字下发 vs coalesce_chunks 按时间/字节数/句子合并
+模拟 CONCURRENCY 个并发回复，每个回复由模型按 TOKEN_INTERVAL 逐字输出，
+每帧经过 sse_event 序列化后写入真实的本地 TCP 连接 (接收端运行在独立线程中)，统计：
+- frames/reply：每条回复的帧数 (即 json.dumps 与 socket 写入次数)
+- TTFT：从开始生成到第一帧写出的时间
+- max gap：相邻两帧之间的最大间隔 (p95)，衡量打字效果是否依然流畅
+- CPU：发送端线程的 CPU 时间 (time.thread_time)
+
+运行方式: python tests/bench_sse_coalescing.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.services.sse import coalesce_chunks, sse_event  # noqa: E402
+
+CONCURRENCY = 100
+TOKEN_INTERVAL = 0.005  # 模型每秒约 200 个增量
+REPLY = "侬好呀！我是小沪，今朝阿拉来学几句上海闲话。" * 12  # 约 250 字，含句末标点
+
+CONFIGS = [
+    ("per-delta", 0, 0),
+    ("40ms/256B", 40, 256),
+    ("100ms/1KB", 100, 1024),
+]
+
+
+def start_sink_thread() -> int:
+    """在独立线程的事件循环中运行只读不写的接收端，返回端口"""
+    ready = threading.Event()
+    port = []
+
+    async def handle(reader, writer):
+        while await reader.read(65536):
+            pass
+        writer.close()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0))
+        port.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return port[0]
+
+
+async def model_deltas():
+    for ch in REPLY:
+        await asyncio.sleep(TOKEN_INTERVAL)
+        yield ch
+
+
+async def one_reply(port: int, max_delay_ms: int, max_bytes: int):
+    """返回 (帧数, TTFT 秒, 最大帧间隔秒)"""
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    start = time.perf_counter()
+    frames = 0
+    ttft = 0.0
+    max_gap = 0.0
+    last = start
+    async for chunk in coalesce_chunks(model_deltas(), max_delay_ms, max_bytes):
+        writer.write(sse_event(chunk).encode())
+        await writer.drain()
+        now = time.perf_counter()
+        if frames == 0:
+            ttft = now - start
+        else:
+            max_gap = max(max_gap, now - last)
+        last = now
+        frames += 1
+    writer.close()
+    return frames, ttft, max_gap
+
+
+def p95(values):
+    ordered = sorted(values)
+    return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+async def main():
+    port = start_sink_thread()
+    print(
+        f"{CONCURRENCY} concurrent replies x {len(REPLY)} deltas, "
+        f"one delta every {TOKEN_INTERVAL * 1000:.0f} ms"
+    )
+    print(f"  {'config':<10} {'frames/reply':>12} {'TTFT p95':>10} {'max gap p95':>12} {'CPU':>8}")
+    for name, max_delay_ms, max_bytes in CONFIGS:
+        cpu = time.thread_time()
+        results = await asyncio.gather(
+            *(one_reply(port, max_delay_ms, max_bytes) for _ in range(CONCURRENCY))
+        )
+        cpu = time.thread_time() - cpu
+        frames = sum(r[0] for r in results) / len(results)
+        print(
+            f"  {name:<10} {frames:12.1f} {p95([r[1] for r in results]) * 1000:8.1f}ms "
+            f"{p95([r[2] for r in results]) * 1000:10.1f}ms {cpu * 1000:6.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""
+TTS 连接池压测：每次请求新建 httpx.AsyncClient vs XiaoHuTTS 的长连接池
+每条语音包含两次请求：POST /run/predict 合成，再经由音频代理 GET /file= 下载 wav，
+本地 Gradio 替身运行在子进程中 (不与客户端争抢 GIL)。统计单条语音的 p50/p99 延迟、吞吐与建立的 TCP 连接数
+
+运行方式: python tests/bench_tts_pool.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import multiprocessing
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.core.logger import log  # noqa: E402
+from app.tts.xiaohu_tts import XiaoHuTTS  # noqa: E402
+from tests.fake_tts_server import FakeTTSServer, make_wav  # noqa: E402
+
+UTTERANCES = 1_000
+CONCURRENCY = 16  # 约 8 路语音对话 × TTS_MAX_PARALLEL=2
+SYNTH_DELAY = 0.002
+
+
+AUDIO = make_wav(seconds=1.0)
+
+
+def start_server_process() -> str:
+    """在子进程中运行 TTS 替身，返回其地址"""
+    server = FakeTTSServer(audio=AUDIO, synth_delay=SYNTH_DELAY)
+    port_queue = multiprocessing.Queue()
+    multiprocessing.Process(
+        target=server.serve_forever, args=(port_queue,), daemon=True
+    ).start()
+    return f"http://127.0.0.1:{port_queue.get()}"
+
+
+def server_connections(base_url: str) -> int:
+    """替身累计建立的连接数 (不含本次查询自身)"""
+    return httpx.get(f"{base_url}/stats", trust_env=False).json()["connections"] - 1
+
+
+async def per_request_clients(tts: XiaoHuTTS, text: str) -> int:
+    """改动前的做法：合成与代理各自新建一个客户端"""
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        response = await client.post(
+            f"{tts.api_base}/run/predict", json={"fn_index": 7, "data": [text]}
+        )
+        path = response.json()["data"][0]["name"]
+    async with httpx.AsyncClient(trust_env=False, timeout=60.0) as client:
+        response = await client.get(f"{tts.api_base}/file={path}")
+        return len(response.content)
+
+
+async def pooled_client(tts: XiaoHuTTS, text: str) -> int:
+    """XiaoHuTTS.generate_audio + 音频代理，各自复用长连接池 (默认的代理设置下合成与下载各一个)"""
+    audio_url = await tts.generate_audio(text)
+    response = await tts.audio_client.get(audio_url)
+    return len(response.content)
+
+
+async def run(name: str, fn, base_url: str):
+    tts = XiaoHuTTS()
+    tts.api_base = base_url
+    connections = server_connections(base_url)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            assert await fn(tts, f"侬好 {i}") == len(AUDIO)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(UTTERANCES)))
+    elapsed = time.perf_counter() - start
+    await tts.close()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(
+        f"  {name:<12} p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  "
+        f"{UTTERANCES / elapsed:7.1f} utt/s  {server_connections(base_url) - connections - 1:5d} connections"
+    )
+
+
+async def main():
+    log.remove()  # 关闭日志输出，避免 I/O 影响测量
+    base_url = start_server_process()
+    print(
+        f"{UTTERANCES} utterances (synthesize + proxy {len(AUDIO) // 1024} KB wav), "
+        f"concurrency {CONCURRENCY}"
+    )
+    await run("per-request", per_request_clients, base_url)
+    await run("pooled", pooled_client, base_url)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,253 @@
+"""
+本地 OpenAI 兼容服务 (供 bench_*.py 使用，不依赖外网)
+支持 /chat/completions 与 /v1/chat/completions 的全量和 SSE 流式返回、
+GET /models (健康检查)，并统计建立的 TCP 连接数，用于对比连接复用 / TLS 握手的开销
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import ssl
+import tempfile
+from typing import Optional, Set, Tuple
+
+
+def make_self_signed_context(
+    cert_dir: str, host: str = "127.0.0.1"
+) -> Tuple[ssl.SSLContext, str]:
+    """
+    生成自签名证书的服务端 SSLContext，返回 (context, 证书路径)
+    客户端可通过 SSL_CERT_FILE=证书路径 信任该证书
+    """
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(host))]),
+            critical=False,
+        )
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(cert_dir, "cert.pem")
+    key_path = os.path.join(cert_dir, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context, cert_path
+
+
+class FakeOpenAIServer:
+    """
+    :param reply: 回复内容，流式时按字符逐个下发
+    :param chunk_delay: 流式 chunk 之间的间隔秒数
+    :param first_token_delay: 首个 chunk (或全量回复) 之前的等待秒数
+    :param api_key: 设置后校验 Authorization 头，不匹配时返回 401
+    """
+
+    def __init__(
+        self,
+        reply: str = "侬好，我是小沪。",
+        chunk_delay: float = 0.0,
+        first_token_delay: float = 0.0,
+        tls: bool = False,
+        api_key: Optional[str] = None,
+    ):
+        self.reply = reply
+        self.chunk_delay = chunk_delay
+        self.first_token_delay = first_token_delay
+        self.tls = tls
+        self.api_key = api_key
+        self.connections = 0
+        self.requests = 0
+        self.cancelled = 0  # 客户端在流结束前断开的请求数
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._cert_dir: Optional[tempfile.TemporaryDirectory] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self.cert_path = ""
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self.port}/v1"
+
+    async def start(self):
+        ssl_context = None
+        if self.tls:
+            self._cert_dir = tempfile.TemporaryDirectory()
+            ssl_context, self.cert_path = make_self_signed_context(self._cert_dir.name)
+        self._server = await asyncio.start_server(
+            self._handle, "127.0.0.1", 0, ssl=ssl_context
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            # 客户端连接池中的长连接不会随 server.close() 断开，需要逐个关闭
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        if self._cert_dir:
+            self._cert_dir.cleanup()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+
+                payload = json.loads(body or b"{}")
+                path = request_line.split()[1].decode()
+                if self.api_key and headers.get("authorization") != f"Bearer {self.api_key}":
+                    self._write_response(writer, 401, {"error": {"message": "invalid api key"}})
+                    await writer.drain()
+                elif path.endswith("/models"):
+                    self._write_response(
+                        writer, 200, {"object": "list", "data": [{"id": "fake"}]}
+                    )
+                    await writer.drain()
+                elif payload.get("stream"):
+                    await self._write_stream(writer, payload)
+                else:
+                    await self._write_json(writer, payload)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, data: dict):
+        body = json.dumps(data).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n".encode()
+            + b"Content-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+    def _usage(self) -> dict:
+        return {
+            "prompt_tokens": 10,
+            "completion_tokens": len(self.reply),
+            "total_tokens": 10 + len(self.reply),
+        }
+
+    async def _write_json(self, writer: asyncio.StreamWriter, payload: dict):
+        if self.first_token_delay:
+            await asyncio.sleep(self.first_token_delay)
+        body = json.dumps(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": payload.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": self.reply},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": self._usage(),
+            },
+            ensure_ascii=False,
+        ).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    async def _write_stream(self, writer: asyncio.StreamWriter, payload: dict):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+
+        def event(data: dict) -> bytes:
+            line = f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+            return f"{len(line):x}\r\n".encode() + line + b"\r\n"
+
+        model = payload.get("model", "fake")
+        try:
+            if self.first_token_delay:
+                await asyncio.sleep(self.first_token_delay)
+            for ch in self.reply:
+                writer.write(
+                    event(
+                        {
+                            "id": "chatcmpl-fake",
+                            "object": "chat.completion.chunk",
+                            "created": 0,
+                            "model": model,
+                            "choices": [
+                                {"index": 0, "delta": {"content": ch}, "finish_reason": None}
+                            ],
+                        }
+                    )
+                )
+                await writer.drain()
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+            if payload.get("stream_options", {}).get("include_usage"):
+                writer.write(
+                    event(
+                        {
+                            "id": "chatcmpl-fake",
+                            "object": "chat.completion.chunk",
+                            "created": 0,
+                            "model": model,
+                            "choices": [],
+                            "usage": self._usage(),
+                        }
+                    )
+                )
+            done = b"data: [DONE]\n\n"
+            writer.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            self.cancelled += 1
+            raise
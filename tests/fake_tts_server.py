@@ -0,0 +1,167 @@
+"""
+本地 Gradio TTS 服务替身 (供 bench_*.py 与测试使用，不依赖外网)
+- POST /run/predict：等待 synth_delay 秒后返回 {"data": [{"name": "/tmp/gradio/<n>.wav"}]}
+- GET /file=<path>：返回 wav 音频，支持 Range 请求
+- GET /stats：返回建立的 TCP 连接数与请求数，用于对比连接复用的效果 (替身运行在子进程时使用)
+"""
+
+import io
+import math
+import wave
+import asyncio
+import json
+import struct
+from typing import Optional, Set
+
+
+def make_wav(seconds: float = 2.0, sample_rate: int = 22050) -> bytes:
+    """生成单声道 16 位的正弦波 wav (带轻微的音高变化，接近语音的频谱)"""
+    frames = int(seconds * sample_rate)
+    samples = bytearray()
+    for i in range(frames):
+        t = i / sample_rate
+        freq = 220 + 60 * math.sin(2 * math.pi * 3 * t)
+        value = 0.3 * math.sin(2 * math.pi * freq * t)
+        samples += struct.pack("<h", int(value * 32767))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(bytes(samples))
+    return buffer.getvalue()
+
+
+class FakeTTSServer:
+    """
+    :param audio: /file= 返回的音频内容，默认 2 秒的 wav
+    :param synth_delay: 每次合成的耗时 (秒)
+    """
+
+    def __init__(self, audio: Optional[bytes] = None, synth_delay: float = 0.0):
+        self.audio = audio if audio is not None else make_wav()
+        self.synth_delay = synth_delay
+        self.connections = 0
+        self.requests = 0
+        self.synthesized = []  # 每次合成请求的文本
+        self.last_headers = {}  # 最近一次请求的请求头
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                self.last_headers = headers
+
+                if method == "POST" and path == "/run/predict":
+                    await self._predict(writer, json.loads(body))
+                elif method == "GET" and path.startswith("/file="):
+                    await self._file(writer, headers)
+                elif method == "GET" and path == "/stats":
+                    stats = {"connections": self.connections, "requests": self.requests}
+                    self._write(writer, 200, json.dumps(stats).encode(), "application/json")
+                else:
+                    self._write(writer, 404, b"not found", "text/plain")
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def serve_forever(self, port_queue=None):
+        """在当前进程中运行直到被终止，启动后把端口放入 port_queue (供 multiprocessing 使用)"""
+
+        async def run():
+            await self.start()
+            if port_queue is not None:
+                port_queue.put(self.port)
+            await asyncio.Event().wait()
+
+        asyncio.run(run())
+
+    async def _predict(self, writer: asyncio.StreamWriter, payload: dict):
+        if self.synth_delay:
+            await asyncio.sleep(self.synth_delay)
+        self.synthesized.append(payload["data"][0])
+        name = f"/tmp/gradio/{len(self.synthesized)}.wav"
+        body = json.dumps({"data": [{"name": name}], "duration": self.synth_delay})
+        self._write(writer, 200, body.encode(), "application/json")
+
+    async def _file(self, writer: asyncio.StreamWriter, headers: dict):
+        size = len(self.audio)
+        range_header = headers.get("range")
+        if not range_header:
+            self._write(writer, 200, self.audio, "audio/wav", "Accept-Ranges: bytes\r\n")
+            return
+        # 只支持单个范围："bytes=start-end"、"bytes=start-" 与 "bytes=-suffix"
+        first, _, last = range_header.removeprefix("bytes=").partition("-")
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+        if start >= size or start > end:
+            self._write(writer, 416, b"", "text/plain", f"Content-Range: bytes */{size}\r\n")
+            return
+        end = min(end, size - 1)
+        self._write(
+            writer,
+            206,
+            self.audio[start : end + 1],
+            "audio/wav",
+            f"Accept-Ranges: bytes\r\nContent-Range: bytes {start}-{end}/{size}\r\n",
+        )
+
+    @staticmethod
+    def _write(
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: bytes,
+        content_type: str,
+        extra_headers: str = "",
+    ):
+        reason = {
+            200: "OK",
+            206: "Partial Content",
+            404: "Not Found",
+            416: "Range Not Satisfiable",
+        }.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n".encode()
+            + extra_headers.encode()
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import pytest
 import pytest_asyncio
 from typing import AsyncGenerator
@@ -7,7 +8,14 @@ from app.db.data_manager import DataManager
 from app.services.session_manager import SessionManager
 from app.services.llm_manager import LLMManager
 from app.services.chat_sdk import ChatSDK
-from app.schemas.chat import APIConfig, OllamaConfig
+from app.schemas.chat import APIConfig, OllamaConfig, Message
+from app.services.context_builder import ContextBuilder
+from app.services.llm_provider import LLMProvider
+from app.services.concurrency import ProviderOverloadedError
+from app.services.disconnect import stream_until_disconnected
+from app.services.sse import coalesce_chunks
+from app.services.openai_compatible_provider import OpenAICompatibleProvider
+from tests.fake_openai_server import FakeOpenAIServer
 from app.core.logger import log
 
 # 准备测试夹具
@@ -31,9 +39,11 @@ async def chat_sdk() -> AsyncGenerator[ChatSDK, None]:
 
     yield sdk  # 将 sdk 交给测试用例
 
-    # 测试结束后的清理工作
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
+    # 测试结束后的清理工作 (含 WAL 模式的 -wal/-shm 文件)
+    await dm.engine.dispose()
+    for path in (TEST_DB_PATH, f"{TEST_DB_PATH}-wal", f"{TEST_DB_PATH}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
 
 
 # 测试用例 1：测试 ChatSDK 的模型全量注册与发送
@@ -169,3 +179,267 @@ async def test_chatsdk_full_integration(chat_sdk: ChatSDK):
         log.info(f"[{msg.role}] {msg.content}")
 
     log.info("--- ChatSDK 多轮上下文记忆 测试通过 ---")
+
+
+# 测试用例 3：测试基于 token 预算的上下文构建 (无需联网)
+def test_context_builder_budget():
+    # encoding_name=None：使用粗略估算，测试不依赖联网下载 tiktoken 编码表
+    builder = ContextBuilder(encoding_name=None)
+    history = [
+        Message(message_id=f"m{i}", role="user" if i % 2 == 0 else "assistant", content="侬" * 96)
+        for i in range(10)
+    ]  # 每条消息约 100 token
+
+    # 未设置预算时原样返回
+    assert builder.build(history, max_context_tokens=0) == history
+
+    # 预算 1000，预留 400 给回复：只能保留最近的 5 条
+    context = builder.build(history, max_context_tokens=1000, reserve_tokens=400)
+    assert [m.message_id for m in context] == ["m5", "m6", "m7", "m8", "m9"]
+
+    # 系统提示词同样占用预算
+    context = builder.build(
+        history, system_prompt="侬" * 196, max_context_tokens=1000, reserve_tokens=400
+    )
+    assert [m.message_id for m in context] == ["m7", "m8", "m9"]
+
+    # 最新一条消息 (本轮提问) 即使超出预算也必须保留
+    assert builder.build(history, max_context_tokens=10) == history[-1:]
+
+    # 每条消息的 token 数按 message_id 缓存，不会重复分词
+    builder.build(history, max_context_tokens=100_000)
+    calls = []
+    builder.count_tokens = lambda text: calls.append(text) or 1
+    builder.build(history, max_context_tokens=100_000)
+    assert calls == []
+
+
+class _RecordingProvider(LLMProvider):
+    """记录每次请求的离线 Provider：摘要请求返回固定摘要，其余返回固定回复"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def init_model(self, config) -> bool:
+        self._is_available = True
+        return True
+
+    def get_model_name(self) -> str:
+        return "fake"
+
+    def get_model_desc(self) -> str:
+        return "fake"
+
+    async def send_message(self, messages, request_param) -> str:
+        self.requests.append((list(messages), dict(request_param)))
+        if "摘要助手" in request_param.get("system_prompt", ""):
+            return "用户叫阿强，住在宝山。"
+        return "侬" * 96
+
+    async def send_message_stream(self, messages, request_param):
+        yield await self.send_message(messages, request_param)
+
+
+# 测试用例 4：测试长对话的滚动摘要 (无需联网)
+@pytest.mark.asyncio
+async def test_chatsdk_rolling_summary(chat_sdk: ChatSDK):
+    provider = _RecordingProvider()
+    chat_sdk._llm_manager.register_provider("fake", provider)
+    await chat_sdk._llm_manager.init_model("fake", {})
+    chat_sdk._initialized = True
+    chat_sdk._context_builder = ContextBuilder(encoding_name=None)
+    chat_sdk._model_configs["fake"] = APIConfig(
+        model_name="fake",
+        api_key="",
+        system_prompt="你是小沪",
+        summary_trigger_tokens=500,
+        summary_keep_recent=2,
+    )
+
+    session_id = await chat_sdk.create_session("fake")
+    # 每轮约 200 token，第 3 轮后超过阈值，在后台触发摘要
+    for i in range(3):
+        await chat_sdk.send_message(session_id, "侬" * 96)
+    await asyncio.gather(*chat_sdk._summary_tasks.values())
+
+    summary = await chat_sdk._session_manager.get_conversation_summary(session_id)
+    assert summary is not None
+    assert summary.covered_count == 4  # 6 条消息，保留最近 2 条原文
+    session = await chat_sdk.get_session(session_id)
+    assert summary.is_valid_for(session.messages)
+
+    # 下一轮请求：被摘要覆盖的消息不再发送，摘要进入系统提示词
+    await chat_sdk.send_message(session_id, "我住在哪里？")
+    messages, request_param = provider.requests[-1]
+    assert "用户叫阿强" in request_param["system_prompt"]
+    assert request_param["system_prompt"].startswith("你是小沪")
+    assert len(messages) == 3  # 最近 2 条 + 本轮提问
+
+    # 删除会话时摘要一并删除
+    await chat_sdk.close()
+    await chat_sdk.delete_session(session_id)
+    assert await chat_sdk._session_manager.get_conversation_summary(session_id) is None
+
+
+# 测试用例 5：测试按模型配置选择 Provider
+def test_chatsdk_provider_selection(chat_sdk: ChatSDK):
+    from app.services.openai_compatible_provider import OpenAICompatibleProvider
+    from app.services.unified_llm_provider import UnifiedLLMProvider
+
+    def pick(config):
+        real_model = config.real_model or config.model_name
+        return type(chat_sdk._create_provider(config, real_model))
+
+    # OpenAI 兼容的提供商默认直连，Gemini 走 litellm
+    assert pick(APIConfig(model_name="deepseek-chat", api_key="")) is OpenAICompatibleProvider
+    assert pick(APIConfig(model_name="gpt-4o-mini", api_key="")) is OpenAICompatibleProvider
+    assert pick(OllamaConfig(model_name="llama3", endpoint="http://ollama")) is OpenAICompatibleProvider
+    assert pick(APIConfig(model_name="gemini-2.5-flash", api_key="")) is UnifiedLLMProvider
+
+    # 可以按模型强制使用 litellm；Gemini 即使配置 direct 也只能走 litellm
+    assert (
+        pick(APIConfig(model_name="deepseek-chat", api_key="", backend="litellm"))
+        is UnifiedLLMProvider
+    )
+    assert (
+        pick(APIConfig(model_name="gemini-2.5-flash", api_key="", backend="direct"))
+        is UnifiedLLMProvider
+    )
+
+
+# 测试用例 6：测试模型过载时拒绝请求且不落库
+@pytest.mark.asyncio
+async def test_chatsdk_overloaded_model(chat_sdk: ChatSDK):
+    provider = _RecordingProvider()
+    chat_sdk._llm_manager.register_provider("fake", provider)
+    await chat_sdk._llm_manager.init_model("fake", {})
+    chat_sdk._initialized = True
+    chat_sdk._model_configs["fake"] = APIConfig(model_name="fake", api_key="")
+    # 并发为 1 且不允许排队
+    chat_sdk._llm_manager.set_concurrency_limit("fake", 1, 0)
+    session_id = await chat_sdk.create_session("fake")
+
+    stream = chat_sdk.send_message_stream(session_id, "第一个问题")
+    await stream.__anext__()  # 第一个请求占用唯一的槽位
+
+    with pytest.raises(ProviderOverloadedError):
+        await chat_sdk.check_admission(session_id)
+    with pytest.raises(ProviderOverloadedError):
+        await chat_sdk.send_message(session_id, "第二个问题")
+    with pytest.raises(ProviderOverloadedError):
+        async for _ in chat_sdk.send_message_stream(session_id, "第三个问题"):
+            pass
+    await stream.aclose()
+
+    # 只有第一个请求落库，被拒绝的请求不留下孤立的提问
+    session = await chat_sdk.get_session(session_id)
+    assert [m.content for m in session.messages if m.role == "user"] == ["第一个问题"]
+    assert chat_sdk.get_metrics()["limiters"][0]["rejected"] == 3
+
+
+# 测试用例 7：测试客户端断开后在有限时间内取消上游，并保存已生成的部分回复
+@pytest.mark.asyncio
+async def test_chatsdk_stream_cancelled_on_disconnect(chat_sdk: ChatSDK):
+    server = FakeOpenAIServer(reply="侬" * 500, chunk_delay=0.02)
+    await server.start()
+    provider = OpenAICompatibleProvider("deepseek", "deepseek-chat")
+    chat_sdk._llm_manager.register_provider("slow", provider)
+    await chat_sdk._llm_manager.init_model(
+        "slow", {"api_key": "sk-test", "endpoint": server.base_url}
+    )
+    chat_sdk._initialized = True
+    chat_sdk._model_configs["slow"] = APIConfig(model_name="slow", api_key="")
+    chat_sdk._llm_manager.set_concurrency_limit("slow", 1, 0)
+    session_id = await chat_sdk.create_session("slow")
+
+    disconnected = False
+
+    async def is_disconnected() -> bool:
+        return disconnected
+
+    try:
+        received = []
+        stream = stream_until_disconnected(
+            chat_sdk.send_message_stream(session_id, "讲个长故事"),
+            is_disconnected,
+            poll_interval=0.01,
+        )
+
+        async def consume():
+            nonlocal disconnected
+            async for chunk in stream:
+                received.append(chunk)
+                if len(received) == 5:
+                    # 浏览器关闭连接，此后不再读取
+                    disconnected = True
+
+        # 上游要 10 秒才能生成完，断开后应在有限时间内结束
+        await asyncio.wait_for(consume(), timeout=1.0)
+        for _ in range(50):
+            if server.cancelled:
+                break
+            await asyncio.sleep(0.01)
+        assert server.cancelled == 1
+        assert chat_sdk.get_metrics()["limiters"][0]["in_flight"] == 0
+
+        # 已生成的部分回复与提问一起落库
+        session = await chat_sdk.get_session(session_id)
+        assert [m.role for m in session.messages] == ["user", "assistant"]
+        assert 5 <= len(session.messages[1].content) < 500
+    finally:
+        await provider.close()
+        await server.close()
+
+
+# 测试用例 8：测试 SSE 帧合并 (首字立即下发，按句末标点、字节数、时间下发)
+@pytest.mark.asyncio
+async def test_coalesce_chunks():
+    async def deltas(text: str, pause_at: int = -1):
+        for i, ch in enumerate(text):
+            await asyncio.sleep(0.1 if i == pause_at else 0.001)  # pause_at 处上游停顿
+            yield ch
+
+    text = "侬好！我是小沪，欢迎来学上海闲话。今朝天气老好额"
+    frames = [f async for f in coalesce_chunks(deltas(text), max_delay_ms=1000, max_bytes=1024)]
+    assert "".join(frames) == text
+    assert frames[:3] == ["侬", "好！", "我是小沪，欢迎来学上海闲话。"]
+
+    # 达到字节上限时下发 (每个汉字 3 字节)
+    frames = [f async for f in coalesce_chunks(deltas("一二三四五六七"), 1000, max_bytes=9)]
+    assert frames == ["一", "二三四", "五六七"]
+
+    # 上游停顿时缓冲区按时下发，不等下一个增量
+    stream = coalesce_chunks(deltas("一二三四五", pause_at=3), max_delay_ms=20)
+    assert await stream.__anext__() == "一"
+    assert await asyncio.wait_for(stream.__anext__(), timeout=0.08) == "二三"
+    assert [f async for f in stream] == ["四五"]
+
+    # 关闭合并时原样转发
+    frames = [f async for f in coalesce_chunks(deltas("侬好。"), max_delay_ms=0)]
+    assert frames == ["侬", "好", "。"]
+
+
+# 测试用例 9：未配置 API Key 的云端模型不作为备用模型，对冲默认关闭
+@pytest.mark.asyncio
+async def test_chatsdk_fallback_requires_api_key(chat_sdk: ChatSDK):
+    configs = [
+        APIConfig(
+            model_name="小沪",
+            real_model="deepseek-chat",
+            api_key="sk-test",
+            fallback_models=["gpt-4o-mini", "llama3"],
+        ),
+        APIConfig(model_name="gpt-4o-mini", api_key=""),
+        OllamaConfig(model_name="llama3", endpoint="http://127.0.0.1:11434"),
+    ]
+    assert await chat_sdk.init_models(configs)
+    routes = chat_sdk.get_metrics()["routes"]
+    assert [(r["candidates"], r["hedge_after_ms"]) for r in routes] == [(["小沪", "llama3"], 0)]
+
+    # 没有可用的备用模型时不配置路由
+    assert await chat_sdk.init_models(
+        [APIConfig(model_name="小沪", api_key="sk-test", fallback_models=["gpt-4o-mini"])]
+    )
+    assert chat_sdk.get_metrics()["routes"] == []
+    await chat_sdk.close()
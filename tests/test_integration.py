@@ -1,13 +1,18 @@
 import os
+import sqlite3
+import asyncio
 import pytest
 import pytest_asyncio
 from typing import AsyncGenerator
 
 from app.db.data_manager import DataManager
+from app.db.migrations import MIGRATIONS
+from app.db.write_behind import _STOP, MessageWriteBehind
 from app.services.session_manager import SessionManager
+from app.services.conversation_cache import ConversationCache
 from app.services.llm_manager import LLMManager
 from app.services.unified_llm_provider import UnifiedLLMProvider
-from app.schemas.chat import Message
+from app.schemas.chat import Message, Session
 from app.core.logger import log
 
 # 准备测试夹具
@@ -25,10 +30,12 @@ async def data_manager() -> AsyncGenerator[DataManager, None]:
 
     yield dm  # 将 dm 交给测试用例使用
 
-    # 测试结束后的清理工作：删除测试数据库文件
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
-        log.info("测试完毕，已清理测试数据库文件。")
+    # 测试结束后的清理工作：关闭连接池并删除测试数据库文件 (含 WAL 模式的 -wal/-shm 文件)
+    await dm.engine.dispose()
+    for path in (TEST_DB_PATH, f"{TEST_DB_PATH}-wal", f"{TEST_DB_PATH}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    log.info("测试完毕，已清理测试数据库文件。")
 
 
 @pytest_asyncio.fixture
@@ -114,3 +121,336 @@ async def test_llm_manager_routing(llm_manager: LLMManager):
     assert available_models[0].model_name == model_name
 
     log.info("--- LLM Manager 路由机制测试通过 ---")
+
+
+# 测试用例 3：测试会话列表摘要 (单条 SQL 聚合) 与分页
+@pytest.mark.asyncio
+async def test_session_summaries(data_manager: DataManager):
+    log.info("--- 开始测试会话列表摘要 ---")
+
+    # 准备两个会话：一个带有开场白与两条用户消息，一个为空会话
+    chat = Session(session_id="s_chat", model_name="小沪", created_at=100, updated_at=100)
+    empty = Session(session_id="s_empty", model_name="deepseek-chat", created_at=50, updated_at=50)
+    await data_manager.insert_session(chat)
+    await data_manager.insert_session(empty)
+
+    await data_manager.insert_message(
+        "s_chat", Message(role="assistant", content="侬好", timestamp=101)
+    )
+    await data_manager.insert_message(
+        "s_chat", Message(role="user", content="第一句", timestamp=102)
+    )
+    await data_manager.insert_message(
+        "s_chat", Message(role="user", content="第二句", timestamp=103)
+    )
+
+    summaries = await data_manager.get_session_summaries()
+    assert [s.session_id for s in summaries] == ["s_chat", "s_empty"]
+    assert summaries[0].message_count == 3
+    assert summaries[0].first_user_message == "第一句"
+    assert summaries[0].updated_at == 103
+    assert summaries[1].message_count == 0
+    assert summaries[1].first_user_message is None
+
+    # 分页
+    page = await data_manager.get_session_summaries(limit=1, offset=1)
+    assert [s.session_id for s in page] == ["s_empty"]
+
+    log.info("--- 会话列表摘要测试通过 ---")
+
+
+# 测试用例 4：测试旧数据库通过版本化迁移补建索引
+@pytest.mark.asyncio
+async def test_schema_migration_on_legacy_db():
+    legacy_path = "./test_legacy_chat.db"
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+    # 模拟旧版本的 chat.db：只有表结构，没有复合索引，user_version 为 0
+    conn = sqlite3.connect(legacy_path)
+    conn.executescript(
+        """
+        CREATE TABLE sessions (session_id VARCHAR PRIMARY KEY, model_name VARCHAR NOT NULL,
+                               create_time INTEGER NOT NULL, update_time INTEGER NOT NULL);
+        CREATE TABLE messages (message_id VARCHAR PRIMARY KEY,
+                               session_id VARCHAR NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+                               role VARCHAR NOT NULL, content VARCHAR NOT NULL, timestamp INTEGER NOT NULL);
+        """
+    )
+    conn.close()
+
+    try:
+        dm = DataManager(f"sqlite+aiosqlite:///{legacy_path}")
+        await dm.init_database()
+        # 重复初始化应当是幂等的
+        await dm.init_database()
+        await dm.engine.dispose()
+
+        conn = sqlite3.connect(legacy_path)
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(messages)")}
+        indexes |= {row[1] for row in conn.execute("PRAGMA index_list(sessions)")}
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM messages WHERE session_id = ? ORDER BY timestamp",
+            ("x",),
+        ).fetchall()
+        conn.close()
+
+        assert "ix_messages_session_id_timestamp" in indexes
+        assert "ix_sessions_update_time_desc" in indexes
+        assert version == MIGRATIONS[-1][0]
+        assert {"token_count", "model", "latency_ms", "prompt_tokens"} <= columns
+        assert "ix_messages_session_id_timestamp" in str(plan)
+        assert "TEMP B-TREE" not in str(plan)  # 不再需要额外排序
+    finally:
+        for path in (legacy_path, f"{legacy_path}-wal", f"{legacy_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# 测试用例 5：测试 SQLite 性能配置在连接建立时生效
+@pytest.mark.asyncio
+async def test_sqlite_connection_profile():
+    db_path = "./test_profile.db"
+    dm = DataManager(
+        f"sqlite+aiosqlite:///{db_path}",
+        pragmas={"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 1234},
+        pool_size=2,
+    )
+    try:
+        async with dm.engine.connect() as conn:
+            journal_mode = (await conn.exec_driver_sql("PRAGMA journal_mode")).scalar()
+            synchronous = (await conn.exec_driver_sql("PRAGMA synchronous")).scalar()
+            busy_timeout = (await conn.exec_driver_sql("PRAGMA busy_timeout")).scalar()
+            foreign_keys = (await conn.exec_driver_sql("PRAGMA foreign_keys")).scalar()
+        assert journal_mode == "wal"
+        assert synchronous == 1  # NORMAL
+        assert busy_timeout == 1234
+        assert foreign_keys == 1
+        assert dm.engine.pool.size() == 2
+
+        # 非法配置在构造时即报错，而不是拼接进 PRAGMA 语句
+        with pytest.raises(ValueError):
+            DataManager(f"sqlite+aiosqlite:///{db_path}", pragmas={"journal_mode": "wal; DROP"})
+    finally:
+        await dm.engine.dispose()
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# 测试用例 6：测试消息写入合并器 (组提交) 与关闭时的刷新
+@pytest.mark.asyncio
+async def test_write_behind_group_commit(data_manager: DataManager):
+    writer = MessageWriteBehind(data_manager, flush_interval_ms=20, max_batch=100)
+    writer.start()
+    session_manager = SessionManager(data_manager, writer)
+
+    session_ids = [await session_manager.create_session("deepseek-chat") for _ in range(5)]
+
+    # 50 个并发写入应当被合并进少量事务中
+    results = await asyncio.gather(
+        *(
+            session_manager.add_message(sid, Message(role="user", content=f"消息{i}"))
+            for sid in session_ids
+            for i in range(10)
+        )
+    )
+    assert all(results)
+    assert writer.flushed_items == 50
+    assert writer.flushed_batches < 50
+
+    # 不存在的会话返回 False，且不影响同批的其他写入
+    assert await session_manager.add_message("no_such_session", Message(role="user", content="x")) is False
+
+    # 关闭前提交的写入在 close 返回后必须已经落库
+    pending = asyncio.create_task(
+        session_manager.add_message(session_ids[0], Message(role="assistant", content="最后一条"))
+    )
+    await asyncio.sleep(0)
+    await writer.close()
+    assert await pending is True
+
+    for sid in session_ids:
+        history = await session_manager.get_history_messages(sid)
+        assert len(history) == (11 if sid == session_ids[0] else 10)
+
+
+# 测试用例 7：测试融合写入路径 (带开场白建会话 / 一次写入一轮对话)
+@pytest.mark.asyncio
+async def test_fused_append_path(session_manager: SessionManager):
+    session_id = await session_manager.create_session("小沪", greeting="侬好！")
+    history = await session_manager.get_history_messages(session_id)
+    assert [(m.role, m.content) for m in history] == [("assistant", "侬好！")]
+
+    user_msg = Message(role="user", content="介绍一下上海话")
+    ai_msg = Message(role="assistant", content="好个呀")
+    assert await session_manager.append_exchange(session_id, user_msg, ai_msg) is True
+
+    # 回复为空时只保存提问
+    assert await session_manager.append_exchange(session_id, Message(role="user", content="还在吗")) is True
+
+    history = await session_manager.get_history_messages(session_id)
+    assert [m.content for m in history] == ["侬好！", "介绍一下上海话", "好个呀", "还在吗"]
+    assert all(m.message_id.startswith("msg_") for m in history)
+
+    # 会话不存在时整轮写入被拒绝
+    assert await session_manager.append_exchange("no_such_session", user_msg, ai_msg) is False
+
+
+# 测试用例 8：测试历史消息的游标分页与会话版本号
+@pytest.mark.asyncio
+async def test_history_keyset_pagination(data_manager: DataManager):
+    await data_manager.insert_session(
+        Session(session_id="s_page", model_name="小沪", created_at=100, updated_at=100)
+    )
+    # 同一秒内的多条消息也必须按插入顺序稳定分页
+    messages = [
+        Message(message_id=f"m{i}", role="user", content=f"第{i}句", timestamp=200 + i // 2)
+        for i in range(6)
+    ]
+    assert await data_manager.append_messages("s_page", messages[:3]) is not None
+    assert await data_manager.append_messages("s_page", messages[3:]) is not None
+
+    page = await data_manager.get_session_messages("s_page", limit=2)
+    assert [m.message_id for m in page] == ["m0", "m1"]
+    page = await data_manager.get_session_messages("s_page", after="m1", limit=2)
+    assert [m.message_id for m in page] == ["m2", "m3"]
+    page = await data_manager.get_session_messages("s_page", after="m3")
+    assert [m.message_id for m in page] == ["m4", "m5"]
+    assert await data_manager.get_session_messages("s_page", after="m5") == []
+
+    # 时间戳游标
+    page = await data_manager.get_session_messages("s_page", after="201")
+    assert [m.message_id for m in page] == ["m4", "m5"]
+
+    with pytest.raises(ValueError):
+        await data_manager.get_session_messages("s_page", after="unknown_id")
+
+    # 同一秒内的两次写入也必须产生不同的版本号
+    v1 = await data_manager.get_session_version("s_page")
+    result = await data_manager.append_messages(
+        "s_page", [Message(role="assistant", content="好", timestamp=202)]
+    )
+    v2 = result.version
+    assert v2 > v1
+    assert result.prior_count == 6
+    assert await data_manager.get_session_version("s_page") == v2
+    assert await data_manager.get_session_version("no_such_session") is None
+
+    # 手动更新时间戳也不会让版本号回退或保持不变
+    await data_manager.update_session_timestamp("s_page", 1)
+    assert await data_manager.get_session_version("s_page") == v2 + 1
+
+
+# 测试用例 9：测试进程内会话缓存 (写穿 + 多进程场景下的版本号校验)
+@pytest.mark.asyncio
+async def test_conversation_cache(data_manager: DataManager):
+    cache_a = ConversationCache()
+    worker_a = SessionManager(data_manager, cache=cache_a)
+    # worker_b 模拟共享同一数据库的另一个 uvicorn worker
+    worker_b = SessionManager(data_manager, cache=ConversationCache())
+
+    session_id = await worker_a.create_session("小沪", greeting="侬好！")
+    assert len((await worker_a.get_session(session_id)).messages) == 1
+
+    # 写穿：本进程写入后再读取直接命中缓存
+    await worker_a.append_exchange(
+        session_id, Message(role="user", content="问"), Message(role="assistant", content="答")
+    )
+    hits = cache_a.stats().hits
+    session = await worker_a.get_session(session_id)
+    assert [m.content for m in session.messages] == ["侬好！", "问", "答"]
+    assert cache_a.stats().hits == hits + 1
+
+    # 另一个 worker 写入后，版本号变化使本进程缓存失效，读到最新数据
+    await worker_b.add_message(session_id, Message(role="user", content="B 写入"))
+    history = await worker_a.get_history_messages(session_id)
+    assert [m.content for m in history] == ["侬好！", "问", "答", "B 写入"]
+
+    # 错过其他进程写入时，写穿不能把缓存改成"看似最新"的版本
+    await worker_b.add_message(session_id, Message(role="user", content="B 再写"))
+    await worker_a.add_message(session_id, Message(role="assistant", content="A 写入"))
+    history = await worker_a.get_history_messages(session_id)
+    assert [m.content for m in history][-2:] == ["B 再写", "A 写入"]
+
+    # 按字节预算淘汰
+    small = ConversationCache(max_bytes=2000)
+    small.put("s1", [Message(role="user", content="x" * 500)], version=1)
+    small.put("s2", [Message(role="user", content="y" * 500)], version=1)
+    small.put("s3", [Message(role="user", content="z" * 500)], version=1)
+    assert small.get("s1", 1) is None
+    assert small.get("s3", 1) is not None
+    assert small.stats().current_bytes <= 2000
+
+
+# 测试用例 10：测试用量列的持久化与聚合查询
+@pytest.mark.asyncio
+async def test_usage_accounting(data_manager: DataManager):
+    for sid in ("s_a", "s_b"):
+        await data_manager.insert_session(Session(session_id=sid, model_name="小沪"))
+
+    def reply(model: str, prompt: int, completion: int, latency: int) -> Message:
+        return Message(
+            role="assistant",
+            content="好个",
+            token_count=2,
+            model=model,
+            latency_ms=latency,
+            prompt_tokens=prompt,
+            completion_tokens=completion,
+            cached_tokens=prompt // 2,
+        )
+
+    await data_manager.append_exchange(
+        "s_a", Message(role="user", content="问", token_count=1), reply("deepseek-chat", 100, 20, 800)
+    )
+    await data_manager.append_exchange(
+        "s_a", Message(role="user", content="问"), reply("deepseek-chat", 300, 40, 1200)
+    )
+    await data_manager.append_exchange(
+        "s_b", Message(role="user", content="问"), reply("gpt-4o-mini", 50, 10, 400)
+    )
+
+    by_model = await data_manager.get_usage_stats(group_by="model")
+    assert [s.key for s in by_model] == ["deepseek-chat", "gpt-4o-mini"]
+    assert by_model[0].message_count == 2  # 用户消息不计入
+    assert by_model[0].prompt_tokens == 400
+    assert by_model[0].completion_tokens == 60
+    assert by_model[0].cached_tokens == 200
+    assert by_model[0].avg_latency_ms == 1000
+    assert by_model[0].max_latency_ms == 1200
+
+    by_session = await data_manager.get_usage_stats(group_by="session", limit=1)
+    assert [(s.key, s.prompt_tokens) for s in by_session] == [("s_a", 400)]
+
+    # 读路径带回持久化的 token 数，供上下文构建直接使用
+    history = await data_manager.get_session_messages("s_a")
+    assert history[0].token_count == 1 and history[1].token_count == 2
+
+
+# 测试用例 11：submit 已通过关闭检查、但在后台任务最后一次清空队列之后才放入队列，消息仍然落库
+@pytest.mark.asyncio
+async def test_write_behind_submit_during_close(data_manager: DataManager):
+    class SlowPutQueue(asyncio.Queue):
+        async def put(self, item):
+            if item is not _STOP:
+                # 模拟队列已满时在 put 上等待，期间 close 完成
+                await asyncio.sleep(0.05)
+            await super().put(item)
+
+    writer = MessageWriteBehind(data_manager, flush_interval_ms=1)
+    writer._queue = SlowPutQueue()
+    writer.start()
+    session_manager = SessionManager(data_manager, writer)
+    session_id = await session_manager.create_session("deepseek-chat")
+
+    pending = asyncio.create_task(
+        session_manager.add_message(session_id, Message(role="user", content="迟到的消息"))
+    )
+    await asyncio.sleep(0)
+    await writer.close()
+    assert await asyncio.wait_for(pending, timeout=1) is True
+    history = await session_manager.get_history_messages(session_id)
+    assert [m.content for m in history] == ["迟到的消息"]
@@ -1,8 +1,21 @@
 import os
+import time
+import asyncio
 import pytest
-from app.schemas.chat import Message
+from app.schemas.chat import Message, LLMUsage
 from app.services.unified_llm_provider import UnifiedLLMProvider
+from app.services.openai_compatible_provider import OpenAICompatibleProvider
 from app.core.logger import log
+from app.db.data_manager import DataManager
+from app.services.llm_manager import LLMManager
+from app.services.llm_provider import LLMProvider
+from app.services.response_cache import ResponseCache
+from app.services.concurrency import ProviderOverloadedError
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.http_transport import http2_available
+from app.core.config import settings
+from tests.fake_openai_server import FakeOpenAIServer
+from litellm.llms.custom_httpx.aiohttp_transport import LiteLLMAiohttpTransport
 
 
 # # 测试用例 1：验证 DeepSeek 全量消息发送
@@ -317,6 +330,7 @@ async def test_ollama_send_message():
 
     # 打印模型回复
     log.info(f"Ollama Response: {full_data}")
+    await provider.close()
 
 
 # 测试用例 8：验证 Ollama 流式响应
@@ -360,3 +374,522 @@ async def test_ollama_send_message_stream():
     # 验证结果
     assert len(full_data) > 0
     log.info(f"Ollama Full Response : {full_data}")
+    await provider.close()
+
+
+# 测试用例 9：验证 Provider 复用长连接池 (本地 OpenAI 兼容服务，无需联网)
+@pytest.mark.asyncio
+async def test_provider_reuses_connections():
+    server = FakeOpenAIServer(reply="侬好")
+    await server.start()
+    try:
+        provider = UnifiedLLMProvider(provider_type="deepseek", model_name="deepseek-chat")
+        assert await provider.init_model({"api_key": "sk-test", "endpoint": server.base_url})
+
+        messages = [Message(role="user", content="侬好")]
+        for _ in range(3):
+            assert await provider.send_message(messages, {}) == "侬好"
+        chunks = [c async for c in provider.send_message_stream(messages, {})]
+        assert "".join(chunks) == "侬好"
+
+        # 4 个请求只建立了 1 条连接
+        assert server.requests == 4
+        assert server.connections == 1
+
+        # close 之后连接池被释放，Provider 可以重新初始化
+        await provider.close()
+        assert provider._litellm_client is None
+        assert await provider.init_model({"api_key": "sk-test", "endpoint": server.base_url})
+        await provider.close()
+    finally:
+        await server.close()
+
+
+# 测试用例 10：验证直连 OpenAI 兼容接口的 Provider (本地服务，无需联网)
+@pytest.mark.asyncio
+async def test_openai_compatible_provider():
+    server = FakeOpenAIServer(reply="侬好，我是小沪。")
+    await server.start()
+    try:
+        # Ollama 只配置了服务地址，自动补全 /v1
+        provider = OpenAICompatibleProvider("ollama", "llama3")
+        assert await provider.init_model({"endpoint": f"http://127.0.0.1:{server.port}"})
+        messages = [Message(role="user", content="侬好")]
+
+        usage = LLMUsage()
+        assert await provider.send_message(messages, {"usage": usage}) == "侬好，我是小沪。"
+        assert usage.completion_tokens == 8
+
+        # 流式：逐字返回，最后一个 chunk 的用量写入 request_param["usage"]
+        usage = LLMUsage()
+        chunks = [
+            c async for c in provider.send_message_stream(messages, {"usage": usage})
+        ]
+        assert chunks == list("侬好，我是小沪。")
+        assert usage.prompt_tokens == 10 and usage.completion_tokens == 8
+        await provider.close()
+
+        # 连接失败时与 UnifiedLLMProvider 一样以文本形式返回错误
+        provider = OpenAICompatibleProvider("deepseek", "deepseek-chat")
+        await provider.init_model({"api_key": "sk-test", "endpoint": "http://127.0.0.1:1"})
+        assert (await provider.send_message(messages, {})).startswith("Error:")
+        chunks = [c async for c in provider.send_message_stream(messages, {})]
+        assert chunks[-1].startswith("\n[Stream Error:")
+        await provider.close()
+    finally:
+        await server.close()
+
+
+class _CountingProvider(LLMProvider):
+    """离线 Provider：记录上游调用次数，模拟出错时以文本形式返回错误"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.fail = False
+
+    async def init_model(self, model_config) -> bool:
+        self._is_available = True
+        return True
+
+    def get_model_name(self) -> str:
+        return "fake"
+
+    def get_model_desc(self) -> str:
+        return ""
+
+    async def send_message(self, messages, request_param) -> str:
+        self.calls += 1
+        return "Error: upstream down" if self.fail else "侬好呀，我是小沪，欢迎来学上海闲话！"
+
+    async def send_message_stream(self, messages, request_param):
+        self.calls += 1
+        if self.fail:
+            yield "\n[Stream Error: upstream down]"
+            return
+        for ch in "侬好呀，我是小沪，欢迎来学上海闲话！":
+            yield ch
+
+
+# 测试用例 11：验证回复缓存 (LRU + TTL + 持久层 + 流式回放)
+@pytest.mark.asyncio
+async def test_llm_manager_response_cache(tmp_path):
+    dm = DataManager(f"sqlite+aiosqlite:///{tmp_path / 'cache.db'}")
+    await dm.init_database()
+    try:
+        provider = _CountingProvider()
+        manager = LLMManager(ResponseCache(max_entries=2, ttl_seconds=60, store=dm))
+        manager.register_provider("fake", provider)
+        await manager.init_model("fake", {})
+
+        greeting = Message(role="assistant", content="侬好！我是小沪。")
+        messages = [greeting, Message(role="user", content="侬好")]
+        param = {"system_prompt": "你是小沪", "temperature": 0.7, "max_tokens": 256}
+        reply = "侬好呀，我是小沪，欢迎来学上海闲话！"
+
+        # 首次请求回源，相同的请求 (消息 ID 不同也一样) 命中缓存
+        assert await manager.send_message("fake", messages, dict(param)) == reply
+        same = [
+            Message(role="assistant", content="侬好！我是小沪。"),
+            Message(role="user", content="侬好"),
+        ]
+        usage = LLMUsage()
+        assert await manager.send_message("fake", same, {**param, "usage": usage}) == reply
+        assert provider.calls == 1
+        assert usage.model == "fake" and usage.completion_tokens == 0
+
+        # 流式请求命中时按小段回放缓存内容
+        chunks = [c async for c in manager.send_message_stream("fake", messages, dict(param))]
+        assert provider.calls == 1
+        assert len(chunks) > 1 and "".join(chunks) == reply
+
+        # 任一参数不同都不会命中；显式关闭缓存时总是回源
+        await manager.send_message("fake", messages, {**param, "temperature": 0.2})
+        await manager.send_message("fake", messages, {**param, "cache": False})
+        assert provider.calls == 3
+
+        # 出错的回复不缓存 (全量与流式)
+        provider.fail = True
+        question = [Message(role="user", content="介绍一下上海话")]
+        await manager.send_message("fake", question, dict(param))
+        [c async for c in manager.send_message_stream("fake", question, dict(param))]
+        provider.fail = False
+        assert await manager.send_message("fake", question, dict(param)) == reply
+        assert provider.calls == 6
+
+        stats = manager.response_cache.stats()
+        assert stats.hits == 2 and stats.entries == 2 and stats.evictions >= 1
+
+        # 重启后 (新的内存层) 从持久层命中；提升回内存时沿用原来的过期时间，不因新的 TTL 延长
+        restarted = LLMManager(ResponseCache(max_entries=2, ttl_seconds=3600, store=dm))
+        restarted.register_provider("fake", provider)
+        await restarted.init_model("fake", {})
+        assert await restarted.send_message("fake", messages, dict(param)) == reply
+        assert provider.calls == 6
+        assert restarted.response_cache.stats().store_hits == 1
+        [(_, expires_at)] = restarted.response_cache._entries.values()
+        assert expires_at <= time.time() + 60
+
+        # 过期后不再命中，并可被清理
+        expired = LLMManager(ResponseCache(max_entries=2, ttl_seconds=0, store=dm))
+        expired.register_provider("fake", provider)
+        await expired.init_model("fake", {})
+        await expired.send_message("fake", [Message(role="user", content="再会")], dict(param))
+        assert await dm.purge_expired_responses(int(time.time())) == 1
+    finally:
+        await dm.engine.dispose()
+
+
+class _SlowProvider(_CountingProvider):
+    """逐字慢速输出的离线 Provider，记录上游流是否被取消"""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = 0
+
+    async def send_message(self, messages, request_param) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return "侬好呀"
+
+    async def send_message_stream(self, messages, request_param):
+        self.calls += 1
+        try:
+            for ch in "侬好呀，我是小沪":
+                await asyncio.sleep(0.01)
+                yield ch
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+# 测试用例 12：验证相同请求的合并 (single-flight)
+@pytest.mark.asyncio
+async def test_llm_manager_single_flight():
+    provider = _SlowProvider()
+    manager = LLMManager(single_flight=True)
+    manager.register_provider("fake", provider)
+    await manager.init_model("fake", {})
+    messages = [Message(role="user", content="侬好")]
+
+    # 全量：5 个并发的相同请求只回源一次
+    replies = await asyncio.gather(
+        *(manager.send_message("fake", messages, {}) for _ in range(5))
+    )
+    assert replies == ["侬好呀"] * 5
+    assert provider.calls == 1
+
+    # 流式：中途加入的订阅者先回放已产生的 chunk；取消其中一个订阅者不影响其他订阅者
+    async def collect():
+        return "".join([c async for c in manager.send_message_stream("fake", messages, {})])
+
+    first = asyncio.create_task(collect())
+    await asyncio.sleep(0.035)
+    late = asyncio.create_task(collect())
+    dropped = asyncio.create_task(collect())
+    await asyncio.sleep(0.02)
+    dropped.cancel()
+    assert await first == "侬好呀，我是小沪"
+    assert await late == "侬好呀，我是小沪"
+    assert dropped.cancelled()
+    assert provider.calls == 2 and provider.cancelled == 0
+
+    # 所有订阅者都离开后才取消上游
+    task = asyncio.create_task(collect())
+    await asyncio.sleep(0.025)
+    task.cancel()
+    await asyncio.sleep(0.02)
+    assert provider.cancelled == 1
+
+    stats = manager.single_flight.stats()
+    assert stats.leaders == 3 and stats.followers == 6
+    assert stats.cancelled == 1 and stats.in_flight == 0
+
+    # 显式关闭缓存的请求不参与合并
+    await asyncio.gather(
+        *(manager.send_message("fake", messages, {"cache": False}) for _ in range(2))
+    )
+    assert provider.calls == 5
+
+
+# 测试用例 13：验证按模型的并发限制与有界等待队列
+@pytest.mark.asyncio
+async def test_llm_manager_concurrency_limit():
+    provider = _SlowProvider()
+    manager = LLMManager()
+    manager.register_provider("fake", provider)
+    await manager.init_model("fake", {})
+    manager.set_concurrency_limit("fake", max_concurrency=1, max_queue_size=1)
+    messages = [Message(role="user", content="侬好")]
+
+    # 1 个执行、1 个排队，第 3 个立即被拒绝并给出 Retry-After
+    first = asyncio.create_task(manager.send_message("fake", messages, {}))
+    second = asyncio.create_task(manager.send_message("fake", messages, {}))
+    await asyncio.sleep(0.01)
+    with pytest.raises(ProviderOverloadedError) as exc_info:
+        manager.check_admission("fake")
+    assert exc_info.value.retry_after >= 1
+    with pytest.raises(ProviderOverloadedError):
+        await manager.send_message("fake", messages, {})
+
+    stats = manager.metrics()["limiters"][0]
+    assert stats["in_flight"] == 1 and stats["queued"] == 1
+    assert await first == "侬好呀" and await second == "侬好呀"
+
+    # 流式请求在整个流期间占用槽位；排队超时同样按过载处理
+    manager.set_concurrency_limit("fake", max_concurrency=1, max_queue_size=4, queue_timeout=0.02)
+    stream = manager.send_message_stream("fake", messages, {})
+    assert await stream.__anext__() == "侬"
+    with pytest.raises(ProviderOverloadedError):
+        await manager.send_message("fake", messages, {})
+    assert "".join([c async for c in stream]) == "好呀，我是小沪"
+    assert await manager.send_message("fake", messages, {}) == "侬好呀"
+
+    stats = manager.metrics()["limiters"][0]
+    assert stats["timed_out"] == 1 and stats["admitted"] == 2
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["max_wait_ms"] >= 0
+
+
+class _RouteProvider(_SlowProvider):
+    """首 token 延迟可配置的离线 Provider，结束时把用量写入 request_param["usage"]"""
+
+    def __init__(self, name: str, first_delay: float, fail: bool = False):
+        super().__init__()
+        self.name = name
+        self.first_delay = first_delay
+        self.fail = fail
+
+    async def send_message_stream(self, messages, request_param):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.first_delay)
+            if self.fail:
+                yield "\n[Stream Error: upstream down]"
+                return
+            for ch in f"{self.name}:侬好":
+                yield ch
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        usage = request_param.get("usage")
+        if usage is not None:
+            usage.model = self.name
+            usage.completion_tokens = 4
+
+
+# 测试用例 14：验证备用路由 (首 token 超时对冲、出错切换、TTFT 统计)
+@pytest.mark.asyncio
+async def test_llm_manager_hedged_route():
+    slow = _RouteProvider("slow", first_delay=0.2)
+    fast = _RouteProvider("fast", first_delay=0.01)
+    manager = LLMManager()
+    for name, provider in [("slow", slow), ("fast", fast)]:
+        manager.register_provider(name, provider)
+        await manager.init_model(name, {})
+    manager.set_route("slow", ["fast"], hedge_after_ms=30)
+    messages = [Message(role="user", content="侬好")]
+
+    # 主模型迟迟没有首 token：对冲到备用模型，取先响应者并取消主模型的请求
+    usage = LLMUsage()
+    chunks = [c async for c in manager.send_message_stream("slow", messages, {"usage": usage})]
+    assert "".join(chunks) == "fast:侬好"
+    assert slow.calls == 1 and slow.cancelled == 1
+    assert usage.model == "fast" and usage.completion_tokens == 4
+
+    # 全量请求同样对冲
+    assert await manager.send_message("slow", messages, {}) == "fast:侬好"
+    assert slow.cancelled == 2
+
+    # 主模型足够快时不会发起对冲
+    slow.first_delay = 0.001
+    assert await manager.send_message("slow", messages, {}) == "slow:侬好"
+    assert fast.calls == 2
+
+    # 主模型出错时立即切换，不等待对冲时限
+    slow.fail = True
+    manager.set_route("slow", ["fast"], hedge_after_ms=0)
+    assert await manager.send_message("slow", messages, {}) == "fast:侬好"
+    assert fast.calls == 3
+
+    # 全部失败时返回最后一个错误
+    fast.fail = True
+    assert (await manager.send_message("slow", messages, {})).startswith("\n[Stream Error:")
+
+    ttft = {s["model_name"]: s for s in manager.metrics()["ttft"]}
+    assert ttft["slow"]["samples"] == 3 and ttft["slow"]["errors"] == 2
+    assert ttft["fast"]["samples"] == 3 and ttft["fast"]["errors"] == 1
+    assert manager.metrics()["routes"][0]["candidates"] == ["slow", "fast"]
+
+
+# 测试用例 15：验证持续慢速的候选被调整到路由末尾，且准入检查考虑备用模型
+@pytest.mark.asyncio
+async def test_llm_manager_route_ordering():
+    slow = _RouteProvider("slow", first_delay=0.05)
+    fast = _RouteProvider("fast", first_delay=0.001)
+    manager = LLMManager()
+    for name, provider in [("slow", slow), ("fast", fast)]:
+        manager.register_provider(name, provider)
+        await manager.init_model(name, {})
+    manager.set_route("slow", ["fast"], hedge_after_ms=20)
+    messages = [Message(role="user", content="侬好")]
+
+    for _ in range(5):
+        assert await manager.send_message("slow", messages, {}) == "fast:侬好"
+    assert slow.calls == 5
+    # 积累足够样本后直接先走备用模型，不再先等主模型超时
+    assert await manager.send_message("slow", messages, {}) == "fast:侬好"
+    assert slow.calls == 5
+
+    # 只有所有候选都已占满时才拒绝
+    manager.set_concurrency_limit("slow", max_concurrency=1)
+    manager.set_concurrency_limit("fast", max_concurrency=1)
+    fast_stream = manager.send_message_stream("fast", messages, {})
+    await fast_stream.__anext__()
+    manager.check_admission("slow")
+    slow_stream = manager.send_message_stream("slow", messages, {})
+    # 路由中 fast 已满，slow 作为第二个候选获得槽位
+    assert await slow_stream.__anext__() == "s"
+    with pytest.raises(ProviderOverloadedError):
+        manager.check_admission("slow")
+    await fast_stream.aclose()
+    await slow_stream.aclose()
+    manager.check_admission("slow")
+
+
+# 测试用例 16：验证熔断器 (连续失败后熔断、快速失败、半开探测后恢复)
+@pytest.mark.asyncio
+async def test_llm_manager_circuit_breaker():
+    provider = _CountingProvider()
+    provider._circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    manager = LLMManager()
+    manager.register_provider("fake", provider)
+    await manager.init_model("fake", {})
+    messages = [Message(role="user", content="侬好")]
+
+    # 连续失败达到阈值后熔断：不再请求上游，也不在模型列表中出现
+    provider.fail = True
+    await manager.send_message("fake", messages, {"cache": False})
+    [c async for c in manager.send_message_stream("fake", messages, {"cache": False})]
+    assert provider.circuit_breaker.state == "open"
+    assert (await manager.send_message("fake", messages, {})).endswith("circuit open.")
+    assert provider.calls == 2
+    assert manager.get_available_models() == []
+
+    # 冷却结束后半开：探测失败重新熔断，探测成功恢复
+    await asyncio.sleep(0.06)
+    assert provider.circuit_breaker.state == "half_open"
+    await manager.send_message("fake", messages, {})
+    assert provider.circuit_breaker.state == "open" and provider.calls == 3
+
+    await asyncio.sleep(0.06)
+    provider.fail = False
+    chunks = [c async for c in manager.send_message_stream("fake", messages, {})]
+    assert "".join(chunks) == "侬好呀，我是小沪，欢迎来学上海闲话！"
+    assert provider.circuit_breaker.state == "closed"
+    assert [m.model_name for m in manager.get_available_models()] == ["fake"]
+
+    stats = manager.metrics()["breakers"][0]
+    assert stats["opened"] == 2 and stats["failures"] == 3 and stats["rejected"] >= 1
+
+
+# 测试用例 17：验证后台健康检查 (节点不可达、API Key 失效时从模型列表中移除)
+@pytest.mark.asyncio
+async def test_llm_manager_health_check():
+    server = FakeOpenAIServer(api_key="sk-good")
+    await server.start()
+    provider = OpenAICompatibleProvider("deepseek", "deepseek-chat")
+    manager = LLMManager()
+    manager.register_provider("deepseek-chat", provider)
+    try:
+        await manager.init_model(
+            "deepseek-chat", {"api_key": "sk-good", "endpoint": server.base_url}
+        )
+        assert await manager.check_health(timeout=2) == {"deepseek-chat": True}
+
+        # API Key 失效
+        server.api_key = "sk-rotated"
+        assert await manager.check_health(timeout=2) == {"deepseek-chat": False}
+        assert manager.get_available_models() == []
+        assert await manager.send_message("deepseek-chat", [], {}) == ""
+
+        # 恢复后重新列出
+        server.api_key = "sk-good"
+        manager.start_health_checks(interval=0.02, timeout=2)
+        await asyncio.sleep(0.1)
+        assert [m.model_name for m in manager.get_available_models()] == ["deepseek-chat"]
+
+        # 节点不可达
+        await server.close()
+        await asyncio.sleep(0.1)
+        assert manager.get_available_models() == []
+    finally:
+        await manager.close()
+        await server.close()
+
+
+# 测试用例 18：litellm 传输层的契约 (Provider 依赖 litellm 内部的 AsyncHTTPHandler 注入连接池，
+# litellm 升级后若注入方式失效，此用例会失败而不是悄悄退回 litellm 自建的连接)
+@pytest.mark.asyncio
+@pytest.mark.parametrize("http2", [True, False])
+async def test_provider_litellm_transport_contract(http2, monkeypatch):
+    if http2 and not http2_available():
+        pytest.skip("h2 is not installed")
+    monkeypatch.setattr(settings, "LLM_HTTP2", http2)
+    server = FakeOpenAIServer(reply="侬好")
+    await server.start()
+    provider = UnifiedLLMProvider(provider_type="deepseek", model_name="deepseek-chat")
+    try:
+        assert await provider.init_model({"api_key": "sk-test", "endpoint": server.base_url})
+        messages = [Message(role="user", content="侬好")]
+        if http2:
+            # handler.client 被替换为本 Provider 的连接池，且 litellm 确实通过它发送请求
+            assert provider._litellm_client.client is provider._http_client
+            sent = []
+
+            async def on_request(request):
+                sent.append(request.url)
+
+            provider._http_client.event_hooks["request"].append(on_request)
+            assert await provider.send_message(messages, {}) == "侬好"
+            assert len(sent) == 1
+        else:
+            # handler 的传输层持有本 Provider 的 aiohttp 会话，发送请求后也没有被替换为新建的会话
+            assert await provider.send_message(messages, {}) == "侬好"
+            transport = provider._litellm_client.client._transport
+            assert isinstance(transport, LiteLLMAiohttpTransport)
+            assert transport.client is provider._aiohttp_session
+    finally:
+        await provider.close()
+        await server.close()
+
+
+# 测试用例 19：由备用模型给出的回复不以主模型的名义写入回复缓存
+@pytest.mark.asyncio
+async def test_llm_manager_fallback_reply_not_cached():
+    primary = _RouteProvider("primary", first_delay=0.001, fail=True)
+    backup = _RouteProvider("backup", first_delay=0.001)
+    manager = LLMManager(ResponseCache(max_entries=8, ttl_seconds=60))
+    for name, provider in [("primary", primary), ("backup", backup)]:
+        manager.register_provider(name, provider)
+        await manager.init_model(name, {})
+    manager.set_route("primary", ["backup"], hedge_after_ms=0)
+    messages = [Message(role="user", content="侬好")]
+
+    # 全量与流式请求都由备用模型回复，均不写入缓存
+    assert await manager.send_message("primary", messages, {}) == "backup:侬好"
+    chunks = [c async for c in manager.send_message_stream("primary", messages, {})]
+    assert "".join(chunks) == "backup:侬好"
+    assert manager.response_cache.stats().entries == 0
+
+    # 主模型恢复后的回复照常缓存，之后的相同请求命中
+    primary.fail = False
+    assert await manager.send_message("primary", messages, {}) == "primary:侬好"
+    assert await manager.send_message("primary", messages, {}) == "primary:侬好"
+    assert primary.calls == 3 and backup.calls == 2
+    assert manager.response_cache.stats().hits == 1
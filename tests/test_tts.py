@@ -0,0 +1,370 @@
+import os
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+from app.core.config import settings
+from app.tts.speech_pipeline import SentenceSplitter, SpeechPipeline
+from app.tts.audio_cache import AudioCache, make_audio_key
+from app.tts.audio_proxy import PROXY_CHUNK_SIZE, fetch_audio, open_audio_stream
+from app.tts.transcoder import AudioTranscoder, ffmpeg_available, negotiate_format
+from app.tts.xiaohu_tts import XiaoHuTTS
+from tests.fake_tts_server import FakeTTSServer, make_wav
+
+
+# 测试用例 1：按句末标点切分流式文本 (短句合并、长句在逗号处切分)
+def test_sentence_splitter():
+    splitter = SentenceSplitter(min_chars=4, max_chars=12)
+    sentences = []
+    for ch in "好！侬好呀，我是小沪。“今朝天气老好额！”阿拉一道去外滩白相，好伐，要么再去城隍庙吃小笼":
+        sentences += splitter.feed(ch)
+    assert sentences == [
+        "好！侬好呀，我是小沪。",
+        "“今朝天气老好额！”",
+        "阿拉一道去外滩白相，好伐，",
+    ]
+    assert splitter.flush() == "要么再去城隍庙吃小笼"
+    assert splitter.flush() is None
+
+
+# 测试用例 2：边生成边合成，限制并发，按句子顺序输出
+@pytest.mark.asyncio
+async def test_speech_pipeline():
+    running = 0
+    peak = 0
+
+    async def synthesize(text: str):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            # 第一句合成得最慢，后面的句子即使先完成也要排在它后面
+            await asyncio.sleep(0.05 if text.startswith("一") else 0.01)
+        finally:
+            running -= 1
+        if "失败" in text:
+            raise RuntimeError("tts down")
+        return f"/audio/{text}"
+
+    pipeline = SpeechPipeline(synthesize, max_parallel=2)
+    pipeline.feed("一句话。")
+    await asyncio.sleep(0.001)
+    pipeline.feed("两句话。合成失败。四句")
+    await asyncio.sleep(0.02)
+    # 第一句还没合成完，后面的句子不能越过它
+    assert pipeline.ready() == []
+    await asyncio.sleep(0.05)
+    ready = pipeline.ready()
+    assert [s.index for s in ready] == [0, 1, 2]
+    assert ready[0].audio_url == "/audio/一句话。" and ready[2].audio_url is None
+
+    # 流出错时错误信息不参与合成；剩余文本在 drain 时提交
+    pipeline.feed("话\n[Stream Error: timeout]")
+    pipeline.feed("不会再合成。")
+    rest = [s async for s in pipeline.drain()]
+    assert [(s.index, s.text) for s in rest] == [(3, "四句话")]
+    assert peak == 2
+
+
+# 测试用例 3：整条回复出错时不合成；关闭时取消未完成的合成
+@pytest.mark.asyncio
+async def test_speech_pipeline_error_and_close():
+    calls = []
+
+    async def synthesize(text: str):
+        calls.append(text)
+        await asyncio.sleep(10)
+
+    pipeline = SpeechPipeline(synthesize)
+    pipeline.feed("Error: Model not available.")
+    assert [s async for s in pipeline.drain()] == [] and calls == []
+
+    pipeline = SpeechPipeline(synthesize)
+    pipeline.feed("侬好呀。再")
+    await asyncio.sleep(0.01)
+    await asyncio.wait_for(pipeline.close(), timeout=1)
+    assert calls == ["侬好呀。"] and pipeline.ready() == []
+
+
+# 测试用例 4：语音磁盘缓存按字节数做 LRU 淘汰，重启后保持淘汰顺序
+@pytest.mark.asyncio
+async def test_audio_cache_lru(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=250)
+    names = [AudioCache.file_name(make_audio_key(t)) for t in ("一", "二", "三")]
+    await cache.put(names[0], b"a" * 100)
+    await cache.put(names[1], b"b" * 100)
+    assert cache.lookup(names[0])  # 一 变为最近使用
+    await cache.put(names[2], b"c" * 100)
+
+    assert cache.get_path(names[1]) is None
+    with open(cache.get_path(names[0]), "rb") as f:
+        assert f.read() == b"a" * 100
+    stats = cache.stats()
+    assert stats.files == 2 and stats.bytes == 200 and stats.evictions == 1
+
+    # 重启：按修改时间恢复顺序，过期的临时文件被清理，其它文件保持不动；预算变小时先淘汰最久未使用的
+    os.utime(tmp_path / names[2], (0, 0))
+    stale = tmp_path / f"{names[1]}.{'0' * 32}.tmp"
+    stale.write_bytes(b"partial")
+    os.utime(stale, (0, 0))
+    fresh = tmp_path / f"{names[1]}.{'1' * 32}.tmp"  # 可能是其它 worker 正在写入的文件
+    fresh.write_bytes(b"partial")
+    (tmp_path / "notes.txt").write_bytes(b"not ours")
+    restarted = AudioCache(str(tmp_path), max_bytes=150)
+    assert restarted.get_path(names[2]) is None
+    assert restarted.get_path(names[0]) is not None
+    assert sorted(os.listdir(tmp_path)) == sorted([names[0], fresh.name, "notes.txt"])
+
+    # 多个 worker 共用目录：超出预算时重新扫描，另一个进程写入的文件也计入预算
+    other = AudioCache(str(tmp_path), max_bytes=150)
+    await other.put(names[1], b"b" * 100)
+    assert sorted(n for n in os.listdir(tmp_path) if AudioCache.is_valid_name(n)) == [names[1]]
+    assert other.stats().bytes == 100
+
+    assert not AudioCache.is_valid_name("../chat.db")
+    assert make_audio_key("侬好", sdp=0.2) != make_audio_key("侬好", sdp=0.3)
+
+
+# 测试用例 5：相同文本只向上游合成一次 (并发请求合并)，参数变化后重新合成
+@pytest.mark.asyncio
+async def test_xiaohu_tts_cache(tmp_path):
+    tts = XiaoHuTTS(AudioCache(str(tmp_path), max_bytes=1 << 20))
+    upstream = []
+
+    async def generate_audio(text):
+        upstream.append(text)
+        await asyncio.sleep(0.01)
+        return None if text == "失败" else f"http://tts/file=/tmp/{len(upstream)}.wav"
+
+    async def fetch_audio(url):
+        return url.encode()
+
+    tts.generate_audio = generate_audio
+    tts._fetch_audio = fetch_audio
+
+    names = await asyncio.gather(*(tts.generate_cached("侬好") for _ in range(3)))
+    assert len(set(names)) == 1 and upstream == ["侬好"]
+    assert await tts.generate_cached("侬好") == names[0]
+    assert upstream == ["侬好"]
+    with open(tts.audio_cache.get_path(names[0]), "rb") as f:
+        assert f.read() == b"http://tts/file=/tmp/1.wav"
+
+    await tts.presynthesize(["再会", "再会", "失败", ""])
+    assert upstream == ["侬好", "再会", "失败"]
+    assert await tts.generate_cached("失败") is None
+
+    tts.speaker = "other"
+    assert await tts.generate_cached("侬好") != names[0]
+    assert upstream[-1] == "侬好"
+    assert tts.audio_cache.stats().hits == 1
+
+
+# 测试用例 6：合成与下载复用长连接，关闭后再次使用会重新建立连接池；
+# 默认合成使用系统代理、下载绕过系统代理 (各用一个连接池)，两者设置相同时共用一个连接池
+@pytest.mark.asyncio
+async def test_xiaohu_tts_connection_reuse(monkeypatch):
+    server = FakeTTSServer(audio=b"RIFF....WAVE")
+    await server.start()
+    tts = XiaoHuTTS()
+    tts.api_base = server.base_url
+    try:
+        assert tts.http_client.trust_env and not tts.audio_client.trust_env
+        await tts.close()
+
+        # 测试环境可能设置了 HTTP(S)_PROXY：都绕过系统代理，合成与下载共用一个连接池
+        monkeypatch.setattr(settings, "TTS_HTTP_TRUST_ENV", False)
+        assert tts.audio_client is tts.http_client
+        for text in ("侬好", "再会"):
+            audio_url = await tts.generate_audio(text)
+            assert await tts._fetch_audio(audio_url) == b"RIFF....WAVE"
+        assert server.synthesized == ["侬好", "再会"]
+        assert server.requests == 4 and server.connections == 1
+
+        await tts.close()
+        assert await tts.generate_audio("侬好") is not None
+        assert server.connections == 2
+    finally:
+        await tts.close()
+        await server.close()
+
+
+# 测试用例 7：音频代理流式转发，支持 Range，按分块发送，客户端断开时关闭上游响应
+@pytest.mark.asyncio
+async def test_audio_proxy_stream():
+    audio = bytes(range(256)) * 1024  # 256 KB
+    server = FakeTTSServer(audio=audio)
+    await server.start()
+    upstream = httpx.AsyncClient(trust_env=False)
+    url = f"{server.base_url}/file=/tmp/gradio/1.wav"
+
+    app = FastAPI()
+
+    @app.get("/proxy")
+    async def proxy(request: Request):
+        return await open_audio_stream(upstream, url, request.headers.get("range"))
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    try:
+        resp = await client.get("/proxy")
+        assert resp.status_code == 200 and resp.content == audio
+        assert resp.headers["content-length"] == str(len(audio))
+        assert resp.headers["accept-ranges"] == "bytes"
+        assert resp.headers["content-type"] == "audio/wav"
+        assert server.last_headers["accept-encoding"] == "identity"
+
+        resp = await client.get("/proxy", headers={"Range": "bytes=4-11"})
+        assert resp.status_code == 206 and resp.content == audio[4:12]
+        assert resp.headers["content-range"] == f"bytes 4-11/{len(audio)}"
+        resp = await client.get("/proxy", headers={"Range": "bytes=-4"})
+        assert resp.content == audio[-4:]
+        resp = await client.get("/proxy", headers={"Range": f"bytes={len(audio)}-"})
+        assert resp.status_code == 416
+        # 每次转发后上游响应都已关闭，连接被复用
+        assert server.connections == 1
+
+        # 按分块发送；客户端中途断开时仍会关闭上游响应
+        response = await open_audio_stream(upstream, url)
+        chunks = []
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                chunks.append(len(message["body"]))
+                if len(chunks) == 2:
+                    raise OSError("client disconnected")
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with pytest.raises(Exception):
+            await response(scope, None, send)
+        assert chunks == [PROXY_CHUNK_SIZE, PROXY_CHUNK_SIZE]
+        assert response.upstream.is_closed
+
+        # 供转码的完整下载有大小上限
+        assert await fetch_audio(upstream, url, max_bytes=len(audio)) == audio
+        assert await fetch_audio(upstream, url, max_bytes=len(audio) - 1) is None
+    finally:
+        await client.aclose()
+        await upstream.aclose()
+        await server.close()
+
+
+# 测试用例 8：按 format 参数或 Accept 头协商音频格式
+def test_negotiate_audio_format():
+    assert negotiate_format(None) == "wav"
+    assert negotiate_format("*/*") == "wav"
+    assert negotiate_format("audio/*;q=0.9, */*;q=0.5") == "wav"
+    assert negotiate_format("audio/webm,audio/ogg,audio/wav,audio/*;q=0.9") == "opus"
+    assert negotiate_format("audio/wav;q=0.5, audio/mpeg") == "mp3"
+    assert negotiate_format("audio/ogg;q=0, audio/mpeg;q=0.8") == "mp3"
+    assert negotiate_format("audio/ogg", "MP3") == "mp3"
+    with pytest.raises(ValueError):
+        negotiate_format(None, "flac")
+
+
+# 测试用例 9：在进程池中转码，结果与源音频一起缓存，同一文件只转码一次
+@pytest.mark.skipif(not ffmpeg_available(), reason="ffmpeg is not installed")
+@pytest.mark.asyncio
+async def test_audio_transcoder(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=1 << 24)
+    key = make_audio_key("侬好")
+    wav = make_wav(seconds=1.0)
+    await cache.put(AudioCache.file_name(key), wav)
+
+    transcoder = AudioTranscoder(max_workers=1)
+    try:
+        names = await asyncio.gather(
+            *(transcoder.cached_variant(cache, key, "opus") for _ in range(3))
+        )
+        assert names == [AudioCache.file_name(key, "opus")] * 3
+        with open(cache.get_path(names[0]), "rb") as f:
+            opus = f.read()
+        assert opus.startswith(b"OggS") and len(opus) < len(wav) / 5
+
+        mp3 = await transcoder.transcode(wav, "mp3")
+        assert mp3 and len(mp3) < len(wav) / 5
+        assert await transcoder.transcode(b"not a wav", "mp3") is None
+        assert await transcoder.cached_variant(cache, make_audio_key("missing"), "mp3") is None
+
+        # 源文件不在缓存中时 (音频代理) 下载后与转码结果一起写入缓存，重复请求不再下载
+        loads = []
+
+        async def load_source():
+            loads.append(1)
+            return wav
+
+        url_key = make_audio_key("http://tts/file=/tmp/1.wav")
+        for _ in range(2):
+            name = await transcoder.cached_variant(cache, url_key, "mp3", load_source)
+            assert name == AudioCache.file_name(url_key, "mp3")
+        assert len(loads) == 1 and cache.get_path(AudioCache.file_name(url_key)) is not None
+
+        async def too_large():
+            return None
+
+        assert await transcoder.cached_variant(cache, make_audio_key("big"), "mp3", too_large) is None
+
+        stats = transcoder.stats()
+        assert stats.transcoded == 3 and stats.failed == 1
+        assert AudioCache.media_type(names[0]) == "audio/ogg"
+    finally:
+        transcoder.close()
+
+
+# 测试用例 10：句子合成完立即穿插输出，不等下一个文本增量；提前关闭时取消上游与合成
+@pytest.mark.asyncio
+async def test_speech_pipeline_interleave():
+    resume = asyncio.Event()
+
+    async def chunks():
+        yield "侬好呀。"
+        yield "再"
+        # 模型停顿：第一句的语音应在停顿期间下发
+        await resume.wait()
+        yield "会。"
+
+    async def synthesize(text: str):
+        await asyncio.sleep(0.01)
+        return f"/audio/{text}"
+
+    pipeline = SpeechPipeline(synthesize)
+    frames = pipeline.interleave(chunks())
+    assert [await anext(frames), await anext(frames)] == ["侬好呀。", "再"]
+    segment = await asyncio.wait_for(anext(frames), timeout=1)
+    assert (segment.index, segment.audio_url) == (0, "/audio/侬好呀。")
+    resume.set()
+    rest = [item async for item in frames]
+    assert rest[0] == "会。" and [(s.index, s.text) for s in rest[1:]] == [(1, "再会。")]
+
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            yield "侬好呀。"
+            await asyncio.sleep(10)
+        finally:
+            closed.set()
+
+    pipeline = SpeechPipeline(synthesize)
+    frames = pipeline.interleave(endless())
+    assert await anext(frames) == "侬好呀。"
+    await frames.aclose()
+    await pipeline.close()
+    assert closed.is_set()
+
+
+# 测试用例 11：多个 worker 共用目录时，另一个进程写入的文件也能命中并加入索引
+@pytest.mark.asyncio
+async def test_audio_cache_shared_dir(tmp_path):
+    writer = AudioCache(str(tmp_path), max_bytes=1000)
+    reader = AudioCache(str(tmp_path), max_bytes=1000)
+    name = AudioCache.file_name(make_audio_key("侬好"))
+    path = await writer.put(name, b"a" * 100)
+
+    assert reader.lookup(name) and reader.get_path(name) == path
+    stats = reader.stats()
+    assert (stats.hits, stats.misses, stats.files, stats.bytes) == (1, 0, 1, 100)
+
+    # 被其它进程淘汰后不再命中，并移出索引
+    os.remove(path)
+    assert reader.get_path(name) is None and reader.stats().files == 0
+    assert not reader.lookup(AudioCache.file_name(make_audio_key("再会")))